@@ -0,0 +1,39 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+ASGI config for bmcodelab project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+'''
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bmcodelab.settings')
+
+django_application = get_asgi_application()
+
+# Imported once Django is set up, it loads the models.
+from bopis.asgi import route_webhooks  # pylint: disable=wrong-import-position
+from bopis.warmup import warm_up_on_startup  # pylint: disable=wrong-import-position
+
+# Webhooks post their replies asynchronously, see bopis/asgi.py.
+application = route_webhooks(django_application)
+
+warm_up_on_startup()
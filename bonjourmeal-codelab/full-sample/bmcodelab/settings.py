@@ -63,6 +63,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bopis.middleware.RequestMetricsMiddleware',
+    'bopis.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,6 +74,25 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# The webhooks Business Messages and Stripe post to go through this shorter
+# chain instead, see bopis/handlers.py. They need no sessions, CSRF
+# protection, users, messages or frame options, and are resolved against
+# BOPIS_WEBHOOK_URLCONF, which only holds them.
+BOPIS_WEBHOOK_PATHS = ['/callback/', '/bopis/stripe-webhook']
+BOPIS_WEBHOOK_URLCONF = 'bmcodelab.webhook_urls'
+BOPIS_WEBHOOK_MIDDLEWARE = [
+    'bopis.middleware.RequestMetricsMiddleware',
+    'bopis.middleware.ProfilingMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+]
+
+# Under ASGI the webhooks post their replies with an async HTTP client, see
+# bopis/asgi.py. It keeps at most BOPIS_ASGI_SEND_CONNECTIONS connections to
+# Business Messages open and gives up on a post after
+# BOPIS_ASGI_SEND_TIMEOUT seconds.
+BOPIS_ASGI_SEND_CONNECTIONS = 100
+BOPIS_ASGI_SEND_TIMEOUT = 10.0
+
 ROOT_URLCONF = 'bmcodelab.urls'
 
 TEMPLATES = [
@@ -90,6 +111,17 @@ TEMPLATES = [
     },
 ]
 
+if os.getenv('GAE_APPLICATION', None):
+    # Running on production App Engine, so compile each template once per
+    # instance instead of on every render.
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'bmcodelab.wsgi.application'
 
 # [START db_setup]
@@ -122,8 +154,148 @@ else:
             'PASSWORD': 'bmdbpassword',
         }
     }
+
+if os.getenv('BOPIS_USE_SQLITE', None):
+    # Lightweight local setup that needs no MySQL server. Set
+    # BOPIS_SQLITE_REPLICA to a second database file to exercise the read
+    # replica router against two local SQLite databases.
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        }
+    }
+    if os.getenv('BOPIS_SQLITE_REPLICA', None):
+        DATABASES['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('BOPIS_SQLITE_REPLICA'),
+            'TEST': {'MIRROR': 'default'},
+        }
+elif os.getenv('BOPIS_REPLICA_HOST', None):
+    # A Cloud SQL read replica for menu and cart display reads.
+    DATABASES['replica'] = dict(DATABASES['default'],
+        HOST=os.getenv('BOPIS_REPLICA_HOST'),
+        TEST={'MIRROR': 'default'})
+
+if not os.getenv('BOPIS_USE_SQLITE', None):
+    # Keep MySQL connections open across requests for BOPIS_CONN_MAX_AGE
+    # seconds rather than connecting for every request. Connections belong
+    # to a thread, so the one the warmup opens serves the later requests of
+    # its thread, see bopis/warmup.py.
+    for database in DATABASES.values():
+        database['CONN_MAX_AGE'] = int(os.getenv('BOPIS_CONN_MAX_AGE', '60'))
 # [END db_setup]
 
+# The default cache. Set BOPIS_MEMCACHED_HOSTS to a comma separated list of
+# memcached host:port (Memorystore) to share it between instances, which the
+# read replica requires. The local SQLite replica shares a cache directory.
+if os.getenv('BOPIS_MEMCACHED_HOSTS', None):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.getenv('BOPIS_MEMCACHED_HOSTS').split(','),
+        }
+    }
+elif os.getenv('BOPIS_SQLITE_REPLICA', None):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(BASE_DIR, '.cache'),
+        }
+    }
+
+# Read-only menu and cart display queries go to the 'replica' alias when it is
+# defined. A conversation that writes is pinned to the primary for
+# BOPIS_REPLICA_STICKY_SECONDS so it always reads its own writes. The pin is
+# kept in the default cache, which then has to be shared by every instance.
+DATABASE_ROUTERS = ['bopis.routers.ReadReplicaRouter']
+BOPIS_REPLICA_DATABASE = 'replica'
+BOPIS_REPLICA_STICKY_SECONDS = 10
+
+# Shopping cart backend, see bopis/cart_store.py. One of
+# bopis.cart_store.OrmCartStore, bopis.cart_store.DatastoreCartStore or
+# bopis.cart_store.InMemoryCartStore.
+BOPIS_CART_STORE = 'bopis.cart_store.OrmCartStore'
+
+# Stripe checkout sessions are cached per cart version, see bopis/checkout.py.
+# A cached session is replaced once it expires in less than this many seconds.
+BOPIS_CHECKOUT_SESSION_MIN_TTL = 300
+
+# Sales tax charged at checkout, see bopis/money.py.
+BOPIS_TAX_RATE = '0.09025'
+
+# How long the rendered cart on the checkout page is cached per cart version.
+BOPIS_CHECKOUT_FRAGMENT_SECONDS = 600
+
+# Signing secret of the Stripe webhook endpoint /bopis/stripe-webhook that
+# records completed payments, shown in the Stripe dashboard as whsec_...
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET',
+    'YOUR_STRIPE_WEBHOOK_SECRET_HERE')
+
+# Business Messages API endpoint, empty for the real API. Pointing it at a
+# local stand-in, e.g. the one `manage.py loadgen` serves, sends messages
+# there without credentials.
+BOPIS_BUSINESS_MESSAGES_URL = os.getenv('BOPIS_BUSINESS_MESSAGES_URL', '')
+
+# Request profiling, see bopis/profiling.py. Off while BOPIS_PROFILE_DIR is
+# empty. A random BOPIS_PROFILE_SAMPLE_RATE fraction of requests has its
+# stack sampled every BOPIS_PROFILE_INTERVAL seconds, and a request with an
+# X-Bopis-Profile header equal to BOPIS_PROFILE_TOKEN runs under cProfile.
+# Only the newest BOPIS_PROFILE_KEEP profiles are kept.
+BOPIS_PROFILE_DIR = os.getenv('BOPIS_PROFILE_DIR', '')
+BOPIS_PROFILE_SAMPLE_RATE = float(os.getenv('BOPIS_PROFILE_SAMPLE_RATE', '0'))
+BOPIS_PROFILE_TOKEN = os.getenv('BOPIS_PROFILE_TOKEN', '')
+BOPIS_PROFILE_INTERVAL = 0.005
+BOPIS_PROFILE_KEEP = 200
+
+# Webhook capture for `manage.py replay`, see bopis/capture.py. Off while
+# BOPIS_CAPTURE_DIR is empty. Capture files are rotated at
+# BOPIS_CAPTURE_MAX_BYTES compressed bytes and each process keeps only its
+# newest BOPIS_CAPTURE_KEEP.
+BOPIS_CAPTURE_DIR = os.getenv('BOPIS_CAPTURE_DIR', '')
+BOPIS_CAPTURE_MAX_BYTES = 16 * 1024 * 1024
+BOPIS_CAPTURE_KEEP = 20
+
+# How long the menu carousels are reused before they are read again, see
+# bopis/view_utils.py. Item changes made in the same process drop them at
+# once.
+BOPIS_MENU_CACHE_SECONDS = 60
+
+# /_ah/warmup and /metrics answer App Engine's own requests, whose
+# X-Appengine-* headers can only be trusted on App Engine, and requests with
+# an "Authorization: Bearer" header equal to BOPIS_INTERNAL_TOKEN, e.g. from
+# Prometheus. Everything else gets 403 Forbidden.
+BOPIS_INTERNAL_TOKEN = os.getenv('BOPIS_INTERNAL_TOKEN', '')
+BOPIS_TRUST_APPENGINE_HEADERS = bool(os.getenv('GAE_APPLICATION', None))
+
+# Warm the process up when the WSGI or ASGI application loads, see
+# bopis/warmup.py. On by default on App Engine, which also sends
+# /_ah/warmup to new instances.
+BOPIS_WARMUP_ON_STARTUP = os.getenv('BOPIS_WARMUP_ON_STARTUP',
+    '1' if os.getenv('GAE_APPLICATION', None) else '0') == '1'
+
+# How long a cold import of each module may take after django.setup(), in
+# milliseconds. The tests fail over them, `manage.py importtime` shows where the
+# time goes.
+BOPIS_IMPORT_BUDGETS = {
+    'bopis.views': 40,
+}
+
+# Threads of the pool running background jobs, see bopis/background.py.
+BOPIS_BACKGROUND_WORKERS = 4
+
+# Opening and closing hour of the store in TIME_ZONE by weekday, Monday
+# first, or None for a day it is closed. Pickup times are offered on the
+# hour within these hours.
+BOPIS_BUSINESS_HOURS = [(8, 20)] * 7
+
+# Orders the store can hand out per hourly pickup slot, see bopis/pickup.py.
+# BOPIS_PICKUP_SLOT_CAPACITY_BY_HOUR overrides it for busy hours, e.g.
+# {12: 25, 18: 20}.
+BOPIS_PICKUP_STORE_ID = 'bonjour-meal'
+BOPIS_PICKUP_SLOT_CAPACITY = 10
+BOPIS_PICKUP_SLOT_CAPACITY_BY_HOUR = {}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -34,6 +34,8 @@ from bopis import views as bopis_views
 urlpatterns = [
     path('', bopis_views.landing_placeholder),
     path('callback/', bopis_views.callback),
+    path('metrics', bopis_views.export_metrics),
+    path('_ah/warmup', bopis_views.warmup),
     path('bopis/', include('bopis.urls')),
     path('admin/', admin.site.urls),
 ]
@@ -24,7 +24,13 @@ https://docs.djangoproject.com/en/2.1/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from bopis.handlers import route_webhooks
+from bopis.warmup import warm_up_on_startup
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bmcodelab.settings')
 
-application = get_wsgi_application()
+# Webhooks skip the session, CSRF, auth, messages and clickjacking
+# middleware, see bopis/handlers.py.
+application = route_webhooks(get_wsgi_application())
+
+warm_up_on_startup()
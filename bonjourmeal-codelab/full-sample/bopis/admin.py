@@ -20,9 +20,60 @@ by Django administration.
 from django.contrib import admin
 
 from .models import *
+from .orders import transition_orders
+from .routers import read_replica
 
-admin.site.register(Conversation)
-admin.site.register(Item)
-admin.site.register(ShoppedItem)
-admin.site.register(ShoppingCart)
+class ReplicaListAdmin(admin.ModelAdmin):
+    '''
+    A ModelAdmin that serves its change list from the read replica.
+    '''
+    def changelist_view(self, request, extra_context=None):
+        '''
+        Builds and renders the change list inside read_replica() so that the
+        lazily evaluated result list is also read from the replica. POSTs,
+        i.e. actions and list edits, run against the primary, as the rows
+        they change must not be picked from a replica that lags behind.
+        '''
+        if request.method not in ('GET', 'HEAD'):
+            return super().changelist_view(request, extra_context)
+        with read_replica():
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render'):
+                response.render()
+        return response
 
+class OrderAdmin(ReplicaListAdmin):
+    '''
+    The kitchen's view of orders. Each action moves every selected order on
+    with one UPDATE, skipping orders that are not in the action's state.
+    '''
+    list_display = ('id', 'state', 'pickup_datetime', 'conversation')
+    list_filter = ('state',)
+    ordering = ('pickup_datetime',)
+    actions = ['mark_preparing', 'mark_ready', 'mark_picked_up']
+
+    def _advance(self, request, queryset, from_state):
+        moved = transition_orders(from_state, Order.NEXT_STATE[from_state],
+            order_ids=list(queryset.values_list('id', flat=True)))
+        self.message_user(request, f'{moved} order(s) marked '
+            f'{dict(Order.STATE_CHOICES)[Order.NEXT_STATE[from_state]].lower()}.')
+
+    def mark_preparing(self, request, queryset):
+        self._advance(request, queryset, Order.PAID)
+    mark_preparing.short_description = 'Mark paid orders as preparing'
+
+    def mark_ready(self, request, queryset):
+        self._advance(request, queryset, Order.PREPARING)
+    mark_ready.short_description = 'Mark preparing orders as ready for pickup'
+
+    def mark_picked_up(self, request, queryset):
+        self._advance(request, queryset, Order.READY)
+    mark_picked_up.short_description = 'Mark ready orders as picked up'
+
+admin.site.register(Conversation, ReplicaListAdmin)
+admin.site.register(Item, ReplicaListAdmin)
+admin.site.register(ShoppedItem, ReplicaListAdmin)
+admin.site.register(ShoppingCart, ReplicaListAdmin)
+admin.site.register(StripeEvent, ReplicaListAdmin)
+admin.site.register(PickupSlot, ReplicaListAdmin)
+admin.site.register(Order, OrderAdmin)
@@ -0,0 +1,176 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Native ASGI handling of the webhooks. route_webhooks sends the paths in
+BOPIS_WEBHOOK_PATHS to a WebhookASGIHandler, which runs them through the
+lean chain of bopis/handlers.py and everything else to Django's
+ASGIHandler.
+
+Django 3.0 has neither async views nor an async ORM, so the view still runs
+synchronously, in a thread of the event loop's executor. It does not need
+the single thread sync_to_async keeps for Django code by default, which
+would have the webhooks wait on each other, as every view closes its own
+database connections. What it no longer does is wait on Business Messages
+there: send_message queues the replies, see view_utils.queue_messages, and
+the handler posts them with an aiohttp ClientSession once the view returns,
+before it answers the webhook. A conversation waiting on its replies holds a
+coroutine rather than a worker thread, so one process holds as many of them
+as BOPIS_ASGI_SEND_CONNECTIONS lets it post to at once. Messages sent by background jobs, e.g. payment
+confirmations, are still posted synchronously from their own threads.
+
+Requires the aiohttp package and an ASGI server, app.yaml runs
+
+    gunicorn -k uvicorn.workers.UvicornWorker bmcodelab.asgi:application
+
+The bench_asgi command compares it with the WSGI deployment.
+'''
+
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+from django.http import HttpResponseServerError
+
+from . import metrics
+from .handlers import WebhookHandlerMixin
+from .sdk import bm_client, encoding
+from .view_utils import get_credentials, queue_messages
+
+logger = logging.getLogger(__name__)
+
+_session = None
+
+def _get_session():
+    # Called on the event loop, which the session is bound to.
+    global _session
+    if _session is None:
+        # Imported here so WSGI deployments do not need aiohttp.
+        import aiohttp
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=settings.BOPIS_ASGI_SEND_CONNECTIONS),
+            timeout=aiohttp.ClientTimeout(total=settings.BOPIS_ASGI_SEND_TIMEOUT))
+    return _session
+
+def _get_access_token():
+    # Blocks while the token is refreshed, so it is called in a thread.
+    return get_credentials().get_access_token().access_token
+
+async def close_session():
+    '''
+    Closes the HTTP session's connections, the next post opens new ones.
+    '''
+    global _session
+    if _session is not None:
+        session, _session = _session, None
+        await session.close()
+
+async def post_messages(outbox):
+    '''
+    Posts queued messages to the Business Messages API one after the other,
+    so that they arrive in the order they were sent.
+
+    Args:
+        outbox (list): (message, conversation id) pairs, see
+            view_utils.queue_messages.
+    Raises:
+        aiohttp.ClientError: If a post fails, the later messages are not
+            posted.
+    '''
+    if not outbox:
+        return
+    url = settings.BOPIS_BUSINESS_MESSAGES_URL
+    headers = {'Content-Type': 'application/json'}
+    if not url:
+        url = bm_client.BusinessmessagesV1.BASE_URL
+        token = await sync_to_async(_get_access_token, thread_sensitive=False)()
+        headers['Authorization'] = f'Bearer {token}'
+
+    session = _get_session()
+    # send_message counted the messages when it queued them.
+    with metrics.phase('outbound', calls=0):
+        for message, conversation_id in outbox:
+            async with session.post(
+                    f'{url}v1/conversations/{conversation_id}/messages',
+                    params={'alt': 'json'}, headers=headers,
+                    data=encoding.MessageToJson(message)) as response:
+                response.raise_for_status()
+                await response.read()
+
+class WebhookASGIHandler(WebhookHandlerMixin, ASGIHandler):
+    '''
+    The ASGIHandler route_webhooks sends the webhooks to. Times the
+    request, replies included, for bopis.metrics.
+    '''
+
+    def _get_response_sync(self, request):
+        try:
+            return super().get_response(request)
+        finally:
+            # request_finished fires on the event loop thread, and the
+            # connections are held by this one.
+            close_old_connections()
+
+    async def get_response(self, request):
+        token = metrics.start_request()
+        try:
+            with queue_messages() as outbox:
+                response = await sync_to_async(self._get_response_sync,
+                    thread_sensitive=False)(request)
+            try:
+                await post_messages(outbox)
+            except Exception:
+                logger.exception('Posting %d replies to Business Messages failed',
+                    len(outbox))
+                response = HttpResponseServerError()
+            return response
+        finally:
+            match = request.resolver_match
+            metrics.end_request(token, match.view_name if match else '')
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_session()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+def route_webhooks(application):
+    '''
+    Wraps the project's ASGI application to send the webhooks through a
+    WebhookASGIHandler. Also handles the lifespan protocol, which Django 3.0
+    does not, to close the HTTP session on shutdown. Call it after Django is
+    set up.
+
+    Args:
+        application (ASGIHandler): The usual handler.
+    Returns:
+        An ASGI application.
+    '''
+    paths = frozenset(settings.BOPIS_WEBHOOK_PATHS)
+    webhooks = WebhookASGIHandler()
+
+    async def router(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await _lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['path'] in paths:
+            await webhooks(scope, receive, send)
+        else:
+            await application(scope, receive, send)
+    return router
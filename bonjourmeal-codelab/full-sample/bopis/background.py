@@ -0,0 +1,70 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+A process wide thread pool for work that should not hold up the request that
+triggered it. Jobs get their own database connections, which are closed when
+the job finishes, and failures are logged rather than raised.
+'''
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    '''
+    Returns the shared executor, creating it on first use with
+    BOPIS_BACKGROUND_WORKERS threads.
+
+    Returns:
+        A :ThreadPoolExecutor:.
+    '''
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'BOPIS_BACKGROUND_WORKERS', 4),
+                    thread_name_prefix='bopis-background')
+    return _executor
+
+def _run(function, args, kwargs):
+    try:
+        return function(*args, **kwargs)
+    except Exception:
+        logger.exception('Background job %s failed', function.__name__)
+        raise
+    finally:
+        connections.close_all()
+
+def submit(function, *args, **kwargs):
+    '''
+    Runs a function on the background pool.
+
+    Args:
+        function (callable): The job to run.
+        *args: Positional arguments for the job.
+        **kwargs: Keyword arguments for the job.
+    Returns:
+        A :Future: for the job's result.
+    '''
+    return get_executor().submit(_run, function, args, kwargs)
@@ -0,0 +1,168 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Capture of webhook traffic for replaying it later with `manage.py replay`.
+While BOPIS_CAPTURE_DIR is set, capture_webhook has the callback append
+every payload it receives to a gzipped JSON lines file in that directory, one record per
+line:
+
+    {"time": "2020-08-01T12:00:00.123456+00:00", "body": "<raw payload>",
+     "command": "add_to_cart", "seconds": 0.012, "messages": 1,
+     "error": null}
+
+Each process writes its own file and starts a new one once the current one
+holds BOPIS_CAPTURE_MAX_BYTES compressed bytes. Each process keeps only its
+newest BOPIS_CAPTURE_KEEP files and leaves the files of other processes
+alone, as they may still be writing to them. Every record is flushed as it
+is written, so a process that dies loses nothing but the end of the gzip
+stream, which read_records tolerates. Failing to write a record is logged,
+the request is handled all the same.
+
+Payloads hold what users typed, so captures are as sensitive as the
+conversations themselves.
+'''
+
+import functools
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+FILE_PATTERN = 'capture-*.jsonl.gz'
+
+_lock = threading.Lock()
+_file = None
+
+def _open_file(directory):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory,
+        f'capture-{timezone.now():%Y%m%dT%H%M%S.%f}-{os.getpid()}.jsonl.gz')
+    return gzip.open(path, 'ab')
+
+def _prune(directory, keep, current):
+    # Only the files of this process, which has closed all but the current one.
+    pattern = os.path.join(directory, f'capture-*-{os.getpid()}.jsonl.gz')
+    for path in sorted(glob.glob(pattern))[:-keep]:
+        if path == current:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def append(record):
+    '''
+    Appends a record to the capture file of this process, rotating it when
+    it is full.
+
+    Args:
+        record (dict): The record, see the module docstring.
+    '''
+    global _file
+    directory = settings.BOPIS_CAPTURE_DIR
+    line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf8')
+    with _lock:
+        if _file is not None and (os.path.dirname(_file.name) != directory
+                or _file.fileobj.tell() >= settings.BOPIS_CAPTURE_MAX_BYTES):
+            _file.close()
+            _file = None
+        if _file is None:
+            _file = _open_file(directory)
+            _prune(directory, settings.BOPIS_CAPTURE_KEEP, _file.name)
+        _file.write(line)
+        _file.flush()
+
+def close():
+    '''
+    Closes the capture file of this process, the next record starts a new
+    one.
+    '''
+    global _file
+    with _lock:
+        if _file is not None:
+            _file.close()
+            _file = None
+
+def capture_webhook(view):
+    '''
+    Decorates the webhook view to record every POST it handles, with the
+    command it was routed to, how long it took and how many messages it
+    posted, while BOPIS_CAPTURE_DIR is set.
+
+    Args:
+        view (function): The view.
+    Returns:
+        The decorated view.
+    '''
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.BOPIS_CAPTURE_DIR or request.method != 'POST':
+            return view(request, *args, **kwargs)
+
+        received = timezone.now()
+        started = time.perf_counter()
+        error = None
+        try:
+            return view(request, *args, **kwargs)
+        except Exception as exception:
+            error = type(exception).__name__
+            raise
+        finally:
+            try:
+                append({
+                    'time': received.isoformat(),
+                    'body': request.body.decode('utf8', 'replace'),
+                    'command': metrics.get_command(),
+                    'seconds': round(time.perf_counter() - started, 6),
+                    'messages': metrics.get_calls('outbound'),
+                    'error': error,
+                })
+            except OSError as exception:
+                logger.warning('Could not capture a payload in %s: %s',
+                    settings.BOPIS_CAPTURE_DIR, exception)
+    return wrapper
+
+def read_records(paths):
+    '''
+    Reads capture files, including ones still being written.
+
+    Args:
+        paths (list): Capture files.
+    Returns:
+        A :list: of records of all the files, oldest first.
+    '''
+    records = []
+    for path in paths:
+        with gzip.open(path, 'rt', encoding='utf8') as capture:
+            try:
+                for line in capture:
+                    if line.endswith('\n'):
+                        records.append(json.loads(line))
+            except (EOFError, zlib.error):
+                # The process writing it is still running or died.
+                pass
+    records.sort(key=lambda record: record['time'])
+    return records
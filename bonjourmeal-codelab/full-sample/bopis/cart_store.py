@@ -0,0 +1,467 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Pluggable shopping cart storage. Views talk to the CartStore interface and the
+backend is picked per deployment with the BOPIS_CART_STORE setting:
+
+    bopis.cart_store.OrmCartStore        Conversation/ShoppingCart/ShoppedItem rows
+    bopis.cart_store.DatastoreCartStore  one Datastore entity per conversation
+    bopis.cart_store.InMemoryCartStore   process local, for tests and benchmarks
+
+bopis/tests/test_cart_store.py runs the same conformance tests against every
+backend, Datastore through bopis.stubs.FakeDatastoreClient, and `manage.py
+bench_cart_stores` times them.
+'''
+
+import collections
+import functools
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Conversation, ShoppedItem, ShoppingCart
+
+# Attempts made before a contended Datastore cart update gives up, and the
+# longest random wait before the first retry, doubled on every retry.
+MAX_TRANSACTION_ATTEMPTS = 10
+TRANSACTION_BACKOFF_SECONDS = 0.01
+
+CartLine = collections.namedtuple('CartLine', ['item_id', 'quantity'])
+
+class CartSummary(collections.namedtuple('CartSummary', ['lines', 'modified'],
+        defaults=[None])):
+    '''
+    An immutable view of a cart: CartLine tuples ordered by item id, and the
+    aware datetime the cart last changed, None for an empty cart.
+    '''
+    __slots__ = ()
+
+    @property
+    def item_count(self):
+        '''
+        The total number of units in the cart.
+        '''
+        return sum(line.quantity for line in self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+def _summary_from_quantities(quantities, modified=None):
+    '''
+    Builds a CartSummary from an item id to quantity mapping.
+    '''
+    lines = tuple(CartLine(item_id, quantity)
+        for item_id, quantity in sorted(quantities.items()) if quantity > 0)
+    return CartSummary(lines, modified if lines else None)
+
+class CartStore:
+    '''
+    The interface every shopping cart backend implements. Carts are addressed
+    by conversation id and hold quantities keyed by Item id.
+    '''
+
+    def add(self, conversation_id, item_id, quantity=1):
+        '''
+        Adds units of an item to the conversation's cart.
+
+        Args:
+            conversation_id (str): The unique id for this user and agent.
+            item_id (int): The id of the Item to add.
+            quantity (int): How many units to add.
+        '''
+        raise NotImplementedError
+
+    def add_many(self, conversation_id, quantities):
+        '''
+        Adds units of several items to the conversation's cart at once, e.g.
+        to reorder a past cart. Backends override it to batch the writes.
+
+        Args:
+            conversation_id (str): The unique id for this user and agent.
+            quantities (dict): How many units to add, keyed by item id.
+        '''
+        for item_id, quantity in quantities.items():
+            self.add(conversation_id, item_id, quantity)
+
+    def remove(self, conversation_id, item_id, quantity=1):
+        '''
+        Removes units of an item from the conversation's cart. Removing more
+        units than the cart holds drops the item.
+
+        Args:
+            conversation_id (str): The unique id for this user and agent.
+            item_id (int): The id of the Item to remove.
+            quantity (int): How many units to remove, None for all of them.
+        '''
+        raise NotImplementedError
+
+    def get_summary(self, conversation_id):
+        '''
+        Reads the conversation's cart.
+
+        Args:
+            conversation_id (str): The unique id for this user and agent.
+        Returns:
+            A :CartSummary: that is empty if there is no cart.
+        '''
+        raise NotImplementedError
+
+    def clear(self, conversation_id):
+        '''
+        Removes every item from the conversation's cart.
+
+        Args:
+            conversation_id (str): The unique id for this user and agent.
+        '''
+        raise NotImplementedError
+
+    def get_cart_id(self, conversation_id):
+        '''
+        Identifies the conversation's current cart. The id changes when the
+        backend starts a new cart, e.g. after the old one was purchased.
+
+        Args:
+            conversation_id (str): The unique id for this user and agent.
+        Returns:
+            A :str: cart id.
+        '''
+        return str(conversation_id)
+
+    def start_new_cart(self, conversation):
+        '''
+        Starts the conversation over with an empty cart. The ShoppingCart,
+        which holds the pickup details, is archived through
+        Conversation.create_new_cart, abandoned unless it was purchased, and
+        the items are removed.
+
+        Args:
+            conversation (Conversation): The conversation done with its cart.
+        '''
+        conversation.create_new_cart()
+        self.clear(conversation.id)
+
+    def save_items(self, conversation_id, cart):
+        '''
+        Copies the conversation's items into ShoppedItem rows of a
+        ShoppingCart, so the order made from it lists them.
+
+        Args:
+            conversation_id (str): The unique id for this user and agent.
+            cart (ShoppingCart): The cart being purchased.
+        '''
+        now = timezone.now()
+        ShoppedItem.objects.bulk_create([ShoppedItem(cart=cart,
+            item_id=item_id, quantity=quantity, cart_placement_timestamp=now,
+            modified_timestamp=now)
+            for item_id, quantity in self.snapshot(conversation_id).items()])
+
+    def snapshot(self, conversation_id):
+        '''
+        Copies the conversation's cart.
+
+        Args:
+            conversation_id (str): The unique id for this user and agent.
+        Returns:
+            A :dict: of quantities keyed by item id, detached from the store.
+        '''
+        return {line.item_id: line.quantity
+            for line in self.get_summary(conversation_id).lines}
+
+class OrmCartStore(CartStore):
+    '''
+    Stores carts as ShoppedItem rows of the conversation's current
+    ShoppingCart. Quantity changes are single UPDATE statements and clearing
+    a cart archives it through Conversation.create_new_cart. Every row keeps
+    when it last changed and the cart when a row was last deleted, which
+    dates the contents without another write per change.
+    '''
+
+    @staticmethod
+    def _get_cart_id(conversation_id):
+        return Conversation.objects.filter(id=conversation_id).values_list(
+            'shopping_cart_id', flat=True).first()
+
+    @staticmethod
+    def _create_cart(conversation_id):
+        # What Conversation.create_new_cart does for a conversation without a
+        # cart, in two statements instead of four.
+        cart = ShoppingCart.objects.create()
+        if Conversation.objects.filter(id=conversation_id,
+                shopping_cart__isnull=True).update(shopping_cart=cart):
+            return cart.id
+        try:
+            with transaction.atomic():
+                Conversation.objects.create(id=conversation_id, shopping_cart=cart)
+            return cart.id
+        except IntegrityError:
+            # A concurrent request created the conversation or its cart first.
+            # The locking read waits for it and sees its row.
+            cart.delete()
+            return Conversation.objects.select_for_update().filter(
+                id=conversation_id).values_list('shopping_cart_id', flat=True).get()
+
+    def get_cart_id(self, conversation_id):
+        return f'{conversation_id}/{self._get_cart_id(conversation_id)}'
+
+    def add(self, conversation_id, item_id, quantity=1):
+        with transaction.atomic():
+            cart_id = self._get_cart_id(conversation_id)
+            if cart_id is None:
+                cart_id = self._create_cart(conversation_id)
+            elif self._top_up(cart_id, item_id, quantity):
+                return
+            try:
+                now = timezone.now()
+                with transaction.atomic():
+                    ShoppedItem.objects.create(cart_id=cart_id, item_id=item_id,
+                        quantity=quantity, cart_placement_timestamp=now,
+                        modified_timestamp=now)
+            except IntegrityError:
+                # A concurrent add inserted the item since the UPDATE found none.
+                self._top_up(cart_id, item_id, quantity)
+
+    @staticmethod
+    def _top_up(cart_id, item_id, quantity):
+        return ShoppedItem.objects.filter(cart_id=cart_id, item_id=item_id).update(
+            quantity=F('quantity') + quantity, modified_timestamp=timezone.now())
+
+    def add_many(self, conversation_id, quantities):
+        # Items already in the cart are topped up with one UPDATE, the rest
+        # are added with a single bulk INSERT.
+        with transaction.atomic():
+            cart_id = self._get_cart_id(conversation_id)
+            if cart_id is None:
+                cart_id = self._create_cart(conversation_id)
+                in_cart = set()
+            else:
+                in_cart = set(ShoppedItem.objects.filter(cart_id=cart_id,
+                    item_id__in=list(quantities)).values_list('item_id', flat=True))
+            now = timezone.now()
+            if in_cart:
+                ShoppedItem.objects.filter(cart_id=cart_id, item_id__in=in_cart).update(
+                    quantity=F('quantity') + Case(*(When(item_id=item_id,
+                        then=Value(quantities[item_id])) for item_id in in_cart),
+                        output_field=IntegerField()), modified_timestamp=now)
+            added = {item_id: quantity for item_id, quantity in quantities.items()
+                if item_id not in in_cart}
+            try:
+                with transaction.atomic():
+                    ShoppedItem.objects.bulk_create([ShoppedItem(cart_id=cart_id,
+                        item_id=item_id, quantity=quantity,
+                        cart_placement_timestamp=now, modified_timestamp=now)
+                        for item_id, quantity in added.items()])
+            except IntegrityError:
+                # A concurrent add inserted some of them, add them one by one.
+                for item_id, quantity in added.items():
+                    self.add(conversation_id, item_id, quantity)
+
+    def remove(self, conversation_id, item_id, quantity=1):
+        with transaction.atomic():
+            cart_id = self._get_cart_id(conversation_id)
+            if cart_id is None:
+                return
+            now = timezone.now()
+            shopped_items = ShoppedItem.objects.filter(cart_id=cart_id,
+                item_id=item_id)
+            if quantity is not None and shopped_items.filter(
+                    quantity__gt=quantity).update(quantity=F('quantity') - quantity,
+                        modified_timestamp=now):
+                return
+            if shopped_items.delete()[0]:
+                ShoppingCart.objects.filter(id=cart_id).update(
+                    items_removed_timestamp=now)
+
+    def get_summary(self, conversation_id):
+        rows = ShoppedItem.objects.filter(cart__conversation__id=conversation_id
+            ).order_by('item_id').values_list('item_id', 'quantity',
+                'modified_timestamp', 'cart__items_removed_timestamp')
+        lines, modified = [], None
+        for item_id, quantity, *timestamps in rows:
+            lines.append(CartLine(item_id, quantity))
+            # Rows from before the timestamps were kept have none.
+            modified = max(filter(None, [modified, *timestamps]), default=None)
+        return CartSummary(tuple(lines), modified)
+
+    def clear(self, conversation_id):
+        # The old cart is kept as an abandoned past cart rather than deleted.
+        conv = Conversation.objects.filter(id=conversation_id).first()
+        if conv is not None and conv.shopping_cart_id is not None:
+            conv.create_new_cart()
+
+    def start_new_cart(self, conversation):
+        # The items are in the archived cart, the new one starts empty.
+        conversation.create_new_cart()
+
+    def save_items(self, conversation_id, cart):
+        # They are ShoppedItem rows already.
+        pass
+
+class DatastoreCartStore(CartStore):
+    '''
+    Stores each cart as one Google Datastore entity keyed by conversation id,
+    with a property per item id and the time of the last change. Updates run
+    in Datastore transactions.
+    Requires the google-cloud-datastore package.
+    '''
+    kind = 'BopisShoppingCart'
+    # Item ids are digits, so this never names an item.
+    modified_property = 'modified'
+
+    def __init__(self, client=None):
+        # Imported here so deployments using other backends do not need the
+        # Datastore client library.
+        from google.api_core import exceptions
+        from google.cloud import datastore
+        self._contention = (exceptions.Aborted, exceptions.Conflict)
+        self._datastore = datastore
+        self._client = client or datastore.Client()
+
+    def _update(self, conversation_id, update):
+        # Datastore transactions are optimistic, a commit fails when another
+        # request wrote the cart since it was read. Retry from the read.
+        key = self._client.key(self.kind, conversation_id)
+        for attempt in range(MAX_TRANSACTION_ATTEMPTS):
+            try:
+                with self._client.transaction():
+                    cart = self._client.get(key) or self._datastore.Entity(key=key)
+                    update(cart)
+                    cart[self.modified_property] = timezone.now()
+                    self._client.put(cart)
+                return
+            except self._contention:
+                if attempt == MAX_TRANSACTION_ATTEMPTS - 1:
+                    raise
+                time.sleep(random.uniform(0, TRANSACTION_BACKOFF_SECONDS * 2 ** attempt))
+
+    def add(self, conversation_id, item_id, quantity=1):
+        def add_quantity(cart):
+            cart[str(item_id)] = cart.get(str(item_id), 0) + quantity
+        self._update(conversation_id, add_quantity)
+
+    def add_many(self, conversation_id, quantities):
+        def add_quantities(cart):
+            for item_id, quantity in quantities.items():
+                cart[str(item_id)] = cart.get(str(item_id), 0) + quantity
+        self._update(conversation_id, add_quantities)
+
+    def remove(self, conversation_id, item_id, quantity=1):
+        def remove_quantity(cart):
+            remaining = 0 if quantity is None else cart.get(str(item_id), 0) - quantity
+            if remaining > 0:
+                cart[str(item_id)] = remaining
+            else:
+                cart.pop(str(item_id), None)
+        self._update(conversation_id, remove_quantity)
+
+    def get_summary(self, conversation_id):
+        cart = self._client.get(self._client.key(self.kind, conversation_id)) or {}
+        return _summary_from_quantities({int(item_id): quantity
+            for item_id, quantity in cart.items() if item_id.isdigit()},
+            cart.get(self.modified_property))
+
+    def clear(self, conversation_id):
+        self._client.delete(self._client.key(self.kind, conversation_id))
+
+class InMemoryCartStore(CartStore):
+    '''
+    A process local store for tests and benchmarks. Each cart is a dict of
+    quantities keyed by item id, changed under one lock so concurrent writers
+    never lose an update.
+
+    The store is not lock free. Every operation on every cart takes the same
+    threading.Lock, so concurrent requests wait on each other. An earlier
+    lock-free version appended changes to a log per cart, but its reads grew
+    with the cart's history. The lock is held for a few dict operations, far
+    less time than the other backends spend on a round trip.
+    '''
+
+    def __init__(self):
+        self._carts = {}
+        self._modified = {}
+        self._lock = threading.Lock()
+
+    def _change(self, conversation_id, item_id, delta):
+        self._modified[conversation_id] = timezone.now()
+        cart = self._carts.setdefault(conversation_id, {})
+        quantity = 0 if delta is None else cart.get(item_id, 0) + delta
+        if quantity > 0:
+            cart[item_id] = quantity
+        else:
+            cart.pop(item_id, None)
+
+    def add(self, conversation_id, item_id, quantity=1):
+        with self._lock:
+            self._change(conversation_id, item_id, quantity)
+
+    def add_many(self, conversation_id, quantities):
+        with self._lock:
+            for item_id, quantity in quantities.items():
+                self._change(conversation_id, item_id, quantity)
+
+    def remove(self, conversation_id, item_id, quantity=1):
+        with self._lock:
+            self._change(conversation_id, item_id,
+                None if quantity is None else -quantity)
+
+    def get_summary(self, conversation_id):
+        with self._lock:
+            quantities = dict(self._carts.get(conversation_id, {}))
+            modified = self._modified.get(conversation_id)
+        return _summary_from_quantities(quantities, modified)
+
+    def clear(self, conversation_id):
+        with self._lock:
+            self._carts.pop(conversation_id, None)
+            self._modified.pop(conversation_id, None)
+
+def get_shopping_cart_id(conversation_id):
+    '''
+    Identifies the conversation's ShoppingCart, which holds the pickup details
+    and, once paid, the order's items whichever CartStore is configured.
+    Creates the conversation and its cart if needed, concurrent callers get
+    the same cart.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+    Returns:
+        An :int: ShoppingCart id.
+    '''
+    with transaction.atomic():
+        cart_id = OrmCartStore._get_cart_id(conversation_id)
+        if cart_id is None:
+            cart_id = OrmCartStore._create_cart(conversation_id)
+        return cart_id
+
+@functools.lru_cache(maxsize=None)
+def _load_store(path):
+    return import_string(path)()
+
+def get_cart_store():
+    '''
+    Returns the process wide CartStore configured by BOPIS_CART_STORE.
+
+    Returns:
+        A :CartStore: instance, OrmCartStore if the setting is absent.
+    '''
+    return _load_store(getattr(settings, 'BOPIS_CART_STORE',
+        'bopis.cart_store.OrmCartStore'))
@@ -0,0 +1,256 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Stripe checkout sessions, reused per cart version. Creating a session costs a
+Stripe round trip, so the session made for a cart is cached together with the
+version of the cart's contents it was made for. Pressing Checkout again, or
+reloading the page, reuses it until the cart changes or the session gets close
+to expiring. The create call carries an idempotency key derived from the same
+version, so concurrent clicks that both miss the cache get the same session.
+
+Once the user confirms their pickup details the session is created in the
+background, so by the time they press Checkout it is usually already cached.
+'''
+
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import background, metrics
+from .cart_store import get_cart_store, get_shopping_cart_id
+from .money import cart_totals
+from .sdk import stripe
+from .view_constants import DOMAIN
+from .view_utils import get_cart_entries, get_cart_fingerprint
+
+CHECKOUT_CACHE_KEY_PREFIX = 'bopis:checkout-session:'
+
+# Used when the Stripe API version does not report expires_at. Checkout
+# sessions expire 24 hours after they are created.
+DEFAULT_SESSION_LIFETIME = 24 * 60 * 60
+
+CheckoutSession = namedtuple('CheckoutSession',
+    ['id', 'expires_at', 'version', 'prefetched'])
+
+class CheckoutSessionStats:
+    '''
+    Counts how checkout session lookups were served in this process.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''
+        Sets every counter back to zero.
+        '''
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.changed = 0
+            self.expired = 0
+            self.prefetched = 0
+            self.prefetch_hits = 0
+
+    def record(self, outcome):
+        '''
+        Counts one event.
+
+        Args:
+            outcome (str): A lookup outcome, one of hits, misses, changed or
+                expired, or prefetched for a session made in the background
+                and prefetch_hits for a hit on such a session.
+        '''
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    @property
+    def hit_rate(self):
+        '''
+        The share of checkout clicks served from the cache, 0 if there were
+        none.
+        '''
+        total = self.hits + self.misses + self.changed + self.expired
+        return self.hits / total if total else 0.0
+
+    def as_dict(self):
+        '''
+        Returns the counters and the hit rate.
+        '''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                'changed': self.changed, 'expired': self.expired,
+                'prefetched': self.prefetched,
+                'prefetch_hits': self.prefetch_hits,
+                'hit_rate': self.hit_rate}
+
+stats = CheckoutSessionStats()
+
+def build_session_params(conversation_id, cart_id, cart_entries, domain,
+        shopping_cart_id):
+    '''
+    Builds the arguments of stripe.checkout.Session.create for a cart. The
+    conversation and cart ids travel in the session metadata so the
+    checkout.session.completed webhook can find the cart that was paid for.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+        cart_id (str): The CartStore id of the cart being paid for.
+        cart_entries (list): CartEntry objects from get_cart_entries.
+        domain (str): The scheme and host Stripe sends the user back to.
+        shopping_cart_id (int): The ShoppingCart the purchase is recorded on.
+    Returns:
+        A :dict: of keyword arguments for the Stripe call.
+    '''
+    totals = cart_totals(cart_entries)
+
+    return {
+        'payment_method_types': ['card'],
+        'line_items': [{
+            'price_data': {
+                'currency': 'usd',
+                'product_data': {
+                    'name': 'Bonjour Meal Purchase',
+                },
+                'unit_amount': totals.total,
+            },
+            'quantity': 1,
+        }],
+        'mode': 'payment',
+        'client_reference_id': conversation_id,
+        'metadata': {
+            'conversation_id': conversation_id,
+            'cart_id': cart_id,
+            'shopping_cart_id': str(shopping_cart_id),
+        },
+        'success_url': domain+'/bopis/checkout_success?conversation_id='+conversation_id,
+        'cancel_url': domain+'/bopis/checkout_failure?conversation_id='+conversation_id,
+    }
+
+def get_cart_version(cart_entries, session_params):
+    '''
+    Fingerprints the cart contents and the session they would be charged in.
+
+    Args:
+        cart_entries (list): CartEntry objects from get_cart_entries.
+        session_params (dict): The output of build_session_params.
+    Returns:
+        A :str: that changes whenever the items, quantities, prices or
+        session parameters change.
+    '''
+    return get_cart_fingerprint(cart_entries, session_params)
+
+def _cache_key(cart_id):
+    return CHECKOUT_CACHE_KEY_PREFIX + cart_id
+
+def get_checkout_session(conversation_id, domain):
+    '''
+    Returns a Stripe checkout session for the conversation's cart, creating
+    one only if the cached session is missing, made for different contents
+    or about to expire.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+        domain (str): The scheme and host Stripe sends the user back to.
+    Returns:
+        A :CheckoutSession:, or None if the cart is empty.
+    '''
+    return _get_or_create_session(conversation_id, domain, prefetch=False)
+
+def prefetch_checkout_session(conversation_id, domain=DOMAIN):
+    '''
+    Creates and caches the conversation's checkout session in the background
+    so that pressing Checkout does not wait on Stripe. The session is made
+    for the cart as it is now; if the cart changes before checkout the
+    version no longer matches and the click creates a fresh one.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+        domain (str): The scheme and host Stripe sends the user back to,
+            DOMAIN like the checkout click.
+    Returns:
+        A :Future: for the CheckoutSession.
+    '''
+    return background.submit(_get_or_create_session, conversation_id, domain,
+        prefetch=True)
+
+def _get_or_create_session(conversation_id, domain, prefetch):
+    cart_entries = get_cart_entries(conversation_id)
+    if not cart_entries:
+        return None
+
+    cart_id = get_cart_store().get_cart_id(conversation_id)
+    params = build_session_params(conversation_id, cart_id, cart_entries,
+        domain, get_shopping_cart_id(conversation_id))
+    version = get_cart_version(cart_entries, params)
+
+    cached = cache.get(_cache_key(cart_id))
+    min_ttl = getattr(settings, 'BOPIS_CHECKOUT_SESSION_MIN_TTL', 300)
+    if cached is None:
+        outcome = 'misses'
+    elif cached.version != version:
+        outcome = 'changed'
+    elif cached.expires_at - time.time() <= min_ttl:
+        outcome = 'expired'
+    else:
+        outcome = 'hits'
+
+    if not prefetch:
+        stats.record(outcome)
+        if outcome == 'hits' and cached.prefetched:
+            stats.record('prefetch_hits')
+    if outcome == 'hits':
+        return cached
+
+    # A retried key returns the session Stripe already made for it, so the
+    # key must change when an expiring session of the same version is
+    # replaced.
+    idempotency_key = f'bopis-checkout-{cart_id}-{version}'
+    if cached is not None and cached.version == version:
+        idempotency_key += f'-after-{cached.id}'
+
+    checkout_session = _create_session(idempotency_key, params, version,
+        prefetch)
+    if checkout_session.expires_at - time.time() <= min_ttl:
+        # The key was replayed and the session it made is itself expiring.
+        checkout_session = _create_session(
+            f'{idempotency_key}-after-{checkout_session.id}', params, version,
+            prefetch)
+    if prefetch:
+        stats.record('prefetched')
+
+    cache.set(_cache_key(cart_id), checkout_session,
+        max(1, int(checkout_session.expires_at - time.time())))
+    return checkout_session
+
+def _create_session(idempotency_key, params, version, prefetched):
+    with metrics.phase('stripe'):
+        session = stripe.checkout.Session.create(idempotency_key=idempotency_key,
+            **params)
+    expires_at = session.get('expires_at') or time.time() + DEFAULT_SESSION_LIFETIME
+    return CheckoutSession(session.id, expires_at, version, prefetched)
+
+def invalidate_checkout_session(conversation_id):
+    '''
+    Drops the cached session of the conversation's current cart.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+    '''
+    cache.delete(_cache_key(get_cart_store().get_cart_id(conversation_id)))
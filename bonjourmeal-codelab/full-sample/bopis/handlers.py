@@ -0,0 +1,96 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+A lean request path for the webhooks. Business Messages and Stripe post to
+/callback/ and /bopis/stripe-webhook machine to machine, so the sessions,
+CSRF, authentication, messages and clickjacking middleware in MIDDLEWARE
+only cost them time. route_webhooks sends the paths in BOPIS_WEBHOOK_PATHS
+to a WebhookWSGIHandler, which runs the middleware in
+BOPIS_WEBHOOK_MIDDLEWARE instead and resolves against BOPIS_WEBHOOK_URLCONF,
+and everything else, the admin and the checkout pages included, to the
+usual handler. The bench_webhook_stack command times both. bopis/asgi.py
+does the same for the ASGI application.
+
+The Django test client builds its own handler with the full MIDDLEWARE, so
+requests made through it do not take the lean path.
+'''
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.exception import convert_exception_to_response
+from django.core.handlers.wsgi import WSGIHandler
+from django.utils.module_loading import import_string
+
+class WebhookHandlerMixin:
+    '''
+    Has a Django handler run BOPIS_WEBHOOK_MIDDLEWARE rather than MIDDLEWARE,
+    loaded the way BaseHandler.load_middleware loads MIDDLEWARE, and
+    resolve against BOPIS_WEBHOOK_URLCONF rather than ROOT_URLCONF.
+    '''
+
+    def get_response(self, request):
+        # BaseHandler resolves against request.urlconf when it is set.
+        request.urlconf = settings.BOPIS_WEBHOOK_URLCONF
+        return super().get_response(request)
+
+    def load_middleware(self):
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+
+        handler = convert_exception_to_response(self._get_response)
+        for middleware_path in reversed(settings.BOPIS_WEBHOOK_MIDDLEWARE):
+            middleware = import_string(middleware_path)
+            try:
+                instance = middleware(handler)
+            except MiddlewareNotUsed:
+                continue
+            if instance is None:
+                raise ImproperlyConfigured(f'Middleware factory {middleware_path} returned None.')
+
+            if hasattr(instance, 'process_view'):
+                self._view_middleware.insert(0, instance.process_view)
+            if hasattr(instance, 'process_template_response'):
+                self._template_response_middleware.append(instance.process_template_response)
+            if hasattr(instance, 'process_exception'):
+                self._exception_middleware.append(instance.process_exception)
+            handler = convert_exception_to_response(instance)
+        self._middleware_chain = handler
+
+class WebhookWSGIHandler(WebhookHandlerMixin, WSGIHandler):
+    '''
+    The WSGIHandler route_webhooks sends the webhooks to.
+    '''
+
+def route_webhooks(application):
+    '''
+    Wraps the project's WSGI application to send the webhooks through a
+    WebhookWSGIHandler. Call it after Django is set up.
+
+    Args:
+        application (WSGIHandler): The usual handler.
+    Returns:
+        A WSGI application.
+    '''
+    paths = frozenset(settings.BOPIS_WEBHOOK_PATHS)
+    if not paths:
+        return application
+    webhooks = WebhookWSGIHandler()
+
+    def router(environ, start_response):
+        if environ.get('PATH_INFO') in paths:
+            return webhooks(environ, start_response)
+        return application(environ, start_response)
+    return router
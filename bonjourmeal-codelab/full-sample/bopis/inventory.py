@@ -0,0 +1,200 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Inventory sync engine. Streams an inventory file, diffs it against the Item
+table by sku and applies the difference with bulk statements in a single
+transaction. Items missing from the file are marked unavailable rather than
+deleted so carts that reference them stay intact.
+'''
+
+import json
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import Item
+
+READ_CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 1000
+SYNC_FIELDS = ('menu_type', 'name', 'price', 'currency', 'image_url', 'available')
+CENTS = Decimal('0.01')
+
+SyncReport = namedtuple('SyncReport', ['created', 'updated', 'deactivated',
+    'unchanged', 'parse_seconds', 'apply_seconds'])
+
+def _find_array_start(buffer):
+    '''
+    Finds the opening bracket of the item list, either the top level array or
+    the array stored under the "inventory" key.
+    '''
+    stripped = buffer.lstrip()
+    if stripped.startswith('['):
+        return len(buffer) - len(stripped)
+
+    key_position = buffer.find('"inventory"')
+    if key_position == -1:
+        return None
+    bracket_position = buffer.find('[', key_position)
+    if bracket_position == -1:
+        return None
+    return bracket_position
+
+def iter_inventory(path):
+    '''
+    Yields the entries of an inventory file one at a time without loading the
+    whole document into memory.
+
+    Args:
+        path (str): Path to a JSON file shaped like {"inventory": [...]} or a
+            bare JSON array.
+    Returns:
+        A generator of :dict: entries with prices parsed as Decimal.
+    '''
+    decoder = json.JSONDecoder(parse_float=Decimal)
+
+    with open(path) as json_file:
+        buffer = json_file.read(READ_CHUNK_SIZE)
+        start = _find_array_start(buffer)
+        while start is None:
+            chunk = json_file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                raise ValueError(f'{path} does not contain an inventory list')
+            buffer += chunk
+            start = _find_array_start(buffer)
+
+        position = start + 1
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+
+            if position >= len(buffer) or buffer[position] != ']':
+                try:
+                    entry, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # The next entry straddles the chunk boundary.
+                    chunk = json_file.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        raise
+                    buffer = buffer[position:] + chunk
+                    position = 0
+                    continue
+                yield entry
+            else:
+                return
+
+            if position > READ_CHUNK_SIZE:
+                buffer = buffer[position:]
+                position = 0
+
+def item_from_entry(entry):
+    '''
+    Builds an unsaved Item from an inventory file entry.
+
+    Args:
+        entry (dict): An entry yielded by iter_inventory.
+    Returns:
+        An unsaved :Item: keyed by the entry's sku, or its slugified name.
+    '''
+    return Item(
+        sku=entry.get('sku') or slugify(entry['name']),
+        menu_type=entry.get('menu_type', 'F'),
+        name=entry['name'],
+        price=Decimal(str(entry['price'])).quantize(CENTS),
+        currency=entry.get('currency', 'USD'),
+        image_url=entry['image_url'],
+        available=entry.get('available', True))
+
+def _insert_batch_size(items):
+    '''
+    Caps BATCH_SIZE to what the database backend accepts in one INSERT. Django
+    3.0 does not apply that cap itself when bulk_create gets a batch size.
+    '''
+    fields = [field for field in Item._meta.concrete_fields if not field.primary_key]
+    connection = connections[router.db_for_write(Item)]
+    return max(min(BATCH_SIZE, connection.ops.bulk_batch_size(fields, items)), 1)
+
+def _has_changed(existing, incoming):
+    '''
+    Compares the synced fields of two items.
+    '''
+    for field in SYNC_FIELDS:
+        if getattr(existing, field) != getattr(incoming, field):
+            return True
+    return False
+
+def sync_inventory(path, deactivate_missing=True):
+    '''
+    Synchronises the Item table with an inventory file.
+
+    Args:
+        path (str): Path to the inventory file.
+        deactivate_missing (bool): Mark items that are not in the file as
+            unavailable.
+    Returns:
+        A :SyncReport: with row counts and the time spent in each phase.
+    '''
+    parse_started = time.perf_counter()
+    incoming = {}
+    for entry in iter_inventory(path):
+        item = item_from_entry(entry)
+        incoming[item.sku] = item
+    parse_seconds = time.perf_counter() - parse_started
+
+    apply_started = time.perf_counter()
+    with transaction.atomic():
+        existing = {}
+        for item in Item.objects.only('id', 'sku', *SYNC_FIELDS):
+            existing[item.sku or slugify(item.name)] = item
+
+        now = timezone.now()
+        to_create = []
+        to_update = []
+        for sku, item in incoming.items():
+            current = existing.get(sku)
+            if current is None:
+                to_create.append(item)
+            elif current.sku != sku or _has_changed(current, item):
+                item.pk = current.pk
+                item.modified_timestamp = now
+                to_update.append(item)
+
+        to_deactivate = []
+        if deactivate_missing:
+            to_deactivate = [item.pk for sku, item in existing.items()
+                if sku not in incoming and item.available]
+
+        Item.objects.bulk_create(to_create,
+            batch_size=_insert_batch_size(to_create))
+        # Neither applies auto_now, so modified_timestamp is set here.
+        Item.objects.bulk_update(to_update,
+            ('sku',) + SYNC_FIELDS + ('modified_timestamp',), batch_size=BATCH_SIZE)
+        for i in range(0, len(to_deactivate), BATCH_SIZE):
+            Item.objects.filter(pk__in=to_deactivate[i:i + BATCH_SIZE]).update(
+                available=False, modified_timestamp=now)
+    apply_seconds = time.perf_counter() - apply_started
+
+    return SyncReport(
+        created=len(to_create),
+        updated=len(to_update),
+        deactivated=len(to_deactivate),
+        unchanged=len(incoming) - len(to_create) - len(to_update),
+        parse_seconds=parse_seconds,
+        apply_seconds=apply_seconds)
@@ -0,0 +1,280 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Django management command that compares the ASGI deployment of the webhook
+with the WSGI one when many conversations wait on their replies at once.
+Every round posts --concurrency messages to /callback/ at the same time, each
+from its own conversation and answered with two messages that Business
+Messages takes --api-latency-ms to accept, to
+
+    wsgi  bmcodelab.wsgi's application, with a thread per request in
+          flight the way a threaded WSGI server runs it, or --wsgi-threads
+    asgi  bmcodelab.asgi's application, on one event loop
+
+and reports requests per second, latency, the peak number of threads and
+the peak resident memory over the idle process. Every measurement runs in a
+process of its own, forked once the application is loaded, and the
+Business Messages stand-in in another, so that neither its threads nor
+earlier measurements count. Runs against a fresh test database. Needs Linux
+for /proc and aiohttp for the ASGI deployment.
+
+    python manage.py bench_asgi --concurrency 10 100 1000
+'''
+
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import override_settings
+from django.test.utils import setup_databases, teardown_databases
+from bopis.models import Conversation
+from bopis.stubs import BusinessMessagesStub
+from bopis.view_constants import CMD_SHOW_HOURS
+from .bench_webhook_stack import call, percentile
+
+# Each reply to CMD_SHOW_HOURS is this many messages.
+MESSAGES_PER_REQUEST = 2
+
+def _rss():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+class _PeakSampler:
+    '''
+    Samples the resident memory and the number of threads of the process
+    every millisecond while it is entered, from a thread of its own that
+    does not count.
+    '''
+
+    def __init__(self):
+        self.peak_rss = self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(0.001):
+            self.peak_rss = max(self.peak_rss, _rss())
+            self.peak_threads = max(self.peak_threads, threading.active_count() - 1)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+async def call_asgi(application, path, body):
+    '''
+    Calls an ASGI application the way an ASGI server would.
+
+    Returns:
+        The :int: status code.
+    '''
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    started = {}
+
+    async def receive():
+        return messages.pop() if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            started['status'] = message['status']
+
+    await application({
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'POST',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode('utf8'),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('ascii'))],
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }, receive, send)
+    return started['status']
+
+def _serve_stub(latency, pipe):
+    with BusinessMessagesStub(latency).running() as stub:
+        pipe.send(stub.url)
+        while pipe.recv() == 'count':
+            pipe.send(len(stub.messages))
+
+def _run_wsgi(bodies, rounds, threads):
+    from bmcodelab.wsgi import application
+
+    def timed(body):
+        started = time.perf_counter()
+        status, _, _ = call(application, '/callback/', body)
+        return status, time.perf_counter() - started
+
+    call(application, '/callback/', bodies[0])
+    idle = _rss()
+    results = []
+    with _PeakSampler() as sampler, \
+            ThreadPoolExecutor(max_workers=threads or len(bodies)) as executor:
+        started = time.perf_counter()
+        for _ in range(rounds):
+            results.extend(executor.map(timed, bodies))
+        seconds = time.perf_counter() - started
+    return results, seconds, sampler, idle
+
+def _run_asgi(bodies, rounds):
+    from bmcodelab.asgi import application
+    from bopis.asgi import close_session
+
+    async def timed(body):
+        started = time.perf_counter()
+        status = await call_asgi(application, '/callback/', body)
+        return status, time.perf_counter() - started
+
+    async def run():
+        await timed(bodies[0])
+        idle = _rss()
+        results = []
+        with _PeakSampler() as sampler:
+            started = time.perf_counter()
+            for _ in range(rounds):
+                results.extend(await asyncio.gather(*map(timed, bodies)))
+            seconds = time.perf_counter() - started
+        await close_session()
+        return results, seconds, sampler, idle
+
+    return asyncio.run(run())
+
+def _measure(server, bodies, rounds, threads, url, pipe):
+    with override_settings(BOPIS_BUSINESS_MESSAGES_URL=url), \
+            redirect_stdout(io.StringIO()):
+        if server == 'wsgi':
+            results, seconds, sampler, idle = _run_wsgi(bodies, rounds, threads)
+        else:
+            results, seconds, sampler, idle = _run_asgi(bodies, rounds)
+    latencies = sorted(latency for _, latency in results)
+    pipe.send({
+        'failed': sum(status != 200 for status, _ in results),
+        'requests_per_second': len(results) / seconds,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'threads': sampler.peak_threads,
+        'rss': max(0, sampler.peak_rss - idle),
+    })
+
+class Command(BaseCommand):
+    help = 'Compares the ASGI and WSGI webhook under many conversations in flight'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100, 1000],
+            help='Requests in flight at once, one measurement each.')
+        parser.add_argument('--rounds', type=int, default=3,
+            help='Rounds of requests per measurement.')
+        parser.add_argument('--api-latency-ms', type=float, default=200,
+            help='Time Business Messages takes per message.')
+        parser.add_argument('--wsgi-threads', type=int, default=0,
+            help='Threads of the WSGI server, 0 for one per request in flight.')
+
+    def handle(self, *args, **options):
+
+        if not os.path.exists('/proc/self/statm'):
+            raise CommandError('bench_asgi reads memory use from /proc, run it on Linux.')
+        try:
+            import aiohttp  # pylint: disable=unused-import,import-outside-toplevel
+        except ImportError:
+            raise CommandError('The ASGI deployment needs the aiohttp package.')
+
+        self.failures = 0
+        forking = multiprocessing.get_context('fork')
+        with tempfile.TemporaryDirectory() as directory:
+            for alias in connections:
+                settings_dict = connections[alias].settings_dict
+                if settings_dict['ENGINE'].endswith('sqlite3'):
+                    # Forked processes cannot share an in-memory database.
+                    settings_dict['TEST']['NAME'] = os.path.join(directory,
+                        f'{alias}.sqlite3')
+            old_config = setup_databases(verbosity=0, interactive=False)
+            pipe, stub_pipe = forking.Pipe()
+            stub = forking.Process(target=_serve_stub,
+                args=(options['api_latency_ms'] / 1000, stub_pipe), daemon=True)
+            try:
+                conversations = Conversation.objects.bulk_create([
+                    Conversation(id=str(uuid.uuid4()))
+                    for _ in range(max(options['concurrency']))])
+                # Forked processes must not share the connections.
+                connections.close_all()
+                stub.start()
+                url = pipe.recv()
+                self._run(conversations, options, url, pipe, forking)
+            finally:
+                if stub.is_alive():
+                    pipe.send('stop')
+                    stub.join()
+                teardown_databases(old_config, verbosity=0)
+
+        if self.failures:
+            raise CommandError(f'{self.failures} check(s) failed')
+
+    def _expect(self, condition, description):
+        if condition:
+            self.stdout.write(f'  ok    {description}')
+        else:
+            self.failures += 1
+            self.stdout.write(f'  FAIL  {description}')
+
+    def _run(self, conversations, options, url, stub_pipe, forking):
+        rows = []
+        for concurrency in options['concurrency']:
+            bodies = [json.dumps({'conversationId': conv.id,
+                'message': {'text': CMD_SHOW_HOURS}}).encode('utf8')
+                for conv in conversations[:concurrency]]
+            for server in ('wsgi', 'asgi'):
+                stub_pipe.send('count')
+                received = stub_pipe.recv()
+                pipe, child_pipe = forking.Pipe()
+                process = forking.Process(target=_measure, args=(server, bodies,
+                    options['rounds'], options['wsgi_threads'], url, child_pipe))
+                process.start()
+                result = pipe.recv()
+                process.join()
+                stub_pipe.send('count')
+                # Including the warm-up request.
+                expected = (len(bodies) * options['rounds'] + 1) * MESSAGES_PER_REQUEST
+                self._expect(not result['failed'] and stub_pipe.recv() - received == expected,
+                    f'{server} with {concurrency} in flight answers every request '
+                    'and posts every reply')
+                rows.append((server, concurrency, result))
+
+        self.stdout.write(f"  {'server':6} {'in flight':>9} {'req/s':>8} {'p50 ms':>8} "
+            f"{'p99 ms':>8} {'threads':>8} {'MiB over idle':>14}")
+        for server, concurrency, result in rows:
+            self.stdout.write(f'  {server:6} {concurrency:9} '
+                f"{result['requests_per_second']:8.1f} {result['p50'] * 1000:8.1f} "
+                f"{result['p99'] * 1000:8.1f} {result['threads']:8} "
+                f"{result['rss'] / 2**20:14.1f}")
@@ -0,0 +1,94 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Django management command that times the same operations against every
+CartStore backend. ORM timings run inside a transaction that is rolled back,
+so the command is safe to run against a live database. The backends'
+behaviour is covered by bopis/tests/test_cart_store.py.
+'''
+
+import contextlib
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.module_loading import import_string
+from bopis.models import Item
+
+BACKENDS = {
+    'orm': 'bopis.cart_store.OrmCartStore',
+    'datastore': 'bopis.cart_store.DatastoreCartStore',
+    'memory': 'bopis.cart_store.InMemoryCartStore',
+}
+
+class _Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Times the CartStore backends'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', action='append', choices=sorted(BACKENDS),
+            help='Backend to time, may be repeated. Defaults to orm and memory.')
+        parser.add_argument('--operations', type=int, default=500,
+            help='Operations per benchmark.')
+
+    def handle(self, *args, **options):
+
+        for name in options['backend'] or ['orm', 'memory']:
+            self.stdout.write(f'== {name} ({BACKENDS[name]})')
+            with self._fixture(name) as (store, item_ids):
+                self._run_benchmarks(store, item_ids, options['operations'])
+
+    @contextlib.contextmanager
+    def _fixture(self, name):
+        store = import_string(BACKENDS[name])()
+        if name != 'orm':
+            yield store, [1, 2, 3]
+            return
+
+        try:
+            with transaction.atomic():
+                items = [Item.objects.create(name=f'Cart store bench {i}',
+                    price='1.00', currency='USD', image_url='https://example.com')
+                    for i in range(3)]
+                yield store, sorted(item.id for item in items)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def _run_benchmarks(self, store, item_ids, operations):
+        conversation_id = f'bench-{uuid.uuid4().hex}'
+
+        def add():
+            for i in range(operations):
+                store.add(conversation_id, item_ids[i % len(item_ids)])
+
+        def get_summary():
+            for _ in range(operations):
+                store.get_summary(conversation_id)
+
+        def remove():
+            for i in range(operations):
+                store.remove(conversation_id, item_ids[i % len(item_ids)])
+
+        for label, run in (('add', add), ('get_summary', get_summary),
+                ('remove', remove)):
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'  {label:12} {operations / elapsed:12.1f} ops/s'
+                f' {elapsed / operations * 1e6:10.1f} us/op')
@@ -0,0 +1,140 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Django management command that times checkout: loads of the checkout page,
+cold, with the cart fragment cached and as 304 reloads, and checkout clicks
+against a local Stripe stub, uncached, cached and prefetched. Runs in a
+transaction that is rolled back, except the clicks, whose carts live in the
+in-memory CartStore; the few rows they need are removed afterwards. The
+behaviour is covered by bopis/tests/test_checkout_page.py and
+test_checkout_sessions.py.
+'''
+
+import time
+import uuid
+
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+from bopis import checkout
+from bopis.cart_store import get_cart_store
+from bopis.models import Conversation, Item, ShoppingCart
+from bopis.stubs import StripeStub
+
+DOMAIN = 'https://checkout.example.com'
+
+class _Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Times the checkout page and checkout clicks against a local Stripe stub'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loads', type=int, default=200,
+            help='Page loads timed per scenario.')
+        parser.add_argument('--stripe-latency-ms', type=float, default=300.0,
+            help='Time the stub takes to create a session.')
+        parser.add_argument('--clicks', type=int, default=20,
+            help='Checkout clicks timed per scenario.')
+
+    def handle(self, *args, **options):
+
+        try:
+            with transaction.atomic():
+                self._time_page(options['loads'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        prefix = uuid.uuid4().hex[:8]
+        item = Item.objects.create(name='Checkout bench', sku=f'{prefix}-0',
+            price='4.50', currency='USD', image_url='https://example.com')
+        stub = StripeStub(options['stripe_latency_ms'] / 1000)
+        checkout.stats.reset()
+        try:
+            with override_settings(
+                    BOPIS_CART_STORE='bopis.cart_store.InMemoryCartStore'), \
+                    stub.running():
+                self._time_clicks(item, options['clicks'])
+        finally:
+            item.delete()
+
+        self.stdout.write(f'Stripe stub: {stub.requests} requests, '
+            f'{len(stub.created)} sessions created')
+        self.stdout.write(f'Cache stats: {checkout.stats.as_dict()}')
+
+    def _time_page(self, loads):
+        client = Client()
+        store = get_cart_store()
+        items = [Item.objects.create(name=f'Checkout page bench {i}',
+            price='3.25', currency='USD', image_url='https://example.com')
+            for i in range(5)]
+        conversation_id = str(uuid.uuid4())
+        for item in items:
+            store.add(conversation_id, item.id)
+        url = f'/bopis/checkout/{conversation_id}'
+
+        def time_loads(label, **headers):
+            started = time.perf_counter()
+            for _ in range(loads):
+                client.get(url, **headers)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'  {label:16} {elapsed / loads * 1000:8.2f} ms/load')
+
+        etag = client.get(url).get('ETag')
+        time_loads('cached fragment')
+        time_loads('304 reload', HTTP_IF_NONE_MATCH=etag)
+        cart_id = store.get_cart_id(conversation_id)
+        fragment_key = make_template_fragment_key('checkout_cart',
+            [cart_id, etag.strip('"')])
+        started = time.perf_counter()
+        for _ in range(loads):
+            cache.delete(fragment_key)
+            client.get(url)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"  {'cold render':16} {elapsed / loads * 1000:8.2f} ms/load")
+
+    def _time_clicks(self, item, clicks):
+        store = get_cart_store()
+        conversation_ids = [f'timing-{uuid.uuid4().hex}' for _ in range(clicks)]
+        prefetched_ids = [f'timing-{uuid.uuid4().hex}' for _ in range(clicks)]
+        conversations = []
+        for conversation_id in conversation_ids + prefetched_ids:
+            store.add(conversation_id, item.id)
+            # The ShoppingCart the pickup details were saved on.
+            conversations.append(Conversation.objects.create(id=conversation_id))
+            conversations[-1].create_new_cart()
+        try:
+            self._click(conversation_ids, prefetched_ids, clicks)
+        finally:
+            Conversation.objects.filter(id__in=[conv.id for conv in conversations]).delete()
+            ShoppingCart.objects.filter(
+                id__in=[conv.shopping_cart_id for conv in conversations]).delete()
+
+    def _click(self, conversation_ids, prefetched_ids, clicks):
+        for future in [checkout.prefetch_checkout_session(conversation_id, DOMAIN)
+                for conversation_id in prefetched_ids]:
+            future.result()
+
+        for label, timed_ids in (('first click', conversation_ids),
+                ('repeat click', conversation_ids),
+                ('prefetched', prefetched_ids)):
+            started = time.perf_counter()
+            for conversation_id in timed_ids:
+                checkout.get_checkout_session(conversation_id, DOMAIN)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'  {label:16} {elapsed / clicks * 1000:8.2f} ms/click')
@@ -0,0 +1,190 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Django management command that benchmarks every bot command end to end
+through route_message against the configured database, with Business
+Messages and Stripe stubbed out. Reports ops/s, p50 and p99 latency,
+queries, messages sent and peak allocated memory per command, writes them
+as JSON and compares them with a baseline written by an earlier run. Every
+run of a command is rolled back to a savepoint, and the seeded data with
+the transaction around it.
+
+    python manage.py bench_commands --output baseline.json
+    python manage.py bench_commands --baseline baseline.json
+'''
+
+import json
+import platform
+import time
+import tracemalloc
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from bopis.models import Conversation
+from bopis.stubs import FakeSender, get_messages, replaying, seed
+from bopis.views import route_message
+
+class _Rollback(Exception):
+    pass
+
+def percentile(sorted_values, fraction):
+    '''
+    Args:
+        sorted_values (list): Ascending values.
+        fraction (float): 0.5 for the median.
+    Returns:
+        The nearest-rank percentile.
+    '''
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+class Command(BaseCommand):
+    help = 'Benchmarks every bot command and compares the results with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200,
+            help='Timed runs per command.')
+        parser.add_argument('--cart-size', type=int, default=5,
+            help='Items in the seeded cart.')
+        parser.add_argument('--command', action='append', dest='commands',
+            help='Only benchmark this command, may be repeated.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--baseline',
+            help='Compare with the results in this JSON file and fail on regressions.')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+            help='How much the p50 latency and peak memory may grow over the '
+            'baseline, as a fraction. Latency only compares on the same machine. '
+            'Queries and messages may not grow at all.')
+
+    def handle(self, *args, **options):
+
+        results = None
+        sender = FakeSender()
+        try:
+            with replaying(sender), transaction.atomic():
+                results = self._run_benchmarks(sender, options)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        report = {
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'iterations': options['iterations'],
+            'cart_size': options['cart_size'],
+            'commands': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+                output.write('\n')
+            self.stdout.write(f"  results written to {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = self._compare(json.load(baseline), report,
+                    options['tolerance'])
+            if regressions:
+                raise CommandError(f'{regressions} regression(s) against '
+                    f"{options['baseline']}")
+
+    def _run_once(self, conversation_id, message):
+        # Measures only route_message, not the savepoint or reading the
+        # conversation, which the callback does before routing.
+        conv = Conversation.objects.select_related('shopping_cart').get(id=conversation_id)
+        with transaction.atomic():
+            started = time.perf_counter()
+            route_message(message, conv)
+            seconds = time.perf_counter() - started
+            transaction.set_rollback(True)
+        return seconds
+
+    def _run_benchmarks(self, sender, options):
+        fixture = seed(options['cart_size'])
+        messages = get_messages(fixture)
+        unknown = set(options['commands'] or []) - set(messages)
+        if unknown:
+            raise CommandError(f"Unknown command(s): {', '.join(sorted(unknown))}")
+
+        results = {}
+        self.stdout.write(f"  {'command':24} {'ops/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+            f"{'queries':>7} {'msgs':>4} {'peak KiB':>9}")
+        for command, message in messages.items():
+            if options['commands'] and command not in options['commands']:
+                continue
+
+            with CaptureQueriesContext(connection) as queries:
+                sent = sender.sent
+                self._run_once(fixture.conversation_id, message)
+                sent = sender.sent - sent
+            # The savepoint and the conversation lookup are not the command's.
+            query_count = len([query for query in queries.captured_queries
+                if 'SAVEPOINT' not in query['sql']]) - 1
+
+            tracemalloc.start()
+            self._run_once(fixture.conversation_id, message)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            # Keep Django from logging every query, as it does with DEBUG on.
+            with override_settings(DEBUG=False):
+                for _ in range(3):
+                    self._run_once(fixture.conversation_id, message)
+                timings = sorted(self._run_once(fixture.conversation_id, message)
+                    for _ in range(options['iterations']))
+
+            results[command] = {
+                'message': message,
+                'ops_per_sec': round(len(timings) / sum(timings), 1),
+                'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+                'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+                'queries': query_count,
+                'messages': sent,
+                'peak_kib': round(peak / 1024, 1),
+            }
+            result = results[command]
+            self.stdout.write(f"  {command:24} {result['ops_per_sec']:9.1f} "
+                f"{result['p50_ms']:8.3f} {result['p99_ms']:8.3f} {result['queries']:7} "
+                f"{result['messages']:4} {result['peak_kib']:9.1f}")
+        return results
+
+    def _compare(self, baseline, report, tolerance):
+        if baseline.get('database') != report['database']:
+            self.stdout.write(f"  note: the baseline ran on {baseline.get('database')}, "
+                f"this run on {report['database']}")
+
+        regressions = 0
+        for command, result in report['commands'].items():
+            before = baseline.get('commands', {}).get(command)
+            if before is None:
+                self.stdout.write(f'  new   {command} is not in the baseline')
+                continue
+            problems = []
+            for metric, allowed in (('p50_ms', before['p50_ms'] * (1 + tolerance)),
+                    ('peak_kib', before['peak_kib'] * (1 + tolerance)),
+                    ('queries', before['queries']), ('messages', before['messages'])):
+                if result[metric] > allowed:
+                    problems.append(f'{metric} {before[metric]} -> {result[metric]}')
+            if problems:
+                regressions += 1
+                self.stdout.write(f"  FAIL  {command}: {', '.join(problems)}")
+            else:
+                self.stdout.write(f'  ok    {command}')
+        return regressions
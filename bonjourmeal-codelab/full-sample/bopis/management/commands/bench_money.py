@@ -0,0 +1,96 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Django management command that times bopis.money against the float math
+the cart and checkout code used before, on randomly generated carts, and
+counts the carts whose Stripe amount the float math got wrong. The
+properties of bopis.money are tested in bopis/tests/test_money.py.
+'''
+
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from bopis import money
+
+def random_price(rng):
+    return Decimal(rng.randint(0, 50000)) / 100
+
+def random_rate(rng):
+    return Decimal(rng.randint(0, 250000)) / 1000000
+
+def float_totals(prices, quantities, tax_rate):
+    '''
+    The float math the views used before bopis.money.
+    '''
+    total_price = 0
+    for price, quantity in zip(prices, quantities):
+        total_price = total_price + price * quantity
+    tax = round(float(total_price)*float(tax_rate), 2)
+    total = round(float(total_price) + float(total_price)*float(tax_rate), 2)
+    return total_price, tax, int(total*100)
+
+class Command(BaseCommand):
+    help = 'Times bopis.money against float math'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=None,
+            help='Seed of the random carts, printed when not given.')
+        parser.add_argument('--lines', type=int, default=8,
+            help='Cart lines per cart.')
+
+    def handle(self, *args, **options):
+
+        seed = options['seed'] if options['seed'] is not None else random.randrange(2**32)
+        self.stdout.write(f'Seed {seed}')
+        self._benchmark(random.Random(seed), options['lines'])
+
+    def _benchmark(self, rng, lines):
+        carts = []
+        for _ in range(20000):
+            prices = [random_price(rng) for _ in range(lines)]
+            carts.append((prices, [rng.randint(1, 5) for _ in prices]))
+        tax_rate = money.get_tax_rate()
+
+        started = time.perf_counter()
+        for prices, quantities in carts:
+            float_totals(prices, quantities, tax_rate)
+        float_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for prices, quantities in carts:
+            money.compute_totals([money.to_minor_units(price) for price in prices],
+                quantities, tax_rate)
+        decimal_input_seconds = time.perf_counter() - started
+
+        cents = [([money.to_minor_units(price) for price in prices], quantities)
+            for prices, quantities in carts]
+        started = time.perf_counter()
+        for prices, quantities in cents:
+            money.compute_totals(prices, quantities, tax_rate)
+        cents_seconds = time.perf_counter() - started
+
+        off_by_a_cent = sum(1 for prices, quantities in carts
+            if float_totals(prices, quantities, tax_rate)[2]
+                != money.compute_totals([money.to_minor_units(price) for price in prices],
+                    quantities, tax_rate).total)
+
+        for label, seconds in (('float (before)', float_seconds),
+                ('money, Decimal prices', decimal_input_seconds),
+                ('money, cents', cents_seconds)):
+            self.stdout.write(f'  {label:22} {seconds / len(carts) * 1e6:8.2f} us/cart')
+        self.stdout.write(f'  Stripe amount differs from the page in {off_by_a_cent} of '
+            f'{len(carts)} carts with the float math')
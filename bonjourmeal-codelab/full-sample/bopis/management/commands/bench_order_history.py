@@ -0,0 +1,168 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Django management command that gives one conversation thousands of past
+carts and compares reading pages of its purchases by walking
+Conversation.past_carts with OFFSET against the keyset pagination in
+bopis.orders, at the first, middle and last page. Runs in a transaction
+that is rolled back.
+'''
+
+import datetime
+import time
+import uuid
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from bopis import orders, view_utils
+from bopis.models import Conversation, Item, Order, ShoppedItem, ShoppingCart
+from bopis.pagination import decode_cursor, encode_cursor
+from bopis.view_constants import CMD_SHOW_PURCHASES
+from bopis.views import route_message
+
+class _Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Benchmarks paging through a conversation with many past carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=10000,
+            help='Past carts of the conversation.')
+        parser.add_argument('--repeat', type=int, default=20,
+            help='Reads timed per page.')
+
+    def handle(self, *args, **options):
+
+        self.failures = 0
+        try:
+            with transaction.atomic():
+                self._run_benchmark(options['carts'], options['repeat'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+        if self.failures:
+            raise CommandError(f'{self.failures} check(s) failed')
+
+    def _expect(self, condition, description):
+        if condition:
+            self.stdout.write(f'  ok    {description}')
+        else:
+            self.failures += 1
+            self.stdout.write(f'  FAIL  {description}')
+
+    def _create_history(self, conv, cart_count):
+        item = Item.objects.create(name='Order history bench', price='4.50',
+            currency='USD', image_url='https://example.com')
+        # bulk_create only returns ids on some databases, so pick them.
+        first_id = (ShoppingCart.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        now = timezone.now()
+        carts = []
+        for i in range(cart_count):
+            # Every third cart shares its timestamp with the next one, so
+            # pages have to break ties by id.
+            purchased = now - datetime.timedelta(minutes=cart_count - i - i % 3)
+            carts.append(ShoppingCart(id=first_id + i, purchased=True,
+                purchase_timestamp=purchased, total_paid='4.50',
+                pickup_datetime=purchased + datetime.timedelta(hours=1)))
+        ShoppingCart.objects.bulk_create(carts, batch_size=500)
+        ShoppedItem.objects.bulk_create([ShoppedItem(item=item, cart=cart)
+            for cart in carts], batch_size=500)
+        conv.past_carts.add(*carts)
+        Order.objects.bulk_create([Order(conversation=conv, shopping_cart=cart,
+            state=Order.PICKED_UP, pickup_datetime=cart.pickup_datetime,
+            creation_timestamp=cart.purchase_timestamp) for cart in carts],
+            batch_size=500)
+
+    def _run_benchmark(self, cart_count, repeat):
+        conv = Conversation.objects.create(id=str(uuid.uuid4()))
+        started = time.perf_counter()
+        self._create_history(conv, cart_count)
+        self.stdout.write(f'  created {cart_count} past carts in '
+            f'{time.perf_counter() - started:.1f}s')
+        page_size = orders.ORDERS_PAGE_SIZE
+
+        expected = list(Order.objects.filter(conversation=conv).order_by(
+            '-creation_timestamp', '-id').values_list('id', flat=True))
+        seen, cursor, reads = [], None, 0
+        while True:
+            page = orders.get_purchases_page(conv.id, cursor)
+            seen.extend(order.id for order in page.items)
+            reads += 1
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self._expect(seen == expected and reads == -(-cart_count // page_size),
+            'following the cursors visits every purchase once, newest first')
+
+        def offset_page(offset):
+            # Walking past_carts the natural way.
+            return list(conv.past_carts.filter(purchased=True).order_by(
+                '-purchase_timestamp', '-id').prefetch_related(
+                'shoppeditem_set__item')[offset:offset + page_size])
+
+        def keyset_cursor(offset):
+            if offset == 0:
+                return None
+            previous = Order.objects.get(id=expected[offset - 1])
+            return encode_cursor(previous.creation_timestamp, previous.id)
+
+        last_page = (cart_count - 1) // page_size * page_size
+        middle_page = last_page // 2 // page_size * page_size
+        self.stdout.write(f"  {'page':>10} {'OFFSET':>12} {'keyset':>12}")
+        for label, offset in (('first', 0), ('middle', middle_page),
+                ('last', last_page)):
+            cursor = keyset_cursor(offset)
+            timings = []
+            for read in (lambda: offset_page(offset),
+                    lambda: orders.get_purchases_page(conv.id, cursor)):
+                read()
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    read()
+                timings.append((time.perf_counter() - started) / repeat * 1000)
+            self.stdout.write(f'  {label:>10} {timings[0]:9.2f} ms {timings[1]:9.2f} ms')
+
+        cursor = keyset_cursor(middle_page)
+        with CaptureQueriesContext(connection) as queries:
+            page = orders.get_purchases_page(conv.id, cursor)
+        self._expect(len(queries) == 3 and page.items[0].id == expected[middle_page],
+            'a page is 3 queries: orders with carts, cart items and items')
+        timestamp, pk = decode_cursor(cursor)
+        plan = Order.objects.filter(Q(creation_timestamp__lt=timestamp) | Q(pk__lt=pk),
+            conversation=conv, creation_timestamp__lte=timestamp).order_by(
+            '-creation_timestamp', '-pk')[:page_size + 1].explain()
+        self.stdout.write('  keyset query plan:')
+        for line in plan.splitlines():
+            self.stdout.write(f'    {line}')
+
+        sent = []
+        with mock.patch.object(view_utils, 'send_message',
+                lambda message, conversation_id: sent.append(message)):
+            route_message(CMD_SHOW_PURCHASES, conv)
+            more = sent[-1].suggestions[0].reply.postbackData
+            route_message(more, conv)
+        self._expect(len(sent[0].richCard.carouselCard.cardContents) == page_size
+            and more.startswith(f'{CMD_SHOW_PURCHASES}-')
+            and sent[1].richCard.carouselCard.cardContents[0].title
+                == f'Order #{expected[page_size]}',
+            'the "More" chip shows the next page as a carousel')
@@ -0,0 +1,183 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Django management command that measures what the middleware costs a
+webhook request. Posts a typing notification, which only looks up the
+conversation, straight to three WSGI applications:
+
+    full    the handler of get_wsgi_application(), with all of MIDDLEWARE
+    lean    bmcodelab.wsgi's router, which sends webhooks through
+            BOPIS_WEBHOOK_MIDDLEWARE and BOPIS_WEBHOOK_URLCONF
+    bare    a WebhookWSGIHandler with no middleware at all
+
+and reports the time per request and the overhead of full and lean over
+bare. Also checks that the router leaves the other pages on the full chain.
+Like the test client, it keeps the database connection across requests and
+runs in a transaction that is rolled back.
+
+    python manage.py bench_webhook_stack --requests 2000
+'''
+
+import io
+import json
+import statistics
+import sys
+import time
+import uuid
+from contextlib import redirect_stdout
+
+from django.core import signals
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import close_old_connections, transaction
+from django.test import override_settings
+from bopis.handlers import WebhookWSGIHandler, route_webhooks
+
+class _Rollback(Exception):
+    pass
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def call(application, path, body=b'', method='POST'):
+    '''
+    Calls a WSGI application the way a WSGI server would.
+
+    Returns:
+        The status code, a :dict: of response headers and the body.
+    '''
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = dict(headers)
+
+    response = application(environ, start_response)
+    try:
+        content = b''.join(response)
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+    return started['status'], started['headers'], content
+
+class Command(BaseCommand):
+    help = 'Benchmarks the per-request middleware overhead of the webhooks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000,
+            help='Timed requests per application.')
+        parser.add_argument('--warmup', type=int, default=100,
+            help='Untimed requests per application first.')
+
+    def handle(self, *args, **options):
+
+        self.failures = 0
+        # As in django.test.client, closing the connection at the end of
+        # every request would end the transaction and skew the timings.
+        signals.request_started.disconnect(close_old_connections)
+        signals.request_finished.disconnect(close_old_connections)
+        try:
+            with transaction.atomic():
+                self._run(options['requests'], options['warmup'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+        finally:
+            signals.request_started.connect(close_old_connections)
+            signals.request_finished.connect(close_old_connections)
+
+        if self.failures:
+            raise CommandError(f'{self.failures} check(s) failed')
+
+    def _expect(self, condition, description):
+        if condition:
+            self.stdout.write(f'  ok    {description}')
+        else:
+            self.failures += 1
+            self.stdout.write(f'  FAIL  {description}')
+
+    def _run(self, requests, warmup):
+        full = get_wsgi_application()
+        lean = route_webhooks(full)
+        with override_settings(BOPIS_WEBHOOK_MIDDLEWARE=[]):
+            bare = WebhookWSGIHandler()
+        applications = {'full': full, 'lean': lean, 'bare': bare}
+        body = json.dumps({'conversationId': str(uuid.uuid4()),
+            'userStatus': {'isTyping': True}}).encode('utf8')
+
+        # The callback prints every payload it receives.
+        with redirect_stdout(io.StringIO()):
+            self._check(full, lean, body)
+            timings = {label: [] for label in applications}
+            for _ in range(warmup):
+                for application in applications.values():
+                    call(application, '/callback/', body)
+            # Interleaved, so that drift in the machine hits all three alike.
+            for _ in range(requests):
+                for label, application in applications.items():
+                    started = time.perf_counter()
+                    call(application, '/callback/', body)
+                    timings[label].append(time.perf_counter() - started)
+
+        self.stdout.write(f"  {'application':12} {'p50 us':>8} {'mean us':>8} "
+            f"{'p99 us':>8} {'overhead':>9}")
+        floor = statistics.median(timings['bare'])
+        for label, seconds in timings.items():
+            seconds.sort()
+            self.stdout.write(f'  {label:12} {percentile(seconds, 0.5) * 1e6:8.0f} '
+                f'{statistics.mean(seconds) * 1e6:8.0f} {percentile(seconds, 0.99) * 1e6:8.0f} '
+                f'{(statistics.median(seconds) - floor) * 1e6:9.0f}')
+        saved = statistics.median(timings['full']) - statistics.median(timings['lean'])
+        self.stdout.write(f'  the lean chain saves {saved * 1e6:.0f} us a webhook request, '
+            f"{saved / statistics.median(timings['full']):.0%} of its p50")
+
+    def _check(self, full, lean, body):
+        status, headers, _ = call(full, '/callback/', body)
+        self._expect(status == 200 and 'X-Frame-Options' in headers,
+            'the full chain answers the callback with frame options')
+        status, headers, _ = call(lean, '/callback/', body)
+        self._expect(status == 200 and 'X-Frame-Options' not in headers
+                and 'X-Content-Type-Options' in headers,
+            'the router sends the callback down the lean chain, SecurityMiddleware included')
+        status, _, _ = call(lean, '/bopis/stripe-webhook', b'{}')
+        self._expect(status == 400,
+            'the router resolves the Stripe webhook, which rejects an unsigned event')
+        status, headers, _ = call(lean, '/', method='GET')
+        self._expect(status == 200 and 'X-Frame-Options' in headers,
+            'other pages still go through the full chain')
+        status, _, _ = call(lean, '/callback', method='GET')
+        self._expect(status == 301,
+            'other spellings of a webhook path still get the full chain\'s redirects')
@@ -0,0 +1,125 @@
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+Django management command that reports what importing the app costs a cold
+process. The modules, bopis.views by default, are imported in a fresh
+interpreter started with `python -X importtime` after django.setup(), so
+that only what they add to a set up process is counted, and the slowest
+modules and packages are listed, e.g.
+
+    python manage.py importtime --top 10
+    python manage.py importtime bopis.views bopis.asgi
+
+Times vary from run to run, the fastest of --repeat runs is reported. The
+import budget tests in bopis/tests fail when an import grows over its budget.
+'''
+
+import os
+import re
+import subprocess
+import sys
+from collections import Counter, namedtuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Written to stderr between django.setup() and the imports being measured.
+MARKER = '-- bopis importtime --'
+
+# -X importtime does not time importlib.import_module, only the import
+# statement and __import__.
+SCRIPT = f'''
+import sys
+import django
+django.setup()
+sys.stderr.write({MARKER!r} + '\\n')
+for name in sys.argv[1:]:
+    __import__(name)
+'''
+
+# import time: self [us] | cumulative | imported package
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$')
+
+Import = namedtuple('Import', ['name', 'depth', 'self_us', 'cumulative_us'])
+
+def measure_imports(modules):
+    '''
+    Imports modules in a fresh, set up Django process.
+
+    Args:
+        modules (list): Names of the modules to import.
+    Returns:
+        A :list: of Import tuples for every module the imports loaded, in
+        the order `-X importtime` reports them, dependencies first.
+    '''
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', SCRIPT, *modules],
+        cwd=settings.BASE_DIR, capture_output=True, text=True, env=dict(os.environ))
+    lines = process.stderr.splitlines()
+    if process.returncode or MARKER not in lines:
+        raise CommandError(f"Importing {', '.join(modules)} failed:\n{process.stderr[-2000:]}")
+
+    imports = []
+    for line in lines[lines.index(MARKER) + 1:]:
+        match = LINE.match(line)
+        if match:
+            imports.append(Import(match.group(4), (len(match.group(3)) - 1) // 2,
+                int(match.group(1)), int(match.group(2))))
+    return imports
+
+def total_ms(imports, name=None):
+    '''
+    Adds up the cumulative time of the top level imports, or of one of them.
+
+    Returns:
+        A :float: of milliseconds.
+    '''
+    return sum(entry.cumulative_us for entry in imports
+        if entry.depth == 0 and name in (None, entry.name)) / 1000
+
+class Command(BaseCommand):
+    help = 'Reports the cold import time of the app and its slowest imports'
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('modules', nargs='*', default=['bopis.views'],
+            help='Modules to import, bopis.views by default.')
+        parser.add_argument('--top', type=int, default=15,
+            help='How many modules and packages to list.')
+        parser.add_argument('--repeat', type=int, default=3,
+            help='Import in this many fresh processes and report the fastest.')
+
+    def handle(self, *args, **options):
+
+        imports = min((measure_imports(options['modules'])
+            for _ in range(max(1, options['repeat']))), key=total_ms)
+
+        for name in options['modules']:
+            self.stdout.write(f'  {name:40} {total_ms(imports, name):9.1f} ms cold')
+        self.stdout.write(f"  {len(imports)} modules loaded in {total_ms(imports):.1f} ms "
+            f'after django.setup()')
+
+        self.stdout.write(f"\n  {'slowest modules':40} {'self ms':>9} {'cumulative':>10}")
+        for entry in sorted(imports, key=lambda entry: -entry.self_us)[:options['top']]:
+            self.stdout.write(f'  {entry.name:40} {entry.self_us / 1000:9.1f} '
+                f'{entry.cumulative_us / 1000:10.1f}')
+
+        packages = Counter()
+        for entry in imports:
+            packages[entry.name.split('.')[0]] += entry.self_us
+        self.stdout.write(f"\n  {'slowest packages':40} {'self ms':>9}")
+        for package, self_us in packages.most_common(options['top']):
+            self.stdout.write(f'  {package:40} {self_us / 1000:9.1f}')
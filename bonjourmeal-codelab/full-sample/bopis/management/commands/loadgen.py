@@ -0,0 +1,237 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Django management command that simulates users ordering through the agent.
+Each virtual user posts webhook payloads to /callback/ the way Business
+Messages does while they browse the menu, add items, look at the cart, pick
+a pickup time and open the checkout page, pausing between taps. Replies go
+to a local stand-in for the Business Messages API and Stripe calls to a
+local stub. Reports throughput, latency percentiles per step and errors.
+
+By default requests go through the Django test client in this process.
+With --url they go to a running server instead, which has to send its
+replies to the stand-in, e.g.
+
+    BOPIS_BUSINESS_MESSAGES_URL=http://127.0.0.1:8099/ python manage.py runserver
+    python manage.py loadgen --url http://127.0.0.1:8000 --fake-api-port 8099
+
+The users' conversations and carts are deleted afterwards unless
+--keep-data is given.
+'''
+
+import datetime
+import io
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, redirect_stdout
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.utils import timezone
+from bopis import pickup
+from bopis.models import Conversation, Item, ShoppedItem, ShoppingCart
+from bopis.stubs import BusinessMessagesStub, StripeStub
+from bopis.view_constants import (CMD_ADD_TO_CART, CMD_CONF_PICKUP_DETAILS,
+    CMD_DRINK_MENU, CMD_FOOD_MENU, CMD_PURCHASE_CART, CMD_SET_PICKUP_DATE,
+    CMD_SET_PICKUP_TIME, CMD_SHOW_CART)
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+class Command(BaseCommand):
+    help = 'Simulates users ordering through /callback/ and reports throughput and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50,
+            help='Virtual users, each walks the ordering flow once.')
+        parser.add_argument('--concurrency', type=int, default=10,
+            help='Users active at the same time.')
+        parser.add_argument('--think-ms', type=float, default=200,
+            help='Average pause between a user\'s taps, uniformly 0 to twice this.')
+        parser.add_argument('--url',
+            help='Base URL of a running server, e.g. http://127.0.0.1:8000. '
+            'Requests go through the Django test client when absent.')
+        parser.add_argument('--fake-api-port', type=int, default=0,
+            help='Port of the Business Messages stand-in, any free one by default.')
+        parser.add_argument('--api-latency-ms', type=float, default=0,
+            help='Time the Business Messages stand-in takes per message.')
+        parser.add_argument('--seed', type=int, help='Seed for the users\' choices.')
+        parser.add_argument('--keep-data', action='store_true',
+            help='Keep the conversations and carts the users created.')
+
+    def handle(self, *args, **options):
+
+        self.food_ids = list(Item.objects.filter(available=True, menu_type='F')
+            .values_list('id', flat=True))
+        self.drink_ids = list(Item.objects.filter(available=True, menu_type='D')
+            .values_list('id', flat=True))
+        if not self.food_ids:
+            raise CommandError('There are no items, run manage.py setup_inventory first.')
+
+        self.options = options
+        self.random = random.Random(options['seed'])
+        self.random_lock = threading.Lock()
+        self.local = threading.local()
+        self.results = []
+        self.conversation_ids = []
+
+        stub = BusinessMessagesStub(options['api_latency_ms'] / 1000)
+        with ExitStack() as stack:
+            stack.enter_context(stub.running(options['fake_api_port']))
+            if options['url']:
+                self.stdout.write(f'  replies are expected at {stub.url}')
+            else:
+                stack.enter_context(StripeStub().running())
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                for _ in executor.map(self._walk, range(options['users'])):
+                    pass
+            seconds = time.perf_counter() - started
+
+        self._report(seconds, sum(stub.received.values()))
+        if not options['keep_data']:
+            self._delete_data()
+
+    def _plan(self):
+        # The taps of one user: browse, add one to three dishes and maybe a
+        # drink, check the cart and choose a pickup time.
+        with self.random_lock:
+            dishes = self.random.sample(self.food_ids, min(len(self.food_ids),
+                self.random.randint(1, 3)))
+            drink = self.random.choice(self.drink_ids) if self.drink_ids \
+                and self.random.random() < 0.6 else None
+            tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+            hours = pickup.get_business_hours(tomorrow)
+            hour = self.random.randrange(*hours) if hours else None
+
+        steps = [(CMD_FOOD_MENU, CMD_FOOD_MENU)]
+        steps += [(CMD_ADD_TO_CART, f'{CMD_ADD_TO_CART}-{item_id}') for item_id in dishes]
+        if drink is not None:
+            steps += [(CMD_DRINK_MENU, CMD_DRINK_MENU),
+                (CMD_ADD_TO_CART, f'{CMD_ADD_TO_CART}-{drink}')]
+        steps += [(CMD_SHOW_CART, CMD_SHOW_CART), (CMD_PURCHASE_CART, CMD_PURCHASE_CART)]
+        if hour is None:
+            steps += [(CMD_SET_PICKUP_DATE, f'{CMD_SET_PICKUP_DATE}-today'),
+                (CMD_SET_PICKUP_TIME, f'{CMD_SET_PICKUP_TIME}-now')]
+        else:
+            steps += [(CMD_SET_PICKUP_DATE, f'{CMD_SET_PICKUP_DATE}-tomorrow'),
+                (CMD_SET_PICKUP_TIME, f"{CMD_SET_PICKUP_TIME}-{hour}:00-"
+                    f"{'AM' if hour < 12 else 'PM'}")]
+        steps.append((CMD_CONF_PICKUP_DETAILS, CMD_CONF_PICKUP_DETAILS))
+        return steps
+
+    def _think(self):
+        with self.random_lock:
+            pause = self.random.uniform(0, 2 * self.options['think_ms']) / 1000
+        time.sleep(pause)
+
+    def _walk(self, _):
+        conversation_id = str(uuid.uuid4())
+        self.conversation_ids.append(conversation_id)
+        try:
+            for step, postback in self._plan():
+                self._think()
+                self._request(step, 'POST', '/callback/', json.dumps({
+                    'conversationId': conversation_id,
+                    'suggestionResponse': {'postbackData': postback}}))
+            self._think()
+            self._request('checkout_page', 'GET', f'/bopis/checkout/{conversation_id}')
+        finally:
+            if not self.options['url']:
+                connections.close_all()
+
+    def _request(self, step, method, path, body=None):
+        started = time.perf_counter()
+        try:
+            status = self._send(method, path, body)
+            error = None if status == 200 else f'HTTP {status}'
+        except Exception as exception:
+            error = type(exception).__name__
+        self.results.append((step, time.perf_counter() - started, error))
+
+    def _send(self, method, path, body):
+        if self.options['url']:
+            request = urllib.request.Request(self.options['url'].rstrip('/') + path,
+                data=body.encode('utf8') if body else None, method=method,
+                headers={'Content-Type': 'application/json'})
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    response.read()
+                    return response.status
+            except urllib.error.HTTPError as error:
+                return error.code
+
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            # Answer 500 like a server would instead of raising.
+            client = self.local.client = Client(raise_request_exception=False)
+        # The callback prints every payload it receives.
+        with redirect_stdout(io.StringIO()):
+            if method == 'POST':
+                return client.post(path, body, content_type='application/json').status_code
+            return client.get(path).status_code
+
+    def _report(self, seconds, replies):
+        by_step = defaultdict(list)
+        errors = Counter()
+        for step, latency, error in self.results:
+            by_step[step].append((latency, error))
+            if error:
+                errors[f'{step}: {error}'] += 1
+
+        total = len(self.results)
+        self.stdout.write(f"  {self.options['users']} users, {self.options['concurrency']} "
+            f"at a time, {self.options['think_ms']:.0f} ms think time, "
+            f"{'server ' + self.options['url'] if self.options['url'] else 'in process'}")
+        self.stdout.write(f'  {total} requests in {seconds:.1f}s, '
+            f'{total / seconds:.1f} requests/s, {self.options["users"] / seconds:.2f} users/s')
+        self.stdout.write(f'  {replies} replies sent to Business Messages, '
+            f'{sum(errors.values())} errors ({sum(errors.values()) / max(total, 1):.2%})')
+
+        self.stdout.write(f"  {'step':24} {'count':>6} {'errors':>6} {'p50 ms':>8} "
+            f"{'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        every = sorted(latency for latency, _ in (pair for pairs in by_step.values()
+            for pair in pairs))
+        for step, pairs in sorted(by_step.items()) + [('all', [(latency, None)
+                for latency in every])]:
+            latencies = sorted(latency for latency, _ in pairs)
+            step_errors = sum(1 for _, error in pairs if error) if step != 'all' \
+                else sum(errors.values())
+            self.stdout.write(f'  {step:24} {len(latencies):6} {step_errors:6} '
+                + ' '.join(f'{percentile(latencies, fraction) * 1000:8.1f}'
+                    for fraction in (0.5, 0.9, 0.99, 1.0)))
+        for error, count in errors.most_common(5):
+            self.stdout.write(f'  {count:6} x {error}')
+
+    def _delete_data(self):
+        conversations = Conversation.objects.filter(id__in=self.conversation_ids)
+        cart_ids = list(conversations.exclude(shopping_cart=None)
+            .values_list('shopping_cart_id', flat=True))
+        for cart in ShoppingCart.objects.filter(id__in=cart_ids).exclude(pickup_slot=None):
+            cart.release_pickup_slot()
+        ShoppedItem.objects.filter(cart_id__in=cart_ids).delete()
+        conversations.delete()
+        ShoppingCart.objects.filter(id__in=cart_ids).delete()
@@ -0,0 +1,161 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Django management command that saturates a few popular pickup slots with
+concurrent bookings from many threads, some of which move their booking to
+another slot, then checks that no slot was booked past its capacity. The
+bookings must be committed to be seen by the other threads, so the command
+uses a store id of its own and deletes its slots and carts when done.
+'''
+
+import datetime
+import random
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, OperationalError
+from django.test import override_settings
+from django.utils import timezone
+from bopis import pickup
+from bopis.models import PickupSlot, ShoppingCart
+
+class Command(BaseCommand):
+    help = 'Load tests concurrent pickup slot reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=200,
+            help='Carts trying to book a popular slot.')
+        parser.add_argument('--threads', type=int, default=16,
+            help='Threads booking concurrently.')
+        parser.add_argument('--capacity', type=int, default=10,
+            help='Capacity of every slot.')
+        parser.add_argument('--popular', type=int, default=3,
+            help='Slots from noon on that every booking goes for.')
+        parser.add_argument('--moves', type=float, default=0.2,
+            help='Share of successful bookings that then move to another slot.')
+        parser.add_argument('--seed', type=int, default=None,
+            help='Seed of the slot choices.')
+
+    def handle(self, *args, **options):
+
+        store_id = f'loadtest-{uuid.uuid4().hex[:12]}'
+        day = timezone.localdate() + datetime.timedelta(days=1)
+        cart_ids = []
+        try:
+            with override_settings(BOPIS_PICKUP_SLOT_CAPACITY=options['capacity'],
+                    BOPIS_PICKUP_SLOT_CAPACITY_BY_HOUR={},
+                    BOPIS_BUSINESS_HOURS=[(8, 20)] * 7):
+                pickup.ensure_slots(day, store_id)
+            for _ in range(options['bookings']):
+                cart_ids.append(ShoppingCart.objects.create().id)
+            failures = self._run_load(store_id, day, cart_ids, options)
+        finally:
+            ShoppingCart.objects.filter(id__in=cart_ids).delete()
+            PickupSlot.objects.filter(store_id=store_id).delete()
+            cache.delete(f'{pickup.SLOTS_CREATED_CACHE_KEY_PREFIX}{store_id}:'
+                f'{day.isoformat()}')
+
+        if failures:
+            raise CommandError(f'{failures} check(s) failed')
+
+    def _run_load(self, store_id, day, cart_ids, options):
+        starts = [pickup.get_slot_start(day, hour)
+            for hour in range(12, 12 + options['popular'])]
+        rng = random.Random(options['seed'])
+        plans = [(cart_id, rng.choice(starts),
+            rng.choice(starts) if rng.random() < options['moves'] else None)
+            for cart_id in cart_ids]
+        lock = threading.Lock()
+        latencies, results = [], {'booked': 0, 'full': 0, 'moved': 0, 'retries': 0}
+
+        def reserve(cart, start):
+            while True:
+                started = time.perf_counter()
+                try:
+                    slot = pickup.reserve_slot(cart, start, store_id)
+                except OperationalError:
+                    # SQLite reports a busy database instead of waiting for
+                    # the row locks other databases take.
+                    with lock:
+                        results['retries'] += 1
+                    time.sleep(0.001)
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                return slot
+
+        def book(worker_plans):
+            try:
+                for cart_id, start, move_to in worker_plans:
+                    cart = ShoppingCart(id=cart_id)
+                    slot = reserve(cart, start)
+                    moved = (slot is not None and move_to is not None
+                        and move_to != start and reserve(cart, move_to) is not None)
+                    with lock:
+                        results['booked' if slot else 'full'] += 1
+                        results['moved'] += moved
+            finally:
+                connection.close()
+
+        thread_count = options['threads']
+        threads = [threading.Thread(target=book, args=(plans[i::thread_count],))
+            for i in range(thread_count)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        failures = 0
+        def expect(condition, description):
+            nonlocal failures
+            if not condition:
+                failures += 1
+            self.stdout.write(f"  {'ok  ' if condition else 'FAIL'}  {description}")
+
+        capacity = options['capacity']
+        slots = list(PickupSlot.objects.filter(store_id=store_id, start__in=starts))
+        for slot in slots:
+            holders = ShoppingCart.objects.filter(pickup_slot=slot).count()
+            expect(slot.reserved == holders <= capacity,
+                f'{timezone.localtime(slot.start):%H:%M} holds {holders} carts,'
+                f' reserved {slot.reserved} of {capacity}')
+        if len(cart_ids) >= capacity * len(starts):
+            expect(all(slot.reserved == capacity for slot in slots),
+                'every popular slot filled up')
+        expect(results['booked'] == sum(slot.reserved for slot in slots),
+            f"{results['booked']} bookings succeeded, {results['full']} found the slot full")
+        open_starts = {slot.start for slot in pickup.get_open_slots(day, store_id)}
+        expect(not open_starts & set(starts)
+            or len(cart_ids) < capacity * len(starts),
+            'full slots are no longer offered')
+
+        latencies.sort()
+        self.stdout.write(f'  {len(latencies)} reservations by {thread_count} threads in'
+            f' {elapsed:.2f}s, {len(latencies) / elapsed:.1f}/s,'
+            f" {results['moved']} moves, {results['retries']} busy retries")
+        self.stdout.write(f'  latency p50 {latencies[len(latencies) // 2] * 1000:.1f}ms'
+            f' p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}ms'
+            f' max {latencies[-1] * 1000:.1f}ms')
+        self.stdout.write('  availability query plan:')
+        for line in pickup.get_open_slots_query(day, store_id).explain().splitlines():
+            self.stdout.write(f'    {line}')
+        return failures
@@ -0,0 +1,132 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Django management command that merges the profiles bopis.profiling wrote.
+The sampled stacks of every request are added up and written as collapsed
+stacks, which flamegraph.pl, speedscope and most flame graph viewers read,
+e.g.
+
+    python manage.py merge_profiles --output stacks.txt
+    flamegraph.pl stacks.txt > flamegraph.svg
+
+The cProfile profiles are merged into one pstats file with --pstats-output,
+which snakeviz or `python -m pstats` open. A summary of the hottest frames
+and functions is printed either way.
+'''
+
+import io
+import os
+import pstats
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from bopis.profiling import CPROFILE_SUFFIX, SAMPLE_SUFFIX, parse_profile_name
+
+def read_collapsed(path):
+    '''
+    Reads a collapsed stacks file.
+
+    Returns:
+        A :Counter: of samples by stack.
+    '''
+    stacks = Counter()
+    with open(path) as profile:
+        for line in profile:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+    return stacks
+
+class Command(BaseCommand):
+    help = 'Merges request profiles into a flamegraph-ready report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='The profile directory, '
+            'BOPIS_PROFILE_DIR by default.')
+        parser.add_argument('--view', help='Only merge requests to this view, '
+            'e.g. bopis.views.callback.')
+        parser.add_argument('--command', dest='bot_command',
+            help='Only merge requests routed to this bot command.')
+        parser.add_argument('--by-command', action='store_true',
+            help='Root every stack at its view and bot command.')
+        parser.add_argument('--output', help='Write the merged collapsed stacks '
+            'to this file.')
+        parser.add_argument('--pstats-output', help='Write the merged cProfile '
+            'profiles to this file.')
+        parser.add_argument('--top', type=int, default=15,
+            help='Frames and functions to list in the summary.')
+
+    def handle(self, *args, **options):
+
+        directory = options['dir'] or settings.BOPIS_PROFILE_DIR
+        if not directory or not os.path.isdir(directory):
+            raise CommandError(f'No profile directory {directory!r}, '
+                'set BOPIS_PROFILE_DIR or pass --dir.')
+
+        samples, cprofiles = [], []
+        for name in sorted(os.listdir(directory)):
+            labels = parse_profile_name(name)
+            if labels is None:
+                continue
+            view, command = labels
+            if options['view'] and view != options['view'] \
+                    or options['bot_command'] and command != options['bot_command']:
+                continue
+            path = os.path.join(directory, name)
+            if name.endswith(SAMPLE_SUFFIX):
+                samples.append((path, view, command))
+            elif name.endswith(CPROFILE_SUFFIX):
+                cprofiles.append(path)
+
+        stacks = Counter()
+        for path, view, command in samples:
+            for stack, count in read_collapsed(path).items():
+                if options['by_command']:
+                    stack = f'{view};{command};{stack}'
+                stacks[stack] += count
+        self.stdout.write(f'  {len(samples)} sampled requests, '
+            f'{sum(stacks.values())} samples, {len(cprofiles)} cProfile requests')
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                for stack, count in sorted(stacks.items()):
+                    output.write(f'{stack} {count}\n')
+            self.stdout.write(f"  collapsed stacks written to {options['output']}")
+        self._summarize_samples(stacks, options['top'])
+
+        if cprofiles:
+            report = io.StringIO()
+            stats = pstats.Stats(*cprofiles, stream=report)
+            if options['pstats_output']:
+                stats.dump_stats(options['pstats_output'])
+                self.stdout.write(f"  pstats written to {options['pstats_output']}")
+            stats.sort_stats('cumulative').print_stats(options['top'])
+            self.stdout.write(report.getvalue(), ending='')
+
+    def _summarize_samples(self, stacks, top):
+        total = sum(stacks.values())
+        if not total:
+            return
+        own, anywhere = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                anywhere[frame] += count
+
+        self.stdout.write(f"  {'self':>6} {'total':>6}  frame, by samples on top of the stack")
+        for frame, count in own.most_common(top):
+            self.stdout.write(f'  {count / total:6.1%} {anywhere[frame] / total:6.1%}  {frame}')
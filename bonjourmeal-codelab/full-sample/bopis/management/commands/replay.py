@@ -0,0 +1,249 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Django management command that replays webhook traffic captured by
+bopis.capture. The payloads are posted to /callback/ in the order and at the
+pace they arrived, or faster with --speed, against a fresh test database
+holding a copy of the items of the configured database, so that the item
+ids in the payloads still match. Replies go to a local stand-in for the
+Business Messages API and Stripe calls to a local stub.
+
+Reports latency percentiles by command next to the captured ones and the
+payloads whose replies differ in number from the captured outcome. With
+--output the replies and latencies are written as JSON, and --baseline
+compares them with a replay of the same capture on another build, e.g.
+
+    git checkout main
+    python manage.py replay --speed 0 --output main.json
+    git checkout my-branch
+    python manage.py replay --speed 0 --baseline main.json
+'''
+
+import difflib
+import glob
+import io
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import wait
+from contextlib import ExitStack, redirect_stdout
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.utils.dateparse import parse_datetime
+from bopis import background
+from bopis.capture import FILE_PATTERN, read_records
+from bopis.models import Item
+from bopis.stubs import BusinessMessagesStub, StripeStub
+
+# Set by the client or the API for every message, not by the agent.
+VOLATILE_FIELDS = ('messageId', 'name')
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def normalize(message):
+    '''
+    Drops the fields of an outbound message that differ on every run.
+
+    Returns:
+        The message as canonical JSON.
+    '''
+    return json.dumps({key: value for key, value in message.items()
+        if key not in VOLATILE_FIELDS}, sort_keys=True)
+
+class Command(BaseCommand):
+    help = 'Replays captured webhook traffic and compares it with the capture or a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--capture', nargs='+',
+            help='Capture files, all of them in BOPIS_CAPTURE_DIR by default.')
+        parser.add_argument('--speed', type=float, default=1.0,
+            help='How many times faster than captured to replay, 0 for no pauses.')
+        parser.add_argument('--limit', type=int, help='Replay only the first payloads.')
+        parser.add_argument('--api-latency-ms', type=float, default=0,
+            help='Time the Business Messages stand-in takes per message.')
+        parser.add_argument('--output', help='Write the replies and latencies '
+            'to this JSON file.')
+        parser.add_argument('--baseline', help='Compare with a replay written '
+            'by --output and fail on different replies or slower commands.')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+            help='How much the p50 latency of a command may grow over the '
+            'baseline, as a fraction.')
+
+    def handle(self, *args, **options):
+
+        paths = options['capture'] or []
+        if not paths and settings.BOPIS_CAPTURE_DIR:
+            paths = sorted(glob.glob(os.path.join(settings.BOPIS_CAPTURE_DIR, FILE_PATTERN)))
+        records = read_records(paths)[:options['limit']]
+        if not records:
+            raise CommandError('Nothing to replay, pass --capture or set BOPIS_CAPTURE_DIR.')
+        self.stdout.write(f'  replaying {len(records)} payloads from {len(paths)} file(s)')
+
+        items = list(Item.objects.all())
+        with tempfile.TemporaryDirectory() as directory:
+            for alias in connections:
+                settings_dict = connections[alias].settings_dict
+                if settings_dict['ENGINE'].endswith('sqlite3') \
+                        and not settings_dict['TEST']['NAME']:
+                    # A shared in-memory database fails instead of waiting
+                    # when a background job writes at the same time.
+                    settings_dict['TEST']['NAME'] = os.path.join(directory,
+                        f'{alias}.sqlite3')
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                if items:
+                    Item.objects.bulk_create(items)
+                else:
+                    call_command('setup_inventory', stdout=io.StringIO())
+                results, lag = self._replay(records, options)
+            finally:
+                teardown_databases(old_config, verbosity=0)
+
+        report = {
+            'database': connection.vendor,
+            'speed': options['speed'],
+            'payloads': len(records),
+            'results': results,
+        }
+        self._report(records, results, lag)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=1, sort_keys=True)
+                output.write('\n')
+            self.stdout.write(f"  replay written to {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = self._compare(json.load(baseline), report,
+                    options['tolerance'])
+            if regressions:
+                raise CommandError(f'{regressions} regression(s) against '
+                    f"{options['baseline']}")
+
+    def _replay(self, records, options):
+        api = BusinessMessagesStub(options['api_latency_ms'] / 1000)
+        client = Client(raise_request_exception=False)
+        first = parse_datetime(records[0]['time'])
+        results = []
+        lag = 0.0
+        jobs = []
+        submit = background.submit
+
+        def track(*args, **kwargs):
+            jobs.append(submit(*args, **kwargs))
+            return jobs[-1]
+
+        with ExitStack() as stack:
+            stack.enter_context(api.running())
+            stack.enter_context(StripeStub().running())
+            stack.enter_context(override_settings(BOPIS_CAPTURE_DIR=''))
+            # Background jobs, e.g. checkout session prefetches, have to
+            # finish while the stubs still run.
+            stack.enter_context(mock.patch.object(background, 'submit', track))
+            # The callback prints every payload it receives.
+            stack.enter_context(redirect_stdout(io.StringIO()))
+
+            started = time.perf_counter()
+            for record in records:
+                if options['speed'] > 0:
+                    due = started + (parse_datetime(record['time'])
+                        - first).total_seconds() / options['speed']
+                    now = time.perf_counter()
+                    if due > now:
+                        time.sleep(due - now)
+                    else:
+                        lag = max(lag, now - due)
+
+                received = len(api.messages)
+                sent = time.perf_counter()
+                response = client.post('/callback/', record['body'],
+                    content_type='application/json')
+                results.append({
+                    'command': record['command'],
+                    'status': response.status_code,
+                    'seconds': round(time.perf_counter() - sent, 6),
+                    'messages': [normalize(message)
+                        for _, message in api.messages[received:]],
+                })
+            wait(jobs)
+        return results, lag
+
+    def _report(self, records, results, lag):
+        captured, replayed = defaultdict(list), defaultdict(list)
+        mismatches = []
+        for index, (record, result) in enumerate(zip(records, results)):
+            command = record['command'] or 'unrouted'
+            captured[command].append(record['seconds'])
+            replayed[command].append(result['seconds'])
+            if result['status'] != 200 or len(result['messages']) != record['messages']:
+                mismatches.append(f"  #{index} {command}: captured {record['messages']} "
+                    f"message(s){' and ' + record['error'] if record['error'] else ''}, "
+                    f"replayed {len(result['messages'])} with HTTP {result['status']}")
+
+        self.stdout.write(f'  at most {lag * 1000:.0f} ms behind the captured pace')
+        self.stdout.write(f"  {'command':24} {'count':>6} {'captured p50':>12} "
+            f"{'p90':>8} {'replayed p50':>12} {'p90':>8} {'p99':>8}")
+        for command in sorted(replayed):
+            before = sorted(captured[command])
+            after = sorted(replayed[command])
+            self.stdout.write(f'  {command:24} {len(after):6} '
+                f'{percentile(before, 0.5) * 1000:12.1f} {percentile(before, 0.9) * 1000:8.1f} '
+                f'{percentile(after, 0.5) * 1000:12.1f} {percentile(after, 0.9) * 1000:8.1f} '
+                f'{percentile(after, 0.99) * 1000:8.1f}')
+        self.stdout.write(f'  {len(mismatches)} payload(s) replied differently from the capture')
+        for mismatch in mismatches[:10]:
+            self.stdout.write(mismatch)
+
+    def _compare(self, baseline, report, tolerance):
+        if baseline.get('payloads') != report['payloads']:
+            raise CommandError(f"The baseline replayed {baseline.get('payloads')} payloads, "
+                f"this replay {report['payloads']}, replay the same capture.")
+
+        regressions = 0
+        for index, (before, after) in enumerate(zip(baseline['results'], report['results'])):
+            if before['messages'] != after['messages'] or before['status'] != after['status']:
+                regressions += 1
+                if regressions <= 5:
+                    self.stdout.write(f"  FAIL  #{index} {after['command']} replied differently")
+                    for line in difflib.unified_diff(before['messages'], after['messages'],
+                            'baseline', 'replay', lineterm='', n=0):
+                        self.stdout.write(f'        {line[:200]}')
+
+        by_command = defaultdict(lambda: ([], []))
+        for before, after in zip(baseline['results'], report['results']):
+            by_command[after['command'] or 'unrouted'][0].append(before['seconds'])
+            by_command[after['command'] or 'unrouted'][1].append(after['seconds'])
+        for command, (before, after) in sorted(by_command.items()):
+            before_p50 = percentile(sorted(before), 0.5)
+            after_p50 = percentile(sorted(after), 0.5)
+            if after_p50 > before_p50 * (1 + tolerance):
+                regressions += 1
+                self.stdout.write(f'  FAIL  {command} p50 {before_p50 * 1000:.1f} ms '
+                    f'-> {after_p50 * 1000:.1f} ms')
+            else:
+                self.stdout.write(f'  ok    {command} p50 {before_p50 * 1000:.1f} ms '
+                    f'-> {after_p50 * 1000:.1f} ms')
+        return regressions
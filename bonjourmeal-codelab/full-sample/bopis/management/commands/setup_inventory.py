@@ -18,28 +18,29 @@
 Django management command to populate data in CloudSQL database.
 '''
 
-from django.core.management.base import BaseCommand, CommandError
-from bopis.models import *
+import os
 
-import json
+from django.core.management.base import BaseCommand
+from bopis.inventory import sync_inventory
+
+DEFAULT_INVENTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'inventory_items.json')
 
 class Command(BaseCommand):
-    help = 'Setups up the inventory with Bonjour Meal Food & Drink Items'
+    help = 'Syncs the inventory with Bonjour Meal Food & Drink Items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=DEFAULT_INVENTORY_FILE,
+            help='Inventory JSON file to sync from.')
+        parser.add_argument('--keep-missing', action='store_true',
+            help='Leave items that are not in the file available.')
 
     def handle(self, *args, **options):
 
-        items = Item.objects.all()
-        for i in items:
-            i.delete()
-
-        with open('bopis/management/commands/inventory_items.json') as json_file:
-            data = json.load(json_file)
-            for item in data['inventory']:
-                print(item['name'])
-                new_item = Item(
-                    name=item['name'],
-                    image_url=item['image_url'],
-                    price=item['price'],
-                    currency="USD"
-                )
-                new_item.save()
\ No newline at end of file
+        report = sync_inventory(options['file'],
+            deactivate_missing=not options['keep_missing'])
+
+        self.stdout.write(f'Created {report.created}, updated {report.updated}, '
+            f'deactivated {report.deactivated}, unchanged {report.unchanged} items.')
+        self.stdout.write(f'Parsed in {report.parse_seconds:.3f}s, '
+            f'applied in {report.apply_seconds:.3f}s.')
@@ -0,0 +1,50 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Django management command that warms this process up the way /_ah/warmup
+warms an App Engine instance, see bopis/warmup.py, and reports how long
+each stage took. Run in a fresh process it measures the cold-start cost.
+'''
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from bopis.warmup import warm_up
+
+class Command(BaseCommand):
+    help = 'Warms the process up and reports the time of every stage'
+    # The system checks load the URLconf, and with it most of the app.
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true',
+            help='Print the stages as JSON.')
+
+    def handle(self, *args, **options):
+
+        stages = warm_up()
+        if options['json']:
+            self.stdout.write(json.dumps([stage._asdict() for stage in stages]))
+        else:
+            for stage in stages:
+                self.stdout.write(f'  {stage.name:12} {stage.seconds * 1000:9.1f} ms  {stage.result}')
+            self.stdout.write(f"  {'total':12} "
+                f'{sum(stage.seconds for stage in stages) * 1000:9.1f} ms')
+
+        failed = [stage.name for stage in stages if stage.failed]
+        if failed:
+            raise CommandError(f"Warmup stage(s) {', '.join(failed)} failed")
@@ -0,0 +1,320 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Per-request latency breakdown. RequestMetricsMiddleware starts a
+RequestMetrics for every request, the code that parses payloads, queries the
+database, posts to Business Messages, calls Stripe or renders templates
+wraps that work in phase(), and the finished request is added to histograms
+labelled by view and routed command, which render_metrics serves in the
+Prometheus text format.
+
+Phases are exclusive: a query run while rendering a template counts as db
+time, not render time, and whatever is not in any phase counts as app time,
+so the phases of a request add up to its wall time.
+
+Each thread records into its own shard of the histograms and render_metrics
+adds the shards up, so recording a request never waits on a lock shared
+with other requests. The shards of threads that have exited are folded
+into one retired total, so short-lived threads, e.g. of a thread pool that
+replaces its workers, leave no shard behind.
+'''
+
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+PHASES = ('parse', 'db', 'outbound', 'stripe', 'render', 'app')
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0)
+
+_current = contextvars.ContextVar('bopis_request_metrics', default=None)
+
+class RequestMetrics:
+    '''
+    Times the phases of one request.
+    '''
+
+    def __init__(self):
+        self.command = ''
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.started = time.perf_counter()
+        self._phase = 'app'
+        self._phase_started = self.started
+
+    def _switch(self, phase):
+        now = time.perf_counter()
+        self.seconds[self._phase] += now - self._phase_started
+        previous, self._phase, self._phase_started = self._phase, phase, now
+        return previous
+
+    def finish(self):
+        '''
+        Closes the current phase.
+
+        Returns:
+            The :float: wall time of the request in seconds.
+        '''
+        self._switch('app')
+        return self._phase_started - self.started
+
+def start_request():
+    '''
+    Starts timing a request in the current context.
+
+    Returns:
+        The :Token: that end_request needs.
+    '''
+    return _current.set(RequestMetrics())
+
+def end_request(token, view):
+    '''
+    Stops timing the request started with start_request and records it.
+
+    Args:
+        token (Token): The token returned by start_request.
+        view (str): The view that handled the request.
+    '''
+    request_metrics = _current.get()
+    _current.reset(token)
+    record(view, request_metrics)
+
+def is_recording():
+    '''
+    Returns:
+        True if a request is being timed in the current context.
+    '''
+    return _current.get() is not None
+
+def set_command(command):
+    '''
+    Labels the current request with the bot command it was routed to.
+
+    Args:
+        command (str): A CMD_* value.
+    '''
+    request_metrics = _current.get()
+    if request_metrics is not None:
+        request_metrics.command = command
+
+def get_command():
+    '''
+    Returns:
+        The :str: bot command the current request was routed to, or ''.
+    '''
+    request_metrics = _current.get()
+    return request_metrics.command if request_metrics is not None else ''
+
+def get_calls(name):
+    '''
+    Args:
+        name (str): One of PHASES.
+    Returns:
+        The :int: calls the current request made in a phase so far, 0
+        outside a request.
+    '''
+    request_metrics = _current.get()
+    return request_metrics.calls[name] if request_metrics is not None else 0
+
+@contextmanager
+def phase(name, calls=1):
+    '''
+    Counts the enclosed work as one call in a phase of the current request.
+    Does nothing outside a request, e.g. in background jobs.
+
+    Args:
+        name (str): One of PHASES.
+        calls (int): How many calls to count, 0 to time calls counted
+            earlier, e.g. messages queued by the ASGI webhook.
+    '''
+    request_metrics = _current.get()
+    if request_metrics is None:
+        yield
+        return
+    previous = request_metrics._switch(name)
+    request_metrics.calls[name] += calls
+    try:
+        yield
+    finally:
+        request_metrics._switch(previous)
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    '''
+    A connection.execute_wrapper() that counts queries as db time.
+    '''
+    with phase('db'):
+        return execute(sql, params, many, context)
+
+class _Shard:
+    '''
+    The histograms and counters recorded by one thread. Only that thread
+    writes to them.
+    '''
+
+    def __init__(self, thread=None):
+        self.thread = thread
+        # (metric, labels) -> bucket counts, then the +Inf bucket, then the sum.
+        self.histograms = {}
+        # (metric, labels) -> count.
+        self.counters = {}
+
+    def observe(self, metric, labels, value):
+        histogram = self.histograms.get((metric, labels))
+        if histogram is None:
+            histogram = self.histograms[(metric, labels)] = [0] * (len(BUCKETS) + 1) + [0.0]
+        histogram[bisect_left(BUCKETS, value)] += 1
+        histogram[-1] += value
+
+    def increment(self, metric, labels, amount):
+        key = (metric, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def add(self, other):
+        # list() copies without letting the owning thread resize the dict.
+        for key, values in list(other.histograms.items()):
+            total = self.histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(list(values)):
+                total[i] += value
+        for key, value in list(other.counters.items()):
+            self.increment(*key, value)
+
+_local = threading.local()
+_shards = []
+# What the threads that have exited recorded.
+_retired = _Shard()
+_shards_lock = threading.Lock()
+
+def _retire_dead_shards():
+    '''
+    Folds the shards of threads that have exited into _retired. Their
+    threads no longer write to them. Call with _shards_lock held.
+    '''
+    live = []
+    for shard in _shards:
+        if shard.thread.is_alive():
+            live.append(shard)
+        else:
+            _retired.add(shard)
+    _shards[:] = live
+
+def _get_shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _Shard(threading.current_thread())
+        # Taken once per thread, never per request.
+        with _shards_lock:
+            _retire_dead_shards()
+            _shards.append(shard)
+    return shard
+
+def record(view, request_metrics):
+    '''
+    Adds a request to the histograms.
+
+    Args:
+        view (str): The view that handled the request.
+        request_metrics (RequestMetrics): Its timings.
+    '''
+    shard = _get_shard()
+    labels = (('view', view), ('command', request_metrics.command))
+    shard.observe('bopis_request_seconds', labels, request_metrics.finish())
+    for name in PHASES:
+        phase_labels = labels + (('phase', name),)
+        if request_metrics.seconds[name] or request_metrics.calls[name]:
+            shard.observe('bopis_request_phase_seconds', phase_labels,
+                request_metrics.seconds[name])
+        if request_metrics.calls[name]:
+            shard.increment('bopis_request_phase_calls_total', phase_labels,
+                request_metrics.calls[name])
+
+def record_warmup(stage, seconds):
+    '''
+    Adds a warmup stage to the histograms, see bopis/warmup.py.
+
+    Args:
+        stage (str): One of warmup.STAGES.
+        seconds (float): How long it took.
+    '''
+    _get_shard().observe('bopis_warmup_seconds', (('stage', stage),), seconds)
+
+_HELP = {
+    'bopis_request_seconds': ('histogram', 'Wall time of requests.'),
+    'bopis_request_phase_seconds': ('histogram',
+        'Time requests spent parsing, in the database, posting to Business '
+        'Messages, calling Stripe, rendering templates and in the app.'),
+    'bopis_request_phase_calls_total': ('counter',
+        'Payloads parsed, queries run, messages posted, Stripe calls made and '
+        'templates rendered by requests.'),
+    'bopis_warmup_seconds': ('histogram',
+        'Time the stages of warming up a process took.'),
+}
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+def render_metrics():
+    '''
+    Adds up the shards of every thread.
+
+    Returns:
+        The metrics as a :str: in the Prometheus text exposition format.
+    '''
+    total = _Shard()
+    with _shards_lock:
+        _retire_dead_shards()
+        total.add(_retired)
+        shards = list(_shards)
+    for shard in shards:
+        total.add(shard)
+    histograms, counters = total.histograms, total.counters
+
+    lines = []
+    for metric, (kind, description) in _HELP.items():
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} {kind}')
+        if kind == 'counter':
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f'{metric}{_labels(labels)} {value}')
+            continue
+        for (name, labels), values in sorted(histograms.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float('inf'),), values):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{metric}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f'{metric}_sum{_labels(labels)} {values[-1]}')
+            lines.append(f'{metric}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    '''
+    Forgets everything recorded so far, in every thread.
+    '''
+    with _shards_lock:
+        _retired.histograms.clear()
+        _retired.counters.clear()
+        for shard in _shards:
+            shard.histograms.clear()
+            shard.counters.clear()
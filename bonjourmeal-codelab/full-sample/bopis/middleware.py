@@ -0,0 +1,68 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Django middleware of the bopis app.
+'''
+
+from contextlib import ExitStack
+
+from django.db import connections
+
+from . import metrics, profiling
+
+class RequestMetricsMiddleware:
+    '''
+    Records the latency breakdown of every request, see bopis.metrics. Goes
+    first in MIDDLEWARE so that the other middleware is timed too. Requests
+    the ASGI webhook already times, replies included, only get their
+    queries counted.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = None if metrics.is_recording() else metrics.start_request()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(
+                        metrics.db_execute_wrapper))
+                return self.get_response(request)
+        finally:
+            if token is not None:
+                match = request.resolver_match
+                metrics.end_request(token, match.view_name if match else '')
+
+class ProfilingMiddleware:
+    '''
+    Profiles the requests bopis.profiling.choose_profiler picks and writes
+    the profiles to BOPIS_PROFILE_DIR. Goes right after
+    RequestMetricsMiddleware, which labels requests with their command.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profiler = profiling.choose_profiler(request)
+        if profiler is None:
+            return self.get_response(request)
+
+        with profiler:
+            response = self.get_response(request)
+        match = request.resolver_match
+        profiling.save(profiler, match.view_name if match else '', metrics.get_command())
+        return response
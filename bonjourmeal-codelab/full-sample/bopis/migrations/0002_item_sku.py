@@ -0,0 +1,48 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Adds a stable sku to Item and backfills it from the item name.
+'''
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def backfill_sku(apps, schema_editor):
+    Item = apps.get_model('bopis', 'Item')
+    seen = set()
+    for item in Item.objects.order_by('id'):
+        sku = slugify(item.name) or str(item.id)
+        if sku in seen:
+            sku = f'{sku}-{item.id}'
+        seen.add(sku)
+        item.sku = sku
+        item.save(update_fields=['sku'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bopis', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='sku',
+            field=models.CharField(blank=True, default=None, max_length=128, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_sku, migrations.RunPython.noop),
+    ]
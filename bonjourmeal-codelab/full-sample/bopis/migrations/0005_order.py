@@ -0,0 +1,49 @@
+# Generated by Django 3.0.8 on 2026-10-19 05:37
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bopis', '0004_pickupslot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('paid', 'Paid'), ('preparing', 'Preparing'), ('ready', 'Ready for pickup'), ('picked_up', 'Picked up')], default='paid', max_length=16)),
+                ('pickup_datetime', models.DateTimeField(blank=True, default=None, null=True)),
+                ('creation_timestamp', models.DateTimeField(auto_now_add=True)),
+                ('state_timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bopis.Conversation')),
+                ('shopping_cart', models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, to='bopis.ShoppingCart')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['conversation', 'state'], name='order_conversation_state'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['state', 'pickup_datetime'], name='order_state_pickup'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.0.8 on 2026-10-19 05:39
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def backfill_orders(apps, schema_editor):
+    # Carts purchased before orders existed become orders, so that past
+    # purchases are all read from Order.
+    Conversation = apps.get_model('bopis', 'Conversation')
+    Order = apps.get_model('bopis', 'Order')
+    ShoppingCart = apps.get_model('bopis', 'ShoppingCart')
+    now = django.utils.timezone.now()
+    ordered_cart_ids = set(Order.objects.values_list('shopping_cart_id', flat=True))
+    orders = {}
+    for conversation_id, cart_id in Conversation.past_carts.through.objects.filter(
+            shoppingcart__purchased=True).values_list('conversation_id', 'shoppingcart_id'):
+        if cart_id not in ordered_cart_ids:
+            orders[cart_id] = conversation_id
+
+    carts = ShoppingCart.objects.filter(id__in=list(orders)).values_list('id',
+        'purchase_timestamp', 'pickup_datetime')
+    Order.objects.bulk_create([
+        Order(conversation_id=orders[cart_id], shopping_cart_id=cart_id,
+            state='picked_up' if pickup_datetime is None or pickup_datetime < now
+                else 'paid',
+            pickup_datetime=pickup_datetime,
+            creation_timestamp=purchase_timestamp or now, state_timestamp=now)
+        for cart_id, purchase_timestamp, pickup_datetime in carts.iterator()],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bopis', '0005_order'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='creation_timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['conversation', 'creation_timestamp'], name='order_conversation_created'),
+        ),
+        migrations.RunPython(backfill_orders, migrations.RunPython.noop),
+    ]
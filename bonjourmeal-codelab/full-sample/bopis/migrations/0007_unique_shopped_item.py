@@ -0,0 +1,44 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_items(apps, schema_editor):
+    # Concurrent adds could insert an item into a cart twice. Keep the first
+    # row with the summed quantity so the constraint can be added.
+    ShoppedItem = apps.get_model('bopis', 'ShoppedItem')
+    duplicates = ShoppedItem.objects.values('cart_id', 'item_id').annotate(
+        rows=Count('id'), first_id=Min('id'), total=Sum('quantity')).filter(rows__gt=1)
+    for duplicate in duplicates.iterator():
+        ShoppedItem.objects.filter(id=duplicate['first_id']).update(
+            quantity=duplicate['total'])
+        ShoppedItem.objects.filter(cart_id=duplicate['cart_id'],
+            item_id=duplicate['item_id']).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bopis', '0006_order_history'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='shoppeditem',
+            constraint=models.UniqueConstraint(fields=('cart', 'item'), name='unique_shopped_item'),
+        ),
+    ]
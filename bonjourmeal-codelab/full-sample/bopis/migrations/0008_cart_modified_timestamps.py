@@ -0,0 +1,42 @@
+# Generated by Django 3.0.8 on 2026-10-19 07:01
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bopis', '0007_unique_shopped_item'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='modified_timestamp',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='shoppeditem',
+            name='modified_timestamp',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='items_removed_timestamp',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
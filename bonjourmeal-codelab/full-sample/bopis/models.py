@@ -20,7 +20,8 @@ migrations can be applied to a SQL database to create schema associated
 with models defined in this file.
 '''
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.utils import timezone
 
 class Conversation(models.Model):
@@ -51,6 +52,7 @@ class Conversation(models.Model):
             if not self.shopping_cart.purchased:
                 self.shopping_cart.abandoned = True
                 self.shopping_cart.abandoned_timestamp = timezone.now()
+                self.shopping_cart.release_pickup_slot()
             self.past_carts.add(self.shopping_cart)
 
         new_cart = ShoppingCart()
@@ -74,11 +76,19 @@ class Item(models.Model):
     menu_type = models.CharField(max_length=1,
         choices=menu_type_choices,
         default="F")
+    # Stable key used to match rows against the inventory file on sync.
+    sku = models.CharField(max_length=128,
+        unique=True,
+        null=True,
+        default=None,
+        blank=True)
     name = models.CharField(max_length=128)
     price = models.DecimalField(decimal_places=2, max_digits=10)
     currency = models.CharField(max_length=5)
     image_url = models.URLField()
     available = models.BooleanField(default=True)
+    # When the row last changed, for the checkout page's Last-Modified.
+    modified_timestamp = models.DateTimeField(auto_now=True)
 
 class ShoppingCart(models.Model):
     '''
@@ -96,6 +106,31 @@ class ShoppingCart(models.Model):
 
     pickup_date = models.DateField(default=None, null=True, blank=True)
     pickup_datetime = models.DateTimeField(default=None, null=True, blank=True)
+    pickup_slot = models.ForeignKey('PickupSlot',
+        on_delete=models.SET_NULL,
+        null=True,
+        default=None,
+        blank=True)
+    # When items were last taken out of the cart. Together with the
+    # ShoppedItem modified_timestamp it dates the cart's current contents.
+    items_removed_timestamp = models.DateTimeField(default=None, null=True, blank=True)
+
+    def release_pickup_slot(self):
+        '''
+        A method to give the cart's pickup slot reservation back. Only the
+        request that clears the cart's slot gives the capacity back, so
+        concurrent releases cannot free it twice.
+        '''
+        slot_id = self.pickup_slot_id
+        if slot_id is None:
+            return
+
+        with transaction.atomic():
+            if ShoppingCart.objects.filter(id=self.id,
+                    pickup_slot_id=slot_id).update(pickup_slot=None):
+                PickupSlot.objects.filter(id=slot_id, reserved__gt=0).update(
+                    reserved=F('reserved') - 1)
+        self.pickup_slot = None
 
 class ShoppedItem(models.Model):
     '''
@@ -105,6 +140,16 @@ class ShoppedItem(models.Model):
     cart = models.ForeignKey(ShoppingCart, on_delete=models.PROTECT)
     cart_placement_timestamp = models.DateTimeField(default=None, blank=True, null=True)
     quantity = models.IntegerField(default = 1)
+    # When the quantity last changed.
+    modified_timestamp = models.DateTimeField(default=None, blank=True, null=True)
+
+    class Meta:
+        # An item is in a cart once, with its quantity. Also the index behind
+        # the quantity updates, which look up one item of one cart.
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'item'],
+                name='unique_shopped_item'),
+        ]
 
     def place_in(self, cart):
         '''
@@ -112,3 +157,90 @@ class ShoppedItem(models.Model):
         '''
         self.cart = cart
         self.save()
+
+class StripeEvent(models.Model):
+    '''
+    A class to represent a Stripe webhook event that has been processed.
+    Stripe delivers events at least once, the primary key makes a redelivery
+    a no-op.
+    '''
+    def __str__(self):
+        '''
+        A string method used to determine how the object should be printed.
+        '''
+        return f"{self.id} ({self.type})"
+    id = models.CharField(max_length=255, primary_key=True)
+    type = models.CharField(max_length=128)
+    received_timestamp = models.DateTimeField(auto_now_add=True)
+
+class PickupSlot(models.Model):
+    '''
+    A class to represent an hour in which a store hands out orders, and how
+    many orders it can take in that hour.
+    '''
+    def __str__(self):
+        '''
+        A string method used to determine how the object should be printed.
+        '''
+        return f"{self.store_id} {self.start} ({self.reserved}/{self.capacity})"
+    store_id = models.CharField(max_length=64)
+    start = models.DateTimeField()
+    capacity = models.PositiveIntegerField()
+    reserved = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # Also the index behind the availability query, which reads one
+        # store's slots for a day in start order.
+        constraints = [
+            models.UniqueConstraint(fields=['store_id', 'start'],
+                name='unique_pickup_slot_start'),
+        ]
+
+class Order(models.Model):
+    '''
+    A class to represent a paid cart on its way from the kitchen to the user.
+    Orders only move forward, from paid to picked up.
+    '''
+    PAID = 'paid'
+    PREPARING = 'preparing'
+    READY = 'ready'
+    PICKED_UP = 'picked_up'
+    STATE_CHOICES = [
+        (PAID, 'Paid'),
+        (PREPARING, 'Preparing'),
+        (READY, 'Ready for pickup'),
+        (PICKED_UP, 'Picked up'),
+    ]
+    # The state each state moves to next.
+    NEXT_STATE = {PAID: PREPARING, PREPARING: READY, READY: PICKED_UP}
+    OPEN_STATES = [PAID, PREPARING, READY]
+    RESCHEDULABLE_STATES = [PAID, PREPARING]
+
+    def __str__(self):
+        '''
+        A string method used to determine how the object should be printed.
+        '''
+        return f"{self.id} {self.state} {self.pickup_datetime}"
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
+    shopping_cart = models.OneToOneField(ShoppingCart, on_delete=models.PROTECT)
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=PAID)
+    # Copied from the cart so that the kitchen's queries by state and pickup
+    # time are served by one index.
+    pickup_datetime = models.DateTimeField(default=None, null=True, blank=True)
+    # When the order was paid for. Orders backfilled from carts purchased
+    # before orders existed carry the cart's purchase time.
+    creation_timestamp = models.DateTimeField(default=timezone.now)
+    state_timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # A user's purchases, newest first, a page at a time.
+            models.Index(fields=['conversation', 'creation_timestamp'],
+                name='order_conversation_created'),
+            # A user's open orders, for status lookups and rescheduling.
+            models.Index(fields=['conversation', 'state'],
+                name='order_conversation_state'),
+            # The kitchen's queue, e.g. every paid order due before 1 PM.
+            models.Index(fields=['state', 'pickup_datetime'],
+                name='order_state_pickup'),
+        ]
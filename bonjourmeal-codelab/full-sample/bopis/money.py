@@ -0,0 +1,116 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Money arithmetic in integer minor units (cents). Prices are converted from
+Decimal once, after which line totals, subtotal, tax and total are plain int
+arithmetic, so the amount shown on the checkout page is exactly the amount
+charged through Stripe. Tax is rounded half up to the cent from the
+BOPIS_TAX_RATE setting.
+'''
+
+import functools
+import operator
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+
+CartTotals = namedtuple('CartTotals', ['line_totals', 'subtotal', 'tax', 'total'])
+
+_CENT = Decimal('0.01')
+
+def to_minor_units(amount):
+    '''
+    Converts an amount in major units to cents, rounding half up.
+
+    Args:
+        amount (Decimal, str or int): The amount, e.g. Item.price.
+    Returns:
+        An :int: number of cents.
+    '''
+    if not isinstance(amount, Decimal):
+        amount = Decimal(amount)
+    numerator, denominator = amount.as_integer_ratio()
+    if 100 % denominator == 0:
+        # Whole cents, the case for every DecimalField(decimal_places=2).
+        return numerator * (100 // denominator)
+    return int(amount.quantize(_CENT, rounding=ROUND_HALF_UP) * 100)
+
+def format_minor_units(cents):
+    '''
+    Formats cents in major units with two decimals, e.g. 1099 as 10.99.
+
+    Args:
+        cents (int): The amount in cents.
+    Returns:
+        A :str:.
+    '''
+    sign = '-' if cents < 0 else ''
+    whole, fraction = divmod(abs(cents), 100)
+    return f'{sign}{whole}.{fraction:02d}'
+
+@functools.lru_cache(maxsize=None)
+def _rate_ratio(rate):
+    return Decimal(rate).as_integer_ratio()
+
+def get_tax_rate():
+    '''
+    Returns:
+        The configured BOPIS_TAX_RATE as a :Decimal:.
+    '''
+    return Decimal(getattr(settings, 'BOPIS_TAX_RATE', '0'))
+
+def compute_tax(subtotal, tax_rate=None):
+    '''
+    Computes the tax on a subtotal, rounded half up to the cent.
+
+    Args:
+        subtotal (int): The amount in cents.
+        tax_rate (Decimal or str): The rate, BOPIS_TAX_RATE by default.
+    Returns:
+        An :int: number of cents.
+    '''
+    numerator, denominator = _rate_ratio(str(
+        get_tax_rate() if tax_rate is None else tax_rate))
+    return (2 * subtotal * numerator + denominator) // (2 * denominator)
+
+def compute_totals(unit_prices, quantities, tax_rate=None):
+    '''
+    Computes every amount of a cart in one pass.
+
+    Args:
+        unit_prices (sequence): Unit prices in cents.
+        quantities (sequence): Quantities, in the same order.
+        tax_rate (Decimal or str): The rate, BOPIS_TAX_RATE by default.
+    Returns:
+        A :CartTotals: of cents, with one line total per price.
+    '''
+    line_totals = list(map(operator.mul, unit_prices, quantities))
+    subtotal = sum(line_totals)
+    tax = compute_tax(subtotal, tax_rate)
+    return CartTotals(line_totals, subtotal, tax, subtotal + tax)
+
+def cart_totals(cart_entries, tax_rate=None):
+    '''
+    Computes the amounts of a cart read with get_cart_entries.
+
+    Args:
+        cart_entries (list): CartEntry or ShoppedItem objects.
+        tax_rate (Decimal or str): The rate, BOPIS_TAX_RATE by default.
+    Returns:
+        A :CartTotals: of cents, with one line total per entry.
+    '''
+    return compute_totals([to_minor_units(entry.item.price) for entry in cart_entries],
+        [entry.quantity for entry in cart_entries], tax_rate)
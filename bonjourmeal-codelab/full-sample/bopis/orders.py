@@ -0,0 +1,177 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Order lifecycle, paid -> preparing -> ready -> picked up. Status lookups
+are one query on Order's (conversation, state) index and the kitchen's bulk
+transitions one UPDATE on its (state, pickup_datetime) index, so moving a
+whole lunch rush to ready is a single statement. A user's pending pickups
+and past purchases are read a page at a time with keyset pagination.
+'''
+
+from django.db import transaction
+from django.db.models import Subquery
+from django.utils import timezone
+
+from .models import Order, ShoppedItem
+from .pagination import get_page
+from .pickup import reserve_slot
+
+# Orders per page of the pending pickup and past purchase carousels.
+ORDERS_PAGE_SIZE = 5
+
+def create_order(conv, cart):
+    '''
+    Creates the order of a cart that was just paid for. A cart paid for
+    without a pickup time is due as soon as possible.
+
+    Args:
+        conv (Conversation): The conversation the cart belongs to.
+        cart (ShoppingCart): The purchased cart.
+    Returns:
+        The new :Order:.
+    '''
+    now = timezone.now()
+    return Order.objects.create(conversation=conv, shopping_cart=cart,
+        pickup_datetime=cart.pickup_datetime or now,
+        creation_timestamp=cart.purchase_timestamp or now)
+
+def get_open_orders(conversation_id):
+    '''
+    Lists the orders of a conversation that have not been picked up.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+    Returns:
+        A :list: of Order objects, earliest pickup first.
+    '''
+    return list(Order.objects.filter(conversation_id=conversation_id,
+        state__in=Order.OPEN_STATES).order_by('pickup_datetime', 'id'))
+
+def _with_cart_items(orders):
+    return orders.select_related('shopping_cart').prefetch_related(
+        'shopping_cart__shoppeditem_set__item')
+
+def get_pending_orders_page(conversation_id, cursor=None):
+    '''
+    Reads a page of the orders of a conversation that have not been picked
+    up, earliest pickup first.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+        cursor (str): The next_cursor of the previous page.
+    Returns:
+        A :Page: of Order objects with their carts' items.
+    '''
+    return get_page(_with_cart_items(Order.objects.filter(
+        conversation_id=conversation_id, state__in=Order.OPEN_STATES)),
+        'pickup_datetime', cursor, ORDERS_PAGE_SIZE)
+
+def get_purchases_page(conversation_id, cursor=None):
+    '''
+    Reads a page of the orders of a conversation, newest first.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+        cursor (str): The next_cursor of the previous page.
+    Returns:
+        A :Page: of Order objects with their carts' items.
+    '''
+    return get_page(_with_cart_items(Order.objects.filter(
+        conversation_id=conversation_id)),
+        'creation_timestamp', cursor, ORDERS_PAGE_SIZE, descending=True)
+
+def get_order_lines(conversation_id, order_id=None):
+    '''
+    Reads what was bought in an order of a conversation, in one query.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+        order_id (int): The order, else the most recent one.
+    Returns:
+        A :list: of (item id, item name, quantity, available) tuples, empty if
+        the conversation has no such order.
+    '''
+    if order_id is None:
+        order_id = Subquery(Order.objects.filter(conversation_id=conversation_id)
+            .order_by('-creation_timestamp', '-id').values('id')[:1])
+    return list(ShoppedItem.objects.filter(cart__order__conversation_id=conversation_id,
+        cart__order__id=order_id).order_by('id').values_list('item_id', 'item__name',
+        'quantity', 'item__available'))
+
+def get_reschedulable_order(conversation_id, order_id=None):
+    '''
+    Finds an order of a conversation the kitchen has not finished yet.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+        order_id (int): A specific order, else the one picked up soonest.
+    Returns:
+        An :Order: with its shopping cart, or None.
+    '''
+    orders = Order.objects.filter(conversation_id=conversation_id,
+        state__in=Order.RESCHEDULABLE_STATES).select_related('shopping_cart')
+    if order_id is not None:
+        orders = orders.filter(id=order_id)
+    return orders.order_by('pickup_datetime', 'id').first()
+
+def reschedule_order(order, start):
+    '''
+    Moves an order to the pickup slot starting at a time, giving its old slot
+    back. Fails if the slot is full or the order is already ready.
+
+    Args:
+        order (Order): The order, with its shopping cart.
+        start (datetime): The start of the requested slot.
+    Returns:
+        True if the order was moved.
+    '''
+    with transaction.atomic():
+        if not Order.objects.filter(id=order.id,
+                state__in=Order.RESCHEDULABLE_STATES).update(pickup_datetime=start):
+            return False
+        if reserve_slot(order.shopping_cart, start) is None:
+            transaction.set_rollback(True)
+            return False
+
+    order.pickup_datetime = start
+    return True
+
+def transition_orders(from_state, to_state, order_ids=None, pickup_before=None):
+    '''
+    Moves every matching order from one state to the next in one UPDATE.
+    Orders that already moved on are left alone, so repeating a transition
+    is harmless.
+
+    Args:
+        from_state (str): The state the orders are in, e.g. Order.PAID.
+        to_state (str): Order.NEXT_STATE[from_state].
+        order_ids (list): Limit to these orders.
+        pickup_before (datetime): Limit to orders picked up before this time.
+    Returns:
+        The :int: number of orders moved.
+    Raises:
+        ValueError: If to_state does not follow from_state.
+    '''
+    if Order.NEXT_STATE.get(from_state) != to_state:
+        raise ValueError(f'An order cannot go from {from_state} to {to_state}')
+
+    orders = Order.objects.filter(state=from_state)
+    if order_ids is not None:
+        orders = orders.filter(id__in=order_ids)
+    if pickup_before is not None:
+        orders = orders.filter(pickup_datetime__lt=pickup_before)
+    return orders.update(state=to_state, state_timestamp=timezone.now())
@@ -0,0 +1,91 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Keyset (seek) pagination. A page starts after the (timestamp, id) of the
+last row of the previous page instead of at an OFFSET, so with an index on
+the timestamp every page costs what the first one does. Cursors are short
+strings that fit in the postback data of a "more" suggestion.
+'''
+
+import datetime
+from collections import namedtuple
+
+from django.db.models import Q
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+def encode_cursor(timestamp, pk):
+    '''
+    Args:
+        timestamp (datetime): The aware sort timestamp of the last row shown.
+        pk (int): Its primary key, which breaks ties between equal timestamps.
+    Returns:
+        A :str: cursor made of digits and a dot.
+    '''
+    delta = timestamp - _EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+    return f'{microseconds}.{pk}'
+
+def decode_cursor(cursor):
+    '''
+    Args:
+        cursor (str): A cursor from encode_cursor.
+    Returns:
+        The (timestamp, pk) :tuple: it was made from.
+    Raises:
+        ValueError: If the cursor is malformed.
+    '''
+    microseconds, pk = cursor.split('.')
+    pk = int(pk)
+    # Bounded like a bigint, which the database would otherwise reject.
+    if not 0 < pk < 2**63:
+        raise ValueError(f'cursor {cursor!r} is out of range')
+    try:
+        return _EPOCH + datetime.timedelta(microseconds=int(microseconds)), pk
+    except OverflowError as error:
+        raise ValueError(f'cursor {cursor!r} is out of range') from error
+
+def get_page(queryset, field, cursor=None, page_size=5, descending=False):
+    '''
+    Reads a page of a queryset ordered by a non-null timestamp field and id.
+
+    Args:
+        queryset (QuerySet): The rows to page through, already filtered.
+        field (str): The timestamp field to order by.
+        cursor (str): The next_cursor of the previous page, None for the
+            first page.
+        page_size (int): Rows per page.
+        descending (bool): Newest first.
+    Returns:
+        A :Page: with at most page_size items and the cursor of the next
+        page, or None on the last page.
+    '''
+    direction = '-' if descending else ''
+    queryset = queryset.order_by(f'{direction}{field}', f'{direction}pk')
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        lookup = 'lt' if descending else 'gt'
+        # The first condition alone bounds the index range, the second
+        # drops the rows of the boundary timestamp already shown.
+        queryset = queryset.filter(Q(**{f'{field}__{lookup}e': timestamp}),
+            Q(**{f'{field}__{lookup}': timestamp}) | Q(**{f'pk__{lookup}': pk}))
+
+    items = list(queryset[:page_size + 1])
+    if len(items) <= page_size:
+        return Page(items, None)
+    last = items[page_size - 1]
+    return Page(items[:page_size], encode_cursor(getattr(last, field), last.pk))
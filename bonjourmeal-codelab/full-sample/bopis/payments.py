@@ -0,0 +1,138 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Payment completion driven by Stripe webhooks. Stripe signs every event and
+may deliver it more than once, so events are verified, deduplicated through
+StripeEvent and applied in the same transaction that records them. The
+confirmation message is sent from the background pool once that transaction
+commits, keeping Business Messages calls out of the webhook response.
+'''
+
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import background
+from .cart_store import get_cart_store
+from .checkout import invalidate_checkout_session
+from .models import Conversation, StripeEvent
+from .orders import create_order
+from .sdk import stripe
+from .view_utils import send_payment_confirmation_message
+
+logger = logging.getLogger(__name__)
+
+def construct_event(payload, signature):
+    '''
+    Parses a webhook payload and checks its Stripe-Signature header against
+    STRIPE_WEBHOOK_SECRET.
+
+    Args:
+        payload (bytes): The raw request body.
+        signature (str): The Stripe-Signature header.
+    Returns:
+        A :stripe.Event:.
+    Raises:
+        ValueError: If the payload is malformed or the signature is invalid.
+    '''
+    try:
+        return stripe.Webhook.construct_event(payload, signature,
+            settings.STRIPE_WEBHOOK_SECRET)
+    except stripe.error.SignatureVerificationError as error:
+        raise ValueError(str(error)) from error
+
+def process_event(event):
+    '''
+    Applies a verified Stripe event once.
+
+    Args:
+        event (stripe.Event): The event sent to the webhook.
+    Returns:
+        True if the event was new, False if it had been processed before.
+    '''
+    with transaction.atomic():
+        _, created = StripeEvent.objects.get_or_create(id=event['id'],
+            defaults={'type': event['type']})
+        if not created:
+            return False
+
+        if event['type'] == 'checkout.session.completed':
+            record_purchase(event['data']['object'])
+    return True
+
+def record_purchase(session):
+    '''
+    Marks the cart a checkout session paid for as purchased and creates its
+    order. Must run inside a transaction. If the cart is the conversation's
+    current one, its items are saved and the conversation starts a new cart.
+    A cart that was replaced before the payment came in, e.g. abandoned with
+    the checkout page still open, is purchased all the same and the current
+    cart is left alone. A payment for a cart that was already purchased or
+    that the conversation never had records nothing and is logged as an
+    error, for the payment to be refunded.
+
+    Args:
+        session (stripe.checkout.Session): The completed checkout session.
+    '''
+    metadata = session.get('metadata') or {}
+    conversation_id = metadata.get('conversation_id') or session.get(
+        'client_reference_id')
+    conv = Conversation.objects.select_for_update().filter(
+        id=conversation_id).first()
+    if conv is None:
+        logger.warning('Checkout session %s has no conversation', session['id'])
+        return
+
+    store = get_cart_store()
+    # Sessions made before the metadata carried the ShoppingCart paid for the
+    # conversation's current one.
+    paid_for = metadata.get('shopping_cart_id', str(conv.shopping_cart_id))
+    is_current = (paid_for == str(conv.shopping_cart_id)
+        and metadata.get('cart_id') == store.get_cart_id(conversation_id))
+    if is_current:
+        cart = conv.shopping_cart
+    else:
+        cart = conv.past_carts.select_for_update().filter(id=paid_for).first()
+    if cart is None or cart.purchased:
+        # E.g. a second session for the same cart was paid as well.
+        logger.error('Checkout session %s paid for cart %s, which %s', session['id'],
+            paid_for, 'is already purchased' if cart else 'the conversation never had')
+        return
+
+    if is_current:
+        store.save_items(conversation_id, cart)
+    else:
+        logger.warning('Checkout session %s paid for cart %s after it was '
+            'replaced, recording its order', session['id'], paid_for)
+    cart.purchased = True
+    cart.purchase_timestamp = timezone.now()
+    cart.abandoned = False
+    cart.abandoned_timestamp = None
+    cart.total_paid = Decimal(session.get('amount_total') or 0) / 100
+    cart.currency = (session.get('currency') or cart.currency).upper()
+    cart.save(update_fields=['purchased', 'purchase_timestamp', 'abandoned',
+        'abandoned_timestamp', 'total_paid', 'currency'])
+    create_order(conv, cart)
+
+    if is_current:
+        invalidate_checkout_session(conversation_id)
+        store.start_new_cart(conv)
+    transaction.on_commit(lambda: background.submit(
+        send_payment_confirmation_message, conversation_id))
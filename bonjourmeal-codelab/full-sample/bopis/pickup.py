@@ -0,0 +1,191 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Pickup slot capacity. Every store has one PickupSlot row per hour of its
+BOPIS_BUSINESS_HOURS with the number of orders the kitchen can hand out in it. Only slots with
+capacity left are offered, and picking a time reserves it with a single
+conditional UPDATE, so concurrent bookings can never take a slot past its
+capacity.
+'''
+
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import PickupSlot, ShoppingCart
+
+SLOTS_CREATED_CACHE_KEY_PREFIX = 'bopis:pickup-slots:'
+
+def get_store_id():
+    '''
+    Returns:
+        The :str: id of the store orders are picked up from.
+    '''
+    return getattr(settings, 'BOPIS_PICKUP_STORE_ID', 'bonjour-meal')
+
+def get_week_business_hours():
+    '''
+    Returns:
+        A :list: of the (opening hour, closing hour) of each weekday, Monday
+        first, from BOPIS_BUSINESS_HOURS. None for days the store is closed.
+    '''
+    return getattr(settings, 'BOPIS_BUSINESS_HOURS', [(8, 20)] * 7)
+
+def get_business_hours(day):
+    '''
+    Args:
+        day (date): The day.
+    Returns:
+        The (opening hour, closing hour) :tuple: of the day, or None if the
+        store is closed.
+    '''
+    return get_week_business_hours()[day.weekday()]
+
+def get_capacity(hour):
+    '''
+    Returns how many orders can be picked up in an hour, from
+    BOPIS_PICKUP_SLOT_CAPACITY_BY_HOUR or else BOPIS_PICKUP_SLOT_CAPACITY.
+
+    Args:
+        hour (int): The hour of the day, 0 to 23.
+    Returns:
+        An :int: capacity.
+    '''
+    by_hour = getattr(settings, 'BOPIS_PICKUP_SLOT_CAPACITY_BY_HOUR', {})
+    return by_hour.get(hour, getattr(settings, 'BOPIS_PICKUP_SLOT_CAPACITY', 10))
+
+def get_slot_start(day, hour):
+    '''
+    Args:
+        day (date): The pickup date.
+        hour (int): The hour of the day, 0 to 23.
+    Returns:
+        The aware :datetime: the slot starts at, in the store's time zone.
+    '''
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time(hour)))
+
+def ensure_slots(day, store_id=None):
+    '''
+    Creates the day's slots, one per business hour, if they do not exist yet. Existing slots keep
+    their reservations. A cache flag saves the INSERT on later calls.
+
+    Args:
+        day (date): The pickup date.
+        store_id (str): The store, get_store_id() by default.
+    '''
+    store_id = store_id or get_store_id()
+    key = f'{SLOTS_CREATED_CACHE_KEY_PREFIX}{store_id}:{day.isoformat()}'
+    if cache.get(key):
+        return
+
+    business_hours = get_business_hours(day)
+    if business_hours is not None:
+        PickupSlot.objects.bulk_create([
+            PickupSlot(store_id=store_id, start=get_slot_start(day, hour),
+                capacity=get_capacity(hour))
+            for hour in range(*business_hours)], ignore_conflicts=True)
+    cache.set(key, True, 2 * 24 * 60 * 60)
+
+def get_open_slots_query(day, store_id=None, after=None):
+    '''
+    Builds the query behind get_open_slots, one read of the (store_id, start)
+    index.
+
+    Args:
+        day (date): The pickup date.
+        store_id (str): The store, get_store_id() by default.
+        after (datetime): Leave out slots starting at or before this time.
+    Returns:
+        A :QuerySet: of PickupSlot objects ordered by start.
+    '''
+    slots = PickupSlot.objects.filter(store_id=store_id or get_store_id(),
+        start__gte=get_slot_start(day, 0),
+        start__lt=get_slot_start(day + datetime.timedelta(days=1), 0),
+        reserved__lt=F('capacity'))
+    if after is not None:
+        slots = slots.filter(start__gt=after)
+    return slots.order_by('start')
+
+def get_open_slots(day, store_id=None, after=None):
+    '''
+    Lists the slots of a day that still have capacity, creating the day's
+    slots first if needed.
+
+    Args:
+        day (date): The pickup date.
+        store_id (str): The store, get_store_id() by default.
+        after (datetime): Leave out slots starting at or before this time.
+    Returns:
+        A :list: of PickupSlot objects ordered by start.
+    '''
+    store_id = store_id or get_store_id()
+    ensure_slots(day, store_id)
+    return list(get_open_slots_query(day, store_id, after))
+
+def reserve_slot(cart, start, store_id=None):
+    '''
+    Reserves the slot starting at a time for a cart, giving back the slot
+    the cart held before. Reserving the slot the cart already holds is a
+    no-op.
+
+    Args:
+        cart (ShoppingCart): The cart being picked up.
+        start (datetime): The start of the requested slot.
+        store_id (str): The store, get_store_id() by default.
+    Returns:
+        The reserved :PickupSlot:, or None if it is full, has started or
+        does not exist.
+    '''
+    if start <= timezone.now():
+        return None
+    store_id = store_id or get_store_id()
+    ensure_slots(timezone.localtime(start).date(), store_id)
+
+    with transaction.atomic():
+        held_slot_id = ShoppingCart.objects.select_for_update().filter(
+            id=cart.id).values_list('pickup_slot_id', flat=True).first()
+        slot = PickupSlot.objects.filter(store_id=store_id, start=start).first()
+        if slot is None:
+            return None
+
+        if held_slot_id != slot.id:
+            if held_slot_id is not None:
+                # Lock both slots in id order so that two carts swapping
+                # slots cannot deadlock.
+                list(PickupSlot.objects.select_for_update().filter(
+                    id__in=[held_slot_id, slot.id]).order_by('id'))
+
+            if not PickupSlot.objects.filter(id=slot.id,
+                    reserved__lt=F('capacity')).update(reserved=F('reserved') + 1):
+                return None
+
+            if held_slot_id is not None:
+                PickupSlot.objects.filter(id=held_slot_id, reserved__gt=0).update(
+                    reserved=F('reserved') - 1)
+
+        pickup_date = timezone.localtime(start).date()
+        ShoppingCart.objects.filter(id=cart.id).update(pickup_slot=slot,
+            pickup_date=pickup_date, pickup_datetime=start)
+
+    cart.pickup_slot = slot
+    cart.pickup_date = pickup_date
+    cart.pickup_datetime = start
+    return slot
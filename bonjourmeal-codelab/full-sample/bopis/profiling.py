@@ -0,0 +1,240 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+On-demand request profiling. ProfilingMiddleware asks choose_profiler
+whether to profile a request, which it does when BOPIS_PROFILE_DIR is set
+and either the request carries an X-Bopis-Profile header equal to
+BOPIS_PROFILE_TOKEN or it falls in the random BOPIS_PROFILE_SAMPLE_RATE
+fraction of requests.
+
+A request asked for by header runs under cProfile and is written as a pstats
+file. A sampled request has its stack read every BOPIS_PROFILE_INTERVAL
+seconds by a background thread, which costs the request next to nothing and
+sees time spent waiting on the database or Business Messages too, and is
+written as collapsed stacks, one "frame;frame;frame count" line per stack.
+Only the newest BOPIS_PROFILE_KEEP profiles are kept.
+
+`manage.py merge_profiles` merges the profiles into one flamegraph-ready
+report.
+'''
+
+import cProfile
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_SUFFIX = '.collapsed'
+CPROFILE_SUFFIX = '.prof'
+
+PROFILE_HEADER = 'X-Bopis-Profile'
+
+# Only one cProfile at a time, newer Pythons refuse a second one anyway.
+_cprofile_lock = threading.Lock()
+
+_labels = {}
+
+def _get_label(code):
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        prefix = max((path for path in sys.path
+            if path and filename.startswith(path + os.sep)), key=len, default='')
+        if prefix:
+            filename = filename[len(prefix) + 1:]
+        # Semicolons separate frames and spaces the count in collapsed stacks.
+        label = _labels[code] = re.sub(r'[; ]', '_',
+            f'{code.co_name}:{filename}:{code.co_firstlineno}')
+    return label
+
+class StackSampler:
+    '''
+    Samples the stack of the thread that enters it from a background
+    thread, below the frame that entered it.
+
+    Attributes:
+        interval (float): Seconds between samples.
+        stacks (Counter): Samples by stack, outermost frame first, joined
+            with semicolons.
+    '''
+
+    suffix = SAMPLE_SUFFIX
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_id = None
+        self._root = None
+
+    def __enter__(self):
+        self._root = sys._getframe(1)
+        self._thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+            name='bopis-profile-sampler')
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._root = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            labels = []
+            while frame is not None and frame is not self._root:
+                labels.append(_get_label(frame.f_code))
+                frame = frame.f_back
+            if labels:
+                self.stacks[';'.join(reversed(labels))] += 1
+
+    def write(self, path):
+        '''
+        Writes the samples as collapsed stacks.
+
+        Args:
+            path (str): The file to write.
+        '''
+        with open(path, 'w') as output:
+            for stack, count in sorted(self.stacks.items()):
+                output.write(f'{stack} {count}\n')
+
+class CallProfiler:
+    '''
+    Runs the enclosed code in the current thread under cProfile.
+
+    Attributes:
+        profile (Profile): The cProfile profile.
+    '''
+
+    suffix = CPROFILE_SUFFIX
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        try:
+            self.profile.enable()
+        except BaseException:
+            # __exit__ is not called, e.g. another profiler is already active.
+            _cprofile_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        _cprofile_lock.release()
+
+    def write(self, path):
+        '''
+        Writes the profile as pstats.
+
+        Args:
+            path (str): The file to write.
+        '''
+        self.profile.dump_stats(path)
+
+def choose_profiler(request):
+    '''
+    Decides whether to profile a request.
+
+    Args:
+        request (HttpRequest): The request.
+    Returns:
+        A :CallProfiler: or :StackSampler: to run the request in, or None.
+    '''
+    if not settings.BOPIS_PROFILE_DIR:
+        return None
+    token = settings.BOPIS_PROFILE_TOKEN
+    if token and hmac.compare_digest(
+            request.headers.get(PROFILE_HEADER, '').encode(), token.encode()) \
+            and _cprofile_lock.acquire(blocking=False):
+        return CallProfiler()
+    if random.random() < settings.BOPIS_PROFILE_SAMPLE_RATE:
+        return StackSampler(settings.BOPIS_PROFILE_INTERVAL)
+    return None
+
+def _get_name_part(value):
+    return re.sub(r'[^\w.]+', '_', value) or 'none'
+
+def parse_profile_name(name):
+    '''
+    Reads the view and command out of the name of a profile save wrote.
+
+    Args:
+        name (str): The file name.
+    Returns:
+        A (view, command) tuple, or None for other files.
+    '''
+    stem, suffix = os.path.splitext(name)
+    parts = stem.split('-')
+    if suffix not in (SAMPLE_SUFFIX, CPROFILE_SUFFIX) or len(parts) != 4:
+        return None
+    return parts[2], parts[3]
+
+def save(profiler, view, command):
+    '''
+    Writes a profile to BOPIS_PROFILE_DIR as
+    <time>-<random>-<view>-<command><suffix> and deletes the oldest profiles
+    beyond BOPIS_PROFILE_KEEP. Failing to write is logged, not raised.
+
+    Args:
+        profiler (CallProfiler or StackSampler): A finished profiler.
+        view (str): The view that handled the request.
+        command (str): The bot command it was routed to, if any.
+    Returns:
+        The path written, or None.
+    '''
+    directory = settings.BOPIS_PROFILE_DIR
+    name = (f'{timezone.now():%Y%m%dT%H%M%S.%f}-{random.getrandbits(32):08x}-'
+        f'{_get_name_part(view)}-{_get_name_part(command)}{profiler.suffix}')
+    path = os.path.join(directory, name)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profiler.write(path)
+        prune(directory, settings.BOPIS_PROFILE_KEEP)
+    except OSError as error:
+        logger.warning('Could not write profile %s: %s', path, error)
+        return None
+    return path
+
+def prune(directory, keep):
+    '''
+    Deletes all but the newest keep profiles in a directory.
+
+    Args:
+        directory (str): The profile directory.
+        keep (int): Profiles to keep.
+    '''
+    names = sorted(name for name in os.listdir(directory)
+        if parse_profile_name(name) is not None)
+    for name in names[:max(len(names) - keep, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            # Another request pruned it first.
+            pass
@@ -0,0 +1,124 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+How many queries each bot command may run, not counting the BEGIN and
+savepoints of transaction.atomic() blocks. bopis/tests/test_query_budgets.py
+replays every command with carts of 1, 10 and 100 items and fails when a
+command goes over its budget or runs more queries for a bigger cart. With
+DEBUG on, route_message also logs a warning whenever a command goes over its
+budget.
+
+Budgets cover creating the day's pickup slots, which takes one query once
+per day and process, so the pickup date and time commands and
+reschedule_order stay within them on a cold cache.
+
+add_to_cart reads the item, then the cart id, then runs the UPDATE that tops
+up an item already in the cart and the INSERT when it is not, four queries.
+The fifth query of its budget creates the cart on a conversation's first
+add.
+
+Raising a budget should come with a reason in the commit that does it.
+'''
+
+import logging
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from .view_constants import (CMD_ABANDON_CART, CMD_ADD_TO_CART,
+    CMD_CART_BREAKDOWN, CMD_CHECK_ORDER_STATUS, CMD_CONF_PICKUP_DETAILS,
+    CMD_DRINK_MENU, CMD_FOOD_MENU, CMD_PURCHASE_CART, CMD_REMOVE_ALL_FROM_CART,
+    CMD_REMOVE_FROM_CART, CMD_REORDER, CMD_RESCHEDULE_ORDER,
+    CMD_RESET_PICKUP_DETAILS, CMD_SET_PICKUP_DATE, CMD_SET_PICKUP_TIME,
+    CMD_SHOW_CART, CMD_SHOW_HOURS, CMD_SHOW_PENDING_PICKUP, CMD_SHOW_PURCHASES)
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUDGETS = {
+    CMD_FOOD_MENU: 1,
+    CMD_DRINK_MENU: 1,
+    CMD_SHOW_HOURS: 0,
+    CMD_ADD_TO_CART: 5,
+    CMD_REMOVE_FROM_CART: 6,
+    CMD_REMOVE_ALL_FROM_CART: 5,
+    CMD_CART_BREAKDOWN: 2,
+    CMD_SHOW_CART: 2,
+    CMD_ABANDON_CART: 5,
+    CMD_PURCHASE_CART: 1,
+    CMD_SET_PICKUP_DATE: 3,
+    CMD_SET_PICKUP_TIME: 5,
+    CMD_RESET_PICKUP_DETAILS: 1,
+    CMD_CONF_PICKUP_DETAILS: 0,
+    CMD_SHOW_PENDING_PICKUP: 3,
+    CMD_SHOW_PURCHASES: 3,
+    CMD_CHECK_ORDER_STATUS: 1,
+    CMD_RESCHEDULE_ORDER: 9,
+    CMD_REORDER: 7,
+}
+
+_TRANSACTION_PREFIXES = ('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT',
+    'ROLLBACK TO SAVEPOINT')
+
+class QueryCounter:
+    '''
+    A connection.execute_wrapper() that counts queries other than BEGIN
+    and savepoints.
+
+    Attributes:
+        count (int): Queries run so far.
+    '''
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.startswith(_TRANSACTION_PREFIXES):
+            self.count += 1
+        return execute(sql, params, many, context)
+
+@contextmanager
+def count_queries():
+    '''
+    Counts the queries the enclosed code runs on any database.
+
+    Yields:
+        A :QueryCounter:.
+    '''
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
+
+@contextmanager
+def watch_query_budget(command):
+    '''
+    With DEBUG on, logs a warning when the enclosed handling of a command
+    runs more queries than its budget. Does nothing otherwise.
+
+    Args:
+        command (str): The CMD_* value being handled.
+    '''
+    budget = QUERY_BUDGETS.get(command)
+    if not settings.DEBUG or budget is None:
+        yield
+        return
+
+    with count_queries() as counter:
+        yield
+    if counter.count > budget:
+        logger.warning('%s ran %d queries, its budget is %d', command,
+            counter.count, budget)
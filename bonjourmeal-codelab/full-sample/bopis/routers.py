@@ -0,0 +1,176 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Database router that sends read-only Bonjour Meal queries to a read replica.
+
+Only code wrapped in read_replica() is eligible for the replica, everything
+else (including every write) goes to the primary. Once a conversation writes
+to the primary it is pinned there for BOPIS_REPLICA_STICKY_SECONDS so the user
+never reads back a cart that is missing the item they just added. The pin is
+kept in the default cache, which must be shared by every instance (memcached),
+otherwise a write handled on one instance would not pin reads on another.
+'''
+
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+
+STICKY_CACHE_KEY_PREFIX = 'bopis:db-sticky:'
+
+# Cache backends that keep nothing other processes can see.
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+_read_only = contextvars.ContextVar('bopis_read_only', default=False)
+_conversation_id = contextvars.ContextVar('bopis_conversation_id', default=None)
+
+def get_replica_alias():
+    '''
+    Returns the database alias of the read replica.
+
+    Returns:
+        The alias configured by BOPIS_REPLICA_DATABASE, or None if that alias
+        is not defined in DATABASES.
+    '''
+    alias = getattr(settings, 'BOPIS_REPLICA_DATABASE', 'replica')
+    if alias in settings.DATABASES:
+        return alias
+    return None
+
+@contextmanager
+def read_replica():
+    '''
+    Marks the queries made inside the block as safe to serve from the replica.
+    Can also be used as a function decorator.
+    '''
+    token = _read_only.set(True)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+@contextmanager
+def conversation_scope(conversation_id):
+    '''
+    Ties the queries made inside the block to a conversation so that writes
+    pin it to the primary and reads honour that pin.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+    '''
+    token = _conversation_id.set(str(conversation_id) if conversation_id else None)
+    try:
+        yield
+    finally:
+        _conversation_id.reset(token)
+
+def pin_to_primary(conversation_id):
+    '''
+    Sends reads for a conversation to the primary for the sticky window.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+    '''
+    cache.set(STICKY_CACHE_KEY_PREFIX + conversation_id, True,
+        getattr(settings, 'BOPIS_REPLICA_STICKY_SECONDS', 10))
+
+def is_pinned_to_primary(conversation_id):
+    '''
+    Checks whether a conversation wrote recently enough to be read from the
+    primary.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+    Returns:
+        True if the conversation is inside its sticky window.
+    '''
+    return cache.get(STICKY_CACHE_KEY_PREFIX + conversation_id, False)
+
+class ReadReplicaRouter:
+    '''
+    Routes reads of bopis models to the replica inside read_replica() blocks
+    and every write of bopis models to the primary.
+    '''
+    app_label = 'bopis'
+
+    def __init__(self):
+        backend = settings.CACHES['default']['BACKEND']
+        if get_replica_alias() is not None and backend in PROCESS_LOCAL_CACHES:
+            raise ImproperlyConfigured(f'The read replica needs a cache shared '
+                f'by every instance to pin conversations to the primary, the '
+                f'default cache is {backend}. Set BOPIS_MEMCACHED_HOSTS.')
+
+    def db_for_read(self, model, **hints):
+        '''
+        Picks the replica for read-only code unless the conversation is
+        pinned to the primary.
+        '''
+        if model._meta.app_label != self.app_label:
+            return None
+
+        replica = get_replica_alias()
+        if replica is None:
+            return None
+
+        if not _read_only.get():
+            # Objects loaded from the replica would otherwise drag related
+            # lookups back to it through their instance hints.
+            return DEFAULT_DB_ALIAS
+
+        conversation_id = _conversation_id.get()
+        if conversation_id and is_pinned_to_primary(conversation_id):
+            return DEFAULT_DB_ALIAS
+
+        return replica
+
+    def db_for_write(self, model, **hints):
+        '''
+        Sends writes to the primary and starts the sticky window for the
+        current conversation.
+        '''
+        if model._meta.app_label != self.app_label:
+            return None
+
+        conversation_id = _conversation_id.get()
+        if conversation_id and get_replica_alias() is not None:
+            pin_to_primary(conversation_id)
+
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        '''
+        The replica mirrors the primary so relations across them are fine.
+        '''
+        replica = get_replica_alias()
+        if replica is None:
+            return None
+        databases = {DEFAULT_DB_ALIAS, replica}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        '''
+        The replica receives its schema through replication, never migrations.
+        '''
+        if db == get_replica_alias():
+            return False
+        return None
@@ -0,0 +1,81 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Lazy access to the client libraries that are slow to import. Importing
+stripe, the Business Messages client and messages, oauth2client and
+apitools takes a cold worker longer than the rest of bopis.views together,
+and the admin and checkout pages need few of them. Code uses the proxies
+here like the modules, e.g. bm_messages.BusinessMessagesMessage(...), and
+each library is imported on first use. `manage.py importtime` shows what
+a cold import costs.
+'''
+
+import importlib
+import threading
+
+class LazyModule:
+    '''
+    Stands in for a module that is imported, and configured, on first
+    attribute access. Setting an attribute sets it on the module.
+    '''
+
+    def __init__(self, name, configure=None):
+        self.__dict__.update(_name=name, _configure=configure, _module=None,
+            _lock=threading.Lock())
+
+    @property
+    def module_name(self):
+        '''
+        The name of the module, e.g. 'stripe'.
+        '''
+        return self._name
+
+    def load(self):
+        '''
+        Imports and configures the module unless that happened already.
+
+        Returns:
+            The module.
+        '''
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._configure is not None:
+                        self._configure(module)
+                    self.__dict__['_module'] = module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.load(), name, value)
+
+    def __repr__(self):
+        return f"<LazyModule {self._name}{'' if self._module is None else ' (loaded)'}>"
+
+def _configure_stripe(module):
+    from .view_constants import STRIPE_API_KEY, STRIPE_MAX_NETWORK_RETRIES
+    module.api_key = STRIPE_API_KEY
+    module.max_network_retries = STRIPE_MAX_NETWORK_RETRIES
+
+stripe = LazyModule('stripe', configure=_configure_stripe)
+bm_client = LazyModule('businessmessages.businessmessages_v1_client')
+bm_messages = LazyModule('businessmessages.businessmessages_v1_messages')
+service_account = LazyModule('oauth2client.service_account')
+encoding = LazyModule('apitools.base.py.encoding')
+
+MODULES = (stripe, bm_client, bm_messages, service_account, encoding)
@@ -0,0 +1,465 @@
+# pylint: disable=no-member
+
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Local stand-ins for the services the agent talks to, and a seeded
+conversation with a message for every bot command. The tests and the
+replay, loadgen and bench_* commands use them, so they ship with the app
+rather than in bopis/tests, which is not deployed.
+
+BusinessMessagesStub listens on a loopback port, accepts the messages
+send_message posts after a configurable delay and echoes them back the way
+the API does.
+
+StripeStub listens on a loopback port, creates checkout sessions after a
+configurable delay and honours Idempotency-Key the way Stripe does: a key
+replays its first response, and a key whose first request is still in
+flight gets a 409 that the Stripe library retries.
+
+FakeDatastoreClient keeps Datastore entities in a dict for
+DatastoreCartStore.
+
+FakeSender, replaying, seed and get_messages replay commands through
+route_message without any network.
+'''
+
+import contextlib
+import datetime
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs
+
+from apitools.base.py import encoding
+from django.test import override_settings
+from django.utils import timezone
+from bopis import orders, pickup, view_constants, view_utils, views
+from bopis.cart_store import get_cart_store
+from bopis.models import Conversation, Item, ShoppedItem, ShoppingCart
+from bopis.sdk import stripe
+
+MESSAGES_PATH = re.compile(r'^/v1/conversations/([^/]+)/messages(\?.*)?$')
+
+class _Server(ThreadingHTTPServer):
+    # Benchmarks open many connections at once.
+    request_queue_size = 1024
+
+class BusinessMessagesStub:
+    '''
+    Serves POST /v1/conversations/<id>/messages.
+
+    Attributes:
+        latency (float): Seconds every message takes.
+        received (Counter): Messages received by conversation id.
+        messages (list): (conversation id, message) pairs in the order they
+            were received.
+        url (str): Where the stub listens while it runs.
+    '''
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.received = Counter()
+        self.messages = []
+        self.url = None
+        self._lock = threading.Lock()
+        self._server = None
+
+    def receive(self, conversation_id, message):
+        '''
+        Accepts a message.
+
+        Returns:
+            A (status, body) tuple.
+        '''
+        time.sleep(self.latency)
+        with self._lock:
+            self.received[conversation_id] += 1
+            self.messages.append((conversation_id, dict(message)))
+        message['name'] = (f'conversations/{conversation_id}/messages/'
+            f"{message.get('messageId', '')}")
+        return 200, message
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode('utf8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                match = MESSAGES_PATH.match(self.path)
+                if match is None:
+                    self._reply(404, {'error': {'code': 404, 'message': 'Unknown path'}})
+                    return
+                self._reply(*stub.receive(match.group(1), json.loads(body or b'{}')))
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    @contextlib.contextmanager
+    def running(self, port=0):
+        '''
+        Serves the stub on a loopback port and points send_message at it for
+        the duration of the block. A server in another process needs
+        BOPIS_BUSINESS_MESSAGES_URL set to the stub's url instead.
+
+        Args:
+            port (int): The port, 0 for any free one.
+        '''
+        self._server = _Server(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+
+        self.url = f'http://127.0.0.1:{self._server.server_port}/'
+        try:
+            with override_settings(BOPIS_BUSINESS_MESSAGES_URL=self.url):
+                yield self
+        finally:
+            self._server.shutdown()
+            self._server.server_close()
+
+SESSION_LIFETIME = 24 * 60 * 60
+
+class StripeStub:
+    '''
+    Serves POST /v1/checkout/sessions and GET /v1/checkout/sessions/<id>.
+
+    Attributes:
+        latency (float): Seconds every create call takes.
+        requests (int): Create requests received, replays included.
+        created (list): The sessions created, in order.
+    '''
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.created = []
+        self._sessions = {}
+        self._responses = {}
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._server = None
+
+    def create_session(self, idempotency_key, params):
+        '''
+        Creates a session or replays the response made for the key.
+
+        Returns:
+            A (status, body) tuple.
+        '''
+        with self._lock:
+            self.requests += 1
+            if idempotency_key in self._responses:
+                return self._responses[idempotency_key]
+            if idempotency_key in self._in_flight:
+                return 409, {'error': {'type': 'idempotency_error',
+                    'message': 'A request with this key is in progress.'}}
+            self._in_flight.add(idempotency_key)
+
+        time.sleep(self.latency)
+        session = {
+            'id': f'cs_test_{next(self._ids):06d}',
+            'object': 'checkout.session',
+            'expires_at': int(time.time()) + SESSION_LIFETIME,
+            'payment_status': 'unpaid',
+            'amount_total': int(params.get('line_items[0][price_data][unit_amount]', ['0'])[0]),
+            'success_url': params.get('success_url', [''])[0],
+        }
+        with self._lock:
+            self._sessions[session['id']] = session
+            self._responses[idempotency_key] = (200, session)
+            self._in_flight.discard(idempotency_key)
+            self.created.append(session)
+        return 200, session
+
+    def retrieve_session(self, session_id):
+        '''
+        Returns:
+            A (status, body) tuple.
+        '''
+        session = self._sessions.get(session_id)
+        if session is None:
+            return 404, {'error': {'type': 'invalid_request_error',
+                'message': f'No such checkout.session: {session_id}'}}
+        return 200, session
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode('utf8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                if self.path != '/v1/checkout/sessions':
+                    self._reply(404, {'error': {'message': 'Unknown path'}})
+                    return
+                length = int(self.headers.get('Content-Length', 0))
+                params = parse_qs(self.rfile.read(length).decode('utf8'))
+                self._reply(*stub.create_session(
+                    self.headers.get('Idempotency-Key'), params))
+
+            def do_GET(self):
+                prefix = '/v1/checkout/sessions/'
+                if not self.path.startswith(prefix):
+                    self._reply(404, {'error': {'message': 'Unknown path'}})
+                    return
+                self._reply(*stub.retrieve_session(self.path[len(prefix):]))
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    @contextlib.contextmanager
+    def running(self):
+        '''
+        Serves the stub on a free loopback port and points the Stripe library
+        at it for the duration of the block.
+        '''
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+
+        saved = stripe.api_base, stripe.api_key
+        stripe.api_base = f'http://127.0.0.1:{self._server.server_port}'
+        stripe.api_key = 'sk_test_stub'
+        try:
+            yield self
+        finally:
+            stripe.api_base, stripe.api_key = saved
+            self._server.shutdown()
+            self._server.server_close()
+
+class FakeDatastoreClient:
+    '''
+    Implements the subset of google.cloud.datastore.Client that
+    bopis.cart_store.DatastoreCartStore uses, on top of a dict. Like
+    Datastore, transactions are optimistic: a commit fails with Conflict when
+    an entity the transaction read was written since. Requires the
+    google-cloud-datastore package.
+    '''
+
+    def __init__(self):
+        # Imported here so deployments without Datastore can import the stubs.
+        from google.api_core import exceptions
+        from google.cloud import datastore
+        self.project = 'fake'
+        self._exceptions = exceptions
+        self._datastore = datastore
+        self._entities = {}
+        self._versions = {}
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def _copy(self, entity):
+        copied = self._datastore.Entity(key=entity.key)
+        copied.update(entity)
+        return copied
+
+    def _write(self, path, entity):
+        if entity is None:
+            self._entities.pop(path, None)
+        else:
+            self._entities[path] = entity
+        self._versions[path] = self._versions.get(path, 0) + 1
+
+    def key(self, *path):
+        '''
+        Builds a key in this client's project.
+        '''
+        return self._datastore.Key(*path, project=self.project)
+
+    def get(self, key):
+        '''
+        Reads an entity, noting its version inside a transaction.
+        '''
+        with self._lock:
+            entity = self._entities.get(key.flat_path)
+            read = getattr(self._local, 'read', None)
+            if read is not None:
+                read.setdefault(key.flat_path, self._versions.get(key.flat_path, 0))
+            return self._copy(entity) if entity is not None else None
+
+    def put(self, entity):
+        '''
+        Writes an entity, at commit inside a transaction.
+        '''
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.append(self._copy(entity))
+        else:
+            with self._lock:
+                self._write(entity.key.flat_path, self._copy(entity))
+
+    def delete(self, key):
+        '''
+        Deletes an entity.
+        '''
+        with self._lock:
+            self._write(key.flat_path, None)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''
+        Commits the puts of the block unless an entity it read was written
+        since.
+
+        Raises:
+            google.api_core.exceptions.Conflict: A read entity changed.
+        '''
+        self._local.pending = []
+        self._local.read = {}
+        try:
+            yield
+            with self._lock:
+                if any(self._versions.get(path, 0) != version
+                        for path, version in self._local.read.items()):
+                    raise self._exceptions.Conflict('too much contention on these '
+                        'datastore entities, please try again')
+                for entity in self._local.pending:
+                    self._write(entity.key.flat_path, entity)
+        finally:
+            self._local.pending = None
+            self._local.read = None
+
+Fixture = namedtuple('Fixture', ['conversation_id', 'items', 'drink', 'order'])
+
+def get_commands():
+    '''
+    Returns:
+        The :list: of every CMD_* value in bopis.view_constants.
+    '''
+    return [value for name, value in sorted(vars(view_constants).items())
+        if name.startswith('CMD_')]
+
+class FakeSender:
+    '''
+    Stands in for view_utils.send_message. Encodes every message to JSON the
+    way the Business Messages client does before posting it, and counts it.
+
+    Attributes:
+        sent (int): Messages sent so far.
+    '''
+
+    def __init__(self):
+        self.sent = 0
+
+    def __call__(self, message, conversation_id):
+        encoding.MessageToJson(message)
+        self.sent += 1
+
+@contextlib.contextmanager
+def replaying(sender):
+    '''
+    Sends messages through a FakeSender and keeps Stripe calls and pickup
+    slots of the block away from real ones.
+
+    Args:
+        sender (FakeSender): Receives every outbound message.
+    '''
+    with override_settings(BOPIS_PICKUP_STORE_ID=f'bench-{uuid.uuid4().hex[:12]}',
+            BOPIS_PICKUP_SLOT_CAPACITY=10**6,
+            BOPIS_BUSINESS_HOURS=[(8, 20)] * 7), \
+            mock.patch.object(view_utils, 'send_message', sender), \
+            mock.patch.object(views, 'send_message', sender), \
+            mock.patch.object(views, 'prefetch_checkout_session'):
+        yield
+
+def seed(cart_size):
+    '''
+    Creates a conversation whose cart holds cart_size dishes and a drink,
+    so removing a dish never empties it, and has a pickup date, and a paid
+    order of the dishes due tomorrow. The last of the items is a dish that
+    is not in the cart. Run inside replaying().
+
+    Args:
+        cart_size (int): Dishes in the cart, one of each.
+    Returns:
+        A :Fixture:.
+    '''
+    items = [Item.objects.create(name=f'Bench item {i}', price='4.25',
+        currency='USD', image_url='https://example.com') for i in range(cart_size + 1)]
+    drink = Item.objects.create(name='Bench drink', price='2.50', currency='USD',
+        image_url='https://example.com', menu_type='D')
+    conv = Conversation.objects.create(id=str(uuid.uuid4()))
+    conv.create_new_cart()
+    get_cart_store().add_many(conv.id, {item.id: 1 for item in [*items[:cart_size], drink]})
+
+    tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+    for day in (timezone.localdate(), tomorrow):
+        pickup.ensure_slots(day, pickup.get_store_id())
+    conv.shopping_cart.pickup_date = tomorrow
+    conv.shopping_cart.save(update_fields=['pickup_date'])
+
+    past = ShoppingCart.objects.create(purchased=True,
+        purchase_timestamp=timezone.now(), total_paid='8.50')
+    ShoppedItem.objects.bulk_create([ShoppedItem(item=item, cart=past, quantity=2)
+        for item in items[:cart_size]])
+    conv.past_carts.add(past)
+    pickup.reserve_slot(past, pickup.get_slot_start(tomorrow, 12))
+    order = orders.create_order(conv, past)
+    return Fixture(conv.id, items, drink, order)
+
+def get_messages(fixture):
+    '''
+    Builds a message for every bot command that exercises its main path.
+
+    Args:
+        fixture (Fixture): The seeded conversation.
+    Returns:
+        A :dict: of command to message, in get_commands() order.
+    '''
+    item_id = fixture.items[0].id
+    tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+    messages = {
+        view_constants.CMD_ADD_TO_CART:
+            f'{view_constants.CMD_ADD_TO_CART}-{fixture.items[-1].id}',
+        view_constants.CMD_REMOVE_FROM_CART: f'{view_constants.CMD_REMOVE_FROM_CART}-{item_id}',
+        view_constants.CMD_REMOVE_ALL_FROM_CART:
+            f'{view_constants.CMD_REMOVE_ALL_FROM_CART}-{item_id}',
+        view_constants.CMD_SET_PICKUP_DATE: f'{view_constants.CMD_SET_PICKUP_DATE}-tomorrow',
+        view_constants.CMD_SET_PICKUP_TIME: f'{view_constants.CMD_SET_PICKUP_TIME}-13:00-PM',
+        # The last step, which moves the order, runs the most queries.
+        view_constants.CMD_RESCHEDULE_ORDER: f'{view_constants.CMD_RESCHEDULE_ORDER}-'
+            f'{fixture.order.id}-{tomorrow:%Y%m%d}-13',
+        view_constants.CMD_REORDER: f'{view_constants.CMD_REORDER}-{fixture.order.id}',
+    }
+    return {command: messages.get(command, command) for command in get_commands()}
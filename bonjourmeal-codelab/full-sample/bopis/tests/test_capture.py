@@ -0,0 +1,70 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests of capturing webhook traffic for `manage.py replay`.
+'''
+
+import io
+import json
+import logging
+import os
+import uuid
+from contextlib import redirect_stdout
+from unittest import mock
+
+import pytest
+from bopis import capture, view_utils
+from bopis.view_constants import CMD_SHOW_HOURS
+
+@pytest.fixture
+def directory(tmp_path, settings):
+    settings.BOPIS_CAPTURE_DIR = str(tmp_path)
+    settings.BOPIS_CAPTURE_KEEP = 2
+    yield str(tmp_path)
+    capture.close()
+
+@pytest.fixture
+def post(client, db):
+    conversation_id = str(uuid.uuid4())
+
+    def post():
+        # The callback prints every payload it receives.
+        with redirect_stdout(io.StringIO()):
+            return client.post('/callback/', json.dumps({
+                'conversationId': conversation_id,
+                'suggestionResponse': {'postbackData': CMD_SHOW_HOURS}}),
+                content_type='application/json')
+
+    with mock.patch.object(view_utils, 'bm_client'), \
+            mock.patch.object(view_utils, 'get_credentials'):
+        yield post
+
+def test_prune_leaves_other_processes_alone(directory, post):
+    other = os.path.join(directory, 'capture-20000101T000000.000000-1.jsonl.gz')
+    open(other, 'wb').close()
+    for _ in range(3):
+        capture.close()
+        post()
+    files = os.listdir(directory)
+    assert len(files) == 3 and os.path.basename(other) in files
+    assert capture.read_records([os.path.join(directory, name)
+        for name in files if name != os.path.basename(other)])
+
+def test_failed_capture_still_answers(directory, post, caplog):
+    with mock.patch.object(capture, '_open_file', side_effect=OSError('disk full')), \
+            caplog.at_level(logging.WARNING, logger=capture.__name__):
+        response = post()
+    assert response.status_code == 200
+    assert 'disk full' in caplog.text
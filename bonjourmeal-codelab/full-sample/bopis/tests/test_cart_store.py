@@ -0,0 +1,176 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Conformance tests every CartStore backend passes. The Datastore backend runs
+against bopis.stubs.FakeDatastoreClient and is skipped without the
+google-cloud-datastore package.
+'''
+
+import threading
+import uuid
+from unittest import mock
+
+import pytest
+from bopis import cart_store
+from bopis.cart_store import DatastoreCartStore, InMemoryCartStore, OrmCartStore
+from bopis.models import Conversation, Item, ShoppedItem
+from bopis.stubs import FakeDatastoreClient
+
+def make_datastore_store():
+    pytest.importorskip('google.cloud.datastore')
+    return DatastoreCartStore(FakeDatastoreClient())
+
+STORES = {
+    'orm': OrmCartStore,
+    'memory': InMemoryCartStore,
+    'datastore': make_datastore_store,
+}
+
+@pytest.fixture(params=list(STORES))
+def store(request, db):
+    return STORES[request.param]()
+
+@pytest.fixture
+def item_ids(db):
+    return sorted(Item.objects.create(name=f'Cart store test {i}', price='1.00',
+        currency='USD', image_url='https://example.com').id for i in range(3))
+
+@pytest.fixture
+def conversation_id():
+    return f'test-{uuid.uuid4().hex}'
+
+def test_empty_cart(store, conversation_id, item_ids):
+    assert not store.get_summary(conversation_id).lines
+    store.remove(conversation_id, item_ids[0])
+    assert not store.get_summary(conversation_id).lines
+
+def test_add_accumulates(store, conversation_id, item_ids):
+    store.add(conversation_id, item_ids[0])
+    store.add(conversation_id, item_ids[0], 2)
+    assert store.snapshot(conversation_id) == {item_ids[0]: 3}
+
+def test_add_many(store, conversation_id, item_ids):
+    store.add(conversation_id, item_ids[0])
+    store.add_many(conversation_id, {item_ids[0]: 2, item_ids[1]: 3})
+    assert store.snapshot(conversation_id) == {item_ids[0]: 3, item_ids[1]: 3}
+    store.add_many(conversation_id, {})
+    assert store.snapshot(conversation_id) == {item_ids[0]: 3, item_ids[1]: 3}
+
+def test_lines_ordered(store, conversation_id, item_ids):
+    for item_id in reversed(item_ids):
+        store.add(conversation_id, item_id)
+    summary = store.get_summary(conversation_id)
+    assert [line.item_id for line in summary.lines] == sorted(item_ids)
+    assert summary.item_count == len(item_ids)
+
+def test_remove(store, conversation_id, item_ids):
+    store.add(conversation_id, item_ids[0], 3)
+    store.add(conversation_id, item_ids[1], 2)
+    store.remove(conversation_id, item_ids[0])
+    assert store.snapshot(conversation_id)[item_ids[0]] == 2
+    store.remove(conversation_id, item_ids[0], 5)
+    assert item_ids[0] not in store.snapshot(conversation_id)
+    store.remove(conversation_id, item_ids[1], None)
+    assert not store.snapshot(conversation_id)
+
+def test_clear(store, conversation_id, item_ids):
+    for item_id in item_ids:
+        store.add(conversation_id, item_id)
+    store.clear(conversation_id)
+    assert not store.get_summary(conversation_id).lines
+    store.add(conversation_id, item_ids[0])
+    assert store.snapshot(conversation_id) == {item_ids[0]: 1}
+
+def test_start_new_cart(store, conversation_id, item_ids):
+    conv = Conversation.objects.create(id=conversation_id)
+    conv.create_new_cart()
+    old_cart = conv.shopping_cart
+    store.add(conversation_id, item_ids[0])
+    store.start_new_cart(conv)
+    assert conv.shopping_cart_id != old_cart.id
+    assert conv.past_carts.filter(id=old_cart.id).exists()
+    assert not store.get_summary(conversation_id).lines
+
+def test_snapshot_detached(store, conversation_id, item_ids):
+    store.add(conversation_id, item_ids[0])
+    snapshot = store.snapshot(conversation_id)
+    snapshot[item_ids[0]] = 100
+    assert store.snapshot(conversation_id) == {item_ids[0]: 1}
+
+def test_carts_isolated(store, conversation_id, item_ids):
+    store.add(conversation_id, item_ids[0])
+    store.add(conversation_id + '-other', item_ids[1])
+    assert store.snapshot(conversation_id) == {item_ids[0]: 1}
+
+@pytest.mark.parametrize('backend', ['memory', 'datastore'])
+def test_concurrent_adds(backend, conversation_id):
+    # ORM carts are covered by the rolled back test transaction, which other
+    # threads' connections cannot see.
+    store = STORES[backend]()
+    threads, adds_per_thread = 8, 50
+
+    def add_many():
+        for _ in range(adds_per_thread):
+            store.add(conversation_id, 1)
+
+    workers = [threading.Thread(target=add_many) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert store.snapshot(conversation_id) == {1: threads * adds_per_thread}
+
+def test_orm_add_raced_by_another_add(db, conversation_id, item_ids):
+    # Another add inserts the item after this add's UPDATE found no row.
+    store = OrmCartStore()
+    store.add(conversation_id, item_ids[0])
+    top_up = OrmCartStore._top_up
+    calls = iter([lambda *args: 0])
+    with mock.patch.object(OrmCartStore, '_top_up', side_effect=lambda *args:
+            next(calls, top_up)(*args)):
+        store.add(conversation_id, item_ids[0], 2)
+    assert store.snapshot(conversation_id) == {item_ids[0]: 3}
+    assert ShoppedItem.objects.filter(item_id=item_ids[0]).count() == 1
+
+def test_orm_cart_created_concurrently(db, conversation_id, item_ids):
+    # Another add created the conversation and its cart after this add
+    # found none.
+    store = OrmCartStore()
+    store.add(conversation_id, item_ids[0])
+    with mock.patch.object(OrmCartStore, '_get_cart_id', return_value=None):
+        store.add(conversation_id, item_ids[1])
+    assert store.snapshot(conversation_id) == {item_ids[0]: 1, item_ids[1]: 1}
+
+def test_datastore_update_retried_on_contention(monkeypatch):
+    pytest.importorskip('google.cloud.datastore')
+    exceptions = pytest.importorskip('google.api_core.exceptions')
+    monkeypatch.setattr(cart_store, 'TRANSACTION_BACKOFF_SECONDS', 0)
+    client = mock.MagicMock()
+    client.get.return_value = {}
+    client.transaction.return_value.__exit__.side_effect = [
+        exceptions.Conflict('contention'), exceptions.Aborted('contention'), None]
+    DatastoreCartStore(client).add('retried', 1)
+    assert client.transaction.call_count == 3
+
+def test_summary_dates_last_change(store, conversation_id, item_ids):
+    assert store.get_summary(conversation_id).modified is None
+    store.add(conversation_id, item_ids[0])
+    store.add(conversation_id, item_ids[1])
+    added = store.get_summary(conversation_id).modified
+    assert added is not None
+    store.remove(conversation_id, item_ids[1])
+    assert store.get_summary(conversation_id).modified >= added
+    store.remove(conversation_id, item_ids[0])
+    assert store.get_summary(conversation_id).modified is None
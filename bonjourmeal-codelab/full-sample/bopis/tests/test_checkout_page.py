@@ -0,0 +1,106 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests of the conditional GET and fragment caching of the checkout page.
+'''
+
+import datetime
+import uuid
+
+import pytest
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.utils import timezone
+from bopis.cart_store import get_cart_store
+from bopis.models import Item, ShoppedItem
+
+@pytest.fixture
+def cart(db):
+    store = get_cart_store()
+    items = [Item.objects.create(name=f'Checkout page test {i}', price='3.25',
+        currency='USD', image_url='https://example.com') for i in range(5)]
+    conversation_id = str(uuid.uuid4())
+    for item in items:
+        store.add(conversation_id, item.id)
+    # Changed a minute ago, pages of carts changed this second have no
+    # Last-Modified.
+    a_minute_ago = timezone.now() - datetime.timedelta(minutes=1)
+    Item.objects.filter(id__in=[item.id for item in items]).update(
+        modified_timestamp=a_minute_ago)
+    ShoppedItem.objects.filter(item__in=items).update(modified_timestamp=a_minute_ago)
+    return store, conversation_id, items
+
+def test_page_is_cached_per_cart_version(client, cart):
+    store, conversation_id, _ = cart
+    response = client.get(f'/bopis/checkout/{conversation_id}')
+    assert response.status_code == 200
+    assert response.get('ETag') and response.get('Last-Modified')
+    assert 'no-cache' in response['Cache-Control'] and 'private' in response['Cache-Control']
+    assert cache.get(make_template_fragment_key('checkout_cart',
+        [store.get_cart_id(conversation_id), response['ETag'].strip('"')])) is not None
+
+def test_reloads_get_304(client, cart):
+    _, conversation_id, _ = cart
+    url = f'/bopis/checkout/{conversation_id}'
+    response = client.get(url)
+    etag, last_modified = response['ETag'], response['Last-Modified']
+
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304 and not response.content
+    assert response['ETag'] == etag
+    assert client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304
+
+def test_changed_cart_is_served(client, cart):
+    store, conversation_id, items = cart
+    url = f'/bopis/checkout/{conversation_id}'
+    response = client.get(url)
+    etag, last_modified = response['ETag'], response['Last-Modified']
+
+    store.add(conversation_id, items[0].id)
+    # Changed in the same second as the page is served.
+    response = client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert response.status_code == 200 and 'Last-Modified' not in response
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200 and response['ETag'] != etag
+    assert b'Quantity: 2' in response.content
+
+def test_changed_price_is_served(client, cart):
+    _, conversation_id, items = cart
+    url = f'/bopis/checkout/{conversation_id}'
+    etag = client.get(url)['ETag']
+
+    Item.objects.filter(id=items[1].id).update(price='4.00')
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200 and response['ETag'] != etag
+    assert b'$4.00' in response.content
+
+def test_last_modified_from_stored_data(client, cart):
+    store, conversation_id, items = cart
+    url = f'/bopis/checkout/{conversation_id}'
+    last_modified = client.get(url)['Last-Modified']
+    # Another instance, with nothing cached, dates the page the same.
+    cache.clear()
+    assert client.get(url)['Last-Modified'] == last_modified
+
+    store.remove(conversation_id, items[0].id)
+    assert client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 200
+
+def test_item_change_moves_last_modified(client, cart):
+    _, conversation_id, items = cart
+    url = f'/bopis/checkout/{conversation_id}'
+    last_modified = client.get(url)['Last-Modified']
+    items[1].price = '4.00'
+    items[1].save()
+    assert client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 200
@@ -0,0 +1,129 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests of checkout session reuse against the local Stripe stub. Prefetches
+and concurrent clicks read the cart from other threads, so the tests commit
+to the test database instead of running in a transaction.
+'''
+
+import json
+import threading
+import time
+import uuid
+
+import pytest
+from django.core.cache import cache
+from bopis import checkout
+from bopis.cart_store import get_cart_store
+from bopis.models import Conversation, Item
+from bopis.stubs import StripeStub
+
+DOMAIN = 'https://checkout.example.com'
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+@pytest.fixture
+def stub(settings):
+    settings.BOPIS_CART_STORE = 'bopis.cart_store.InMemoryCartStore'
+    stub = StripeStub(latency=0.05)
+    with stub.running():
+        yield stub
+
+@pytest.fixture
+def items():
+    return [Item.objects.create(name=f'Checkout test {i}', price='4.50',
+        currency='USD', image_url='https://example.com') for i in range(2)]
+
+@pytest.fixture
+def conversation_id():
+    # By checkout the conversation has the ShoppingCart its pickup details
+    # were saved on.
+    conversation_id = f'checkout-{uuid.uuid4().hex}'
+    Conversation.objects.create(id=conversation_id).create_new_cart()
+    return conversation_id
+
+def test_empty_cart_makes_no_stripe_call(stub, conversation_id):
+    assert checkout.get_checkout_session(conversation_id, DOMAIN) is None
+    assert not stub.requests
+
+def test_session_reused_per_cart_version(stub, items, conversation_id):
+    store = get_cart_store()
+    store.add(conversation_id, items[0].id)
+    first = checkout.get_checkout_session(conversation_id, DOMAIN)
+    assert len(stub.created) == 1
+    assert checkout.get_checkout_session(conversation_id, DOMAIN).id == first.id
+    assert len(stub.created) == 1
+
+    store.add(conversation_id, items[1].id)
+    changed = checkout.get_checkout_session(conversation_id, DOMAIN)
+    assert changed.id != first.id and len(stub.created) == 2
+
+    # A dropped cache entry is recovered through the idempotency key.
+    checkout.invalidate_checkout_session(conversation_id)
+    assert checkout.get_checkout_session(conversation_id, DOMAIN).id == changed.id
+    assert len(stub.created) == 2
+
+def test_session_about_to_expire_is_replaced(stub, items, conversation_id):
+    store = get_cart_store()
+    store.add(conversation_id, items[0].id)
+    session = checkout.get_checkout_session(conversation_id, DOMAIN)
+    cache.set(checkout.CHECKOUT_CACHE_KEY_PREFIX + store.get_cart_id(conversation_id),
+        session._replace(expires_at=time.time() + 10))
+    assert checkout.get_checkout_session(conversation_id, DOMAIN).id != session.id
+    assert len(stub.created) == 2
+
+def test_concurrent_clicks_share_one_session(stub, items, conversation_id):
+    get_cart_store().add(conversation_id, items[0].id)
+    threads = 4
+    barrier = threading.Barrier(threads)
+    session_ids = []
+
+    def click():
+        barrier.wait()
+        session_ids.append(checkout.get_checkout_session(conversation_id, DOMAIN).id)
+
+    workers = [threading.Thread(target=click) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert len(session_ids) == threads and len(set(session_ids)) == 1
+    assert len(stub.created) == 1
+
+def test_click_uses_prefetched_session(stub, items, conversation_id):
+    store = get_cart_store()
+    store.add(conversation_id, items[0].id)
+    prefetched = checkout.prefetch_checkout_session(conversation_id, DOMAIN).result()
+    clicked = checkout.get_checkout_session(conversation_id, DOMAIN)
+    assert clicked.id == prefetched.id and clicked.prefetched
+
+    store.add(conversation_id, items[1].id)
+    assert checkout.get_checkout_session(conversation_id, DOMAIN).id != prefetched.id
+
+def test_click_racing_prefetch_gets_same_session(stub, items, conversation_id):
+    get_cart_store().add(conversation_id, items[0].id)
+    future = checkout.prefetch_checkout_session(conversation_id, DOMAIN)
+    clicked = checkout.get_checkout_session(conversation_id, DOMAIN)
+    assert clicked.id == future.result().id
+    assert len(stub.created) == 1
+
+def test_click_from_another_host_uses_prefetched_session(stub, items,
+        conversation_id, client):
+    get_cart_store().add(conversation_id, items[0].id)
+    prefetched = checkout.prefetch_checkout_session(conversation_id).result()
+    response = client.get('/bopis/create-checkout-session',
+        {'conversation_id': conversation_id}, HTTP_HOST='localhost:8000')
+    assert json.loads(response.content)['id'] == prefetched.id
+    assert len(stub.created) == 1
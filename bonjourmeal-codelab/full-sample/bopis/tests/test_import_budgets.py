@@ -0,0 +1,43 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests of the cold import time of the modules in BOPIS_IMPORT_BUDGETS, each
+imported in a fresh process after django.setup(), and that none of them
+imports the client libraries bopis.sdk defers. Run `manage.py importtime` to
+see where the time goes when a budget is exceeded.
+'''
+
+import pytest
+from django.conf import settings
+from bopis import sdk
+from bopis.management.commands.importtime import measure_imports, total_ms
+
+# Import in this many fresh processes and check the fastest.
+REPEAT = 3
+
+@pytest.fixture(scope='module', params=sorted(settings.BOPIS_IMPORT_BUDGETS))
+def imported(request):
+    return request.param, min((measure_imports([request.param])
+        for _ in range(REPEAT)), key=total_ms)
+
+def test_within_budget(imported):
+    name, imports = imported
+    assert total_ms(imports) <= settings.BOPIS_IMPORT_BUDGETS[name]
+
+@pytest.mark.parametrize('package', sorted({module.module_name.split('.')[0]
+    for module in sdk.MODULES}))
+def test_client_library_deferred(imported, package):
+    _, imports = imported
+    assert package not in {entry.name.split('.')[0] for entry in imports}
@@ -0,0 +1,108 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests of streaming an inventory file and syncing the Item table with it.
+'''
+
+import json
+from decimal import Decimal
+
+import pytest
+from django.db.models import ProtectedError
+from bopis import inventory
+from bopis.inventory import iter_inventory, sync_inventory
+from bopis.models import Item, ShoppedItem, ShoppingCart
+
+def entry(sku, name=None, price='4.50', **fields):
+    return dict(sku=sku, name=name or f'Item {sku}', price=price,
+        image_url=f'https://example.com/{sku}.png', **fields)
+
+@pytest.fixture
+def write(tmp_path):
+    def write(entries, wrapped=True):
+        path = tmp_path / 'inventory.json'
+        path.write_text(json.dumps({'inventory': entries} if wrapped else entries))
+        return str(path)
+    return write
+
+def get_items():
+    return {item.sku: item for item in Item.objects.all()}
+
+def test_entries_split_across_chunks(write, monkeypatch):
+    entries = [entry(f'sku-{i}', name='x' * (i * 7)) for i in range(20)]
+    # Smaller than an entry, so entries and the list's start straddle chunks.
+    monkeypatch.setattr(inventory, 'READ_CHUNK_SIZE', 16)
+    for wrapped in (True, False):
+        parsed = list(iter_inventory(write(entries, wrapped)))
+        assert [item['name'] for item in parsed] == [item['name'] for item in entries]
+
+def test_sync_creates_updates_and_deactivates_by_sku(db, write):
+    report = sync_inventory(write([entry('a'), entry('b'), entry('c')]))
+    assert (report.created, report.updated, report.deactivated) == (3, 0, 0)
+    created = get_items()
+
+    report = sync_inventory(write([entry('a'), entry('b', name='Renamed', price='5.25'),
+        entry('d', menu_type='D')]))
+    assert (report.created, report.updated, report.deactivated, report.unchanged) \
+        == (1, 1, 1, 1)
+    items = get_items()
+    assert items['b'].pk == created['b'].pk
+    assert (items['b'].name, items['b'].price) == ('Renamed', Decimal('5.25'))
+    assert items['b'].modified_timestamp > created['b'].modified_timestamp
+    assert not items['c'].available and items['c'].pk == created['c'].pk
+    assert items['d'].menu_type == 'D' and items['a'].available
+
+def test_item_in_a_cart_is_deactivated_not_deleted(db, write):
+    sync_inventory(write([entry('a'), entry('b')]))
+    item = Item.objects.get(sku='b')
+    ShoppedItem.objects.create(item=item, cart=ShoppingCart.objects.create())
+
+    report = sync_inventory(write([entry('a')]))
+    assert report.deactivated == 1
+    item.refresh_from_db()
+    assert not item.available
+    assert ShoppedItem.objects.filter(item=item).exists()
+    with pytest.raises(ProtectedError):
+        item.delete()
+
+@pytest.mark.parametrize('tail', [
+    # Cut off in the middle of an entry.
+    '{"sku": "b", "name": ',
+    # An entry without the fields every item needs.
+    '{"sku": "b"}]}',
+])
+def test_malformed_file_changes_nothing(db, write, tmp_path, tail):
+    sync_inventory(write([entry('a'), entry('c')]))
+    before = {sku: (item.name, item.available) for sku, item in get_items().items()}
+    path = tmp_path / 'malformed.json'
+    path.write_text('{"inventory": [' + json.dumps(entry('a', name='Changed')) + ', ' + tail)
+    with pytest.raises((ValueError, KeyError)):
+        sync_inventory(str(path))
+    assert {sku: (item.name, item.available)
+        for sku, item in get_items().items()} == before
+
+def test_failed_apply_rolls_back(db, write, monkeypatch):
+    sync_inventory(write([entry('a'), entry('c')]))
+    before = {sku: (item.name, item.available) for sku, item in get_items().items()}
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('connection lost')
+    # The new and renamed items are written before the deactivation fails.
+    monkeypatch.setattr(Item.objects, 'filter', fail)
+    with pytest.raises(RuntimeError):
+        sync_inventory(write([entry('a', name='Changed'), entry('b')]))
+    monkeypatch.undo()
+    assert {sku: (item.name, item.available)
+        for sku, item in get_items().items()} == before
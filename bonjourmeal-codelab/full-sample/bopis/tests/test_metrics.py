@@ -0,0 +1,173 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests of the request latency breakdown served at /metrics. Business Messages
+is not called.
+'''
+
+import io
+import json
+import re
+import threading
+import time
+import uuid
+from contextlib import redirect_stdout
+from unittest import mock
+
+import pytest
+from bopis import metrics, view_utils
+from bopis.models import Item
+from bopis.view_constants import CMD_ADD_TO_CART, CMD_SHOW_CART
+
+SAMPLE_LINE = re.compile(r'^([a-z_]+)\{(.*)\} (\S+)$')
+
+def parse_metrics(text):
+    '''
+    Reads the samples of a Prometheus text exposition.
+
+    Returns:
+        A :dict: of (name, frozenset of label pairs) to float.
+    '''
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('#'):
+            continue
+        match = SAMPLE_LINE.match(line)
+        assert match is not None, f'Not a sample: {line}'
+        labels = frozenset(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(2)))
+        samples[(match.group(1), labels)] = float(match.group(3))
+    return samples
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+@pytest.fixture
+def bm_client():
+    with mock.patch.object(view_utils, 'bm_client') as bm_client, \
+            mock.patch.object(view_utils, 'get_credentials'):
+        yield bm_client
+
+def post(client, conversation_id, postback):
+    # The callback prints every payload it receives.
+    with redirect_stdout(io.StringIO()):
+        return client.post('/callback/', json.dumps({'conversationId': conversation_id,
+            'suggestionResponse': {'postbackData': postback}}),
+            content_type='application/json')
+
+def test_callback_breakdown(client, db, bm_client, settings):
+    item = Item.objects.create(name='Metrics test', price='1.75',
+        currency='USD', image_url='https://example.com')
+    conversation_id = str(uuid.uuid4())
+    for _ in range(3):
+        post(client, conversation_id, f'{CMD_ADD_TO_CART}-{item.id}')
+    post(client, conversation_id, CMD_SHOW_CART)
+    posted = bm_client.BusinessmessagesV1.ConversationsMessagesService.return_value \
+        .Create.call_count
+
+    settings.BOPIS_INTERNAL_TOKEN = 'test-metrics'
+    assert client.get('/metrics').status_code == 403
+    response = client.get('/metrics', HTTP_AUTHORIZATION='Bearer test-metrics')
+    assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+    samples = parse_metrics(response.content.decode())
+
+    def sample(name, command, **labels):
+        return samples.get((name, frozenset({('view', 'bopis.views.callback'),
+            ('command', command), *labels.items()})), 0)
+
+    assert sample('bopis_request_seconds_count', CMD_ADD_TO_CART) == 3
+    assert sample('bopis_request_seconds_count', CMD_SHOW_CART) == 1
+    assert sample('bopis_request_phase_calls_total', CMD_ADD_TO_CART, phase='outbound') \
+        + sample('bopis_request_phase_calls_total', CMD_SHOW_CART, phase='outbound') \
+        == posted > 3
+    assert sample('bopis_request_phase_calls_total', CMD_ADD_TO_CART, phase='db') > 0
+    assert sample('bopis_request_phase_calls_total', CMD_ADD_TO_CART, phase='parse') == 3
+
+    phases = sum(sample('bopis_request_phase_seconds_sum', CMD_ADD_TO_CART, phase=name)
+        for name in metrics.PHASES)
+    wall = sample('bopis_request_seconds_sum', CMD_ADD_TO_CART)
+    assert abs(phases - wall) <= wall * 1e-6
+
+    # Histogram buckets are cumulative.
+    bounds = [repr(bound) for bound in metrics.BUCKETS] + ['+Inf']
+    for (name, labels), value in samples.items():
+        le = dict(labels).get('le')
+        if name.endswith('_bucket') and le != bounds[0]:
+            below = labels - {('le', le)} | {('le', bounds[bounds.index(le) - 1])}
+            assert samples[(name, below)] <= value
+
+def test_nested_phases():
+    token = metrics.start_request()
+    with metrics.phase('render'):
+        time.sleep(0.01)
+        with metrics.phase('db'):
+            time.sleep(0.02)
+    request_metrics = metrics._current.get()
+    metrics.end_request(token, 'test')
+    # A query inside a template render counts as db time only.
+    assert 0.01 <= request_metrics.seconds['render'] < 0.02
+    assert request_metrics.seconds['db'] >= 0.02
+
+def test_threads_recording_while_scraped():
+    threads, per_thread = 8, 2000
+    stop = threading.Event()
+
+    def scrape():
+        while not stop.is_set():
+            metrics.render_metrics()
+
+    def work():
+        for _ in range(per_thread):
+            token = metrics.start_request()
+            metrics.set_command('threads')
+            with metrics.phase('outbound'):
+                pass
+            metrics.end_request(token, 'test')
+
+    scraper = threading.Thread(target=scrape)
+    scraper.start()
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    stop.set()
+    scraper.join()
+
+    samples = parse_metrics(metrics.render_metrics())
+    labels = frozenset({('view', 'test'), ('command', 'threads')})
+    assert samples[('bopis_request_seconds_count', labels)] == threads * per_thread
+    assert samples[('bopis_request_phase_calls_total',
+        labels | {('phase', 'outbound')})] == threads * per_thread
+
+def test_exited_threads_leave_no_shard():
+    threads = 50
+
+    def work():
+        token = metrics.start_request()
+        metrics.set_command('short-lived')
+        metrics.end_request(token, 'test')
+
+    for _ in range(threads):
+        worker = threading.Thread(target=work)
+        worker.start()
+        worker.join()
+    samples = parse_metrics(metrics.render_metrics())
+    assert samples[('bopis_request_seconds_count',
+        frozenset({('view', 'test'), ('command', 'short-lived')}))] == threads
+    # Only the shards of threads still running, e.g. this one, are kept.
+    assert all(shard.thread.is_alive() for shard in metrics._shards)
@@ -0,0 +1,82 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Property tests of bopis.money against an exact Decimal reference on randomly
+generated carts. The seed is fixed, so a failure reproduces.
+'''
+
+import random
+from decimal import Decimal, ROUND_HALF_UP
+
+import pytest
+from bopis import money
+
+EXAMPLES = 5000
+
+def random_price(rng):
+    return Decimal(rng.randint(0, 50000)) / 100
+
+def random_rate(rng):
+    return Decimal(rng.randint(0, 250000)) / 1000000
+
+def reference_totals(prices, quantities, tax_rate):
+    '''
+    The same amounts computed with Decimal throughout.
+    '''
+    subtotal = sum((price * quantity for price, quantity in zip(prices, quantities)),
+        Decimal(0))
+    tax = (subtotal * tax_rate).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return subtotal, tax, subtotal + tax
+
+@pytest.fixture
+def rng():
+    return random.Random(20200801)
+
+def test_totals_match_decimal_reference(rng):
+    for _ in range(EXAMPLES):
+        prices = [random_price(rng) for _ in range(rng.randint(0, 10))]
+        quantities = [rng.randint(1, 20) for _ in prices]
+        tax_rate = random_rate(rng)
+        totals = money.compute_totals(
+            [money.to_minor_units(price) for price in prices], quantities, tax_rate)
+        subtotal, tax, total = reference_totals(prices, quantities, tax_rate)
+        example = (prices, quantities, tax_rate)
+        assert money.format_minor_units(totals.subtotal) \
+            == str(subtotal.quantize(Decimal('0.01'))), example
+        assert money.format_minor_units(totals.tax) == str(tax), example
+        assert money.format_minor_units(totals.total) \
+            == str(total.quantize(Decimal('0.01'))), example
+        assert sum(totals.line_totals) == totals.subtotal, example
+        assert totals.subtotal + totals.tax == totals.total, example
+
+def test_format_round_trips(rng):
+    for _ in range(EXAMPLES):
+        price = random_price(rng)
+        # Unlike multiplying by -1, negating leaves no negative zero.
+        price = -price if rng.random() < 0.5 else price
+        assert money.format_minor_units(money.to_minor_units(price)) \
+            == str(price.quantize(Decimal('0.01')))
+
+def test_tax_bounds(rng):
+    # Tax never decreases with the subtotal and splitting a cart changes the
+    # tax by at most a cent.
+    for _ in range(EXAMPLES):
+        tax_rate = random_rate(rng)
+        first, second = rng.randint(0, 10**7), rng.randint(0, 10**7)
+        low, high = sorted((first, second))
+        split = (money.compute_tax(first + second, tax_rate)
+            - money.compute_tax(first, tax_rate) - money.compute_tax(second, tax_rate))
+        assert money.compute_tax(low, tax_rate) <= money.compute_tax(high, tax_rate)
+        assert split in (-1, 0, 1), (first, second, tax_rate)
@@ -0,0 +1,158 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests of the order state machine, the query count of status lookups,
+rescheduling, bulk kitchen transitions and paging through orders.
+'''
+
+import datetime
+import uuid
+from collections import namedtuple
+from unittest import mock
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from bopis import orders, pickup, view_utils
+from bopis.models import Conversation, Order, PickupSlot, ShoppingCart
+from bopis.view_constants import (CMD_CHECK_ORDER_STATUS, CMD_RESCHEDULE_ORDER,
+    CMD_SHOW_PENDING_PICKUP, CMD_SHOW_PURCHASES)
+from bopis.views import route_message
+
+LUNCH_ORDERS = 20
+
+Day = namedtuple('Day', ['date', 'noon', 'one', 'six', 'lunch', 'dinner'])
+
+def create_order(start):
+    conv = Conversation.objects.create(id=str(uuid.uuid4()))
+    cart = ShoppingCart.objects.create(purchased=True)
+    pickup.reserve_slot(cart, start)
+    return orders.create_order(conv, cart)
+
+@pytest.fixture
+def day(db, settings):
+    '''
+    Tomorrow, with lunch orders split between noon and one o'clock and
+    dinner orders at six.
+    '''
+    settings.BOPIS_PICKUP_STORE_ID = f'test-{uuid.uuid4().hex[:12]}'
+    settings.BOPIS_PICKUP_SLOT_CAPACITY = LUNCH_ORDERS
+    settings.BOPIS_BUSINESS_HOURS = [(8, 20)] * 7
+    tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+    noon, one, six = (pickup.get_slot_start(tomorrow, hour) for hour in (12, 13, 18))
+    return Day(tomorrow, noon, one, six,
+        [create_order(noon if i % 2 else one) for i in range(LUNCH_ORDERS)],
+        [create_order(six) for _ in range(5)])
+
+def test_status_lookup_is_one_indexed_query(day):
+    conversation_id = day.lunch[0].conversation_id
+    with CaptureQueriesContext(connection) as queries:
+        open_orders = orders.get_open_orders(conversation_id)
+    assert len(queries) == 1
+    assert [order.id for order in open_orders] == [day.lunch[0].id]
+    assert 'order_conversation_state' in Order.objects.filter(
+        conversation_id=conversation_id, state__in=Order.OPEN_STATES).explain()
+
+def test_bulk_transition_is_one_indexed_statement(day):
+    before = pickup.get_slot_start(day.date, 14)
+    with CaptureQueriesContext(connection) as queries:
+        moved = orders.transition_orders(Order.PAID, Order.PREPARING, pickup_before=before)
+    assert len(queries) == 1 and moved == LUNCH_ORDERS
+    assert Order.objects.filter(id__in=[order.id for order in day.lunch],
+        state=Order.PREPARING).count() == LUNCH_ORDERS
+    assert not Order.objects.filter(id__in=[order.id for order in day.dinner]) \
+        .exclude(state=Order.PAID).exists()
+    assert 'order_state_pickup' in Order.objects.filter(state=Order.PAID,
+        pickup_datetime__lt=before).explain()
+
+def test_transitions_follow_the_state_machine(day):
+    lunch_ids = [order.id for order in day.lunch]
+    orders.transition_orders(Order.PAID, Order.PREPARING, order_ids=lunch_ids)
+    assert orders.transition_orders(Order.PAID, Order.PREPARING, order_ids=lunch_ids) == 0
+    with pytest.raises(ValueError):
+        orders.transition_orders(Order.PAID, Order.READY)
+
+def test_reschedule_moves_order_and_slot(day):
+    order = orders.get_reschedulable_order(day.lunch[0].conversation_id)
+    assert orders.reschedule_order(order, day.six)
+    assert Order.objects.get(id=order.id).pickup_datetime == day.six
+    assert ShoppingCart.objects.get(id=order.shopping_cart_id).pickup_slot.start == day.six
+    assert PickupSlot.objects.get(store_id=pickup.get_store_id(),
+        start=day.one).reserved == LUNCH_ORDERS // 2 - 1
+
+    PickupSlot.objects.filter(store_id=pickup.get_store_id(), start=day.noon).update(
+        reserved=LUNCH_ORDERS)
+    assert not orders.reschedule_order(order, day.noon)
+    assert Order.objects.get(id=order.id).pickup_datetime == day.six
+
+def test_ready_order_cannot_be_rescheduled(day):
+    lunch_ids = [order.id for order in day.lunch]
+    orders.transition_orders(Order.PAID, Order.PREPARING, order_ids=lunch_ids)
+    orders.transition_orders(Order.PREPARING, Order.READY, order_ids=lunch_ids)
+    assert orders.get_reschedulable_order(day.lunch[1].conversation_id) is None
+    assert not orders.reschedule_order(day.lunch[1], day.six)
+
+def test_status_and_reschedule_messages(day):
+    ready_order, paid_order = day.lunch[2], day.dinner[0]
+    orders.transition_orders(Order.PAID, Order.PREPARING, order_ids=[ready_order.id])
+    orders.transition_orders(Order.PREPARING, Order.READY, order_ids=[ready_order.id])
+    sent = []
+    with mock.patch.object(view_utils, 'send_message',
+            lambda message, conversation_id: sent.append(message)):
+        route_message(CMD_CHECK_ORDER_STATUS, ready_order.conversation)
+        assert 'is ready for pickup' in sent[-1].text
+        assert CMD_RESCHEDULE_ORDER not in [suggestion.reply.postbackData
+            for suggestion in sent[-1].suggestions]
+
+        # The reschedule chips offer open times other than the current one
+        # and move the order.
+        PickupSlot.objects.filter(store_id=pickup.get_store_id(), start=day.noon).update(
+            reserved=LUNCH_ORDERS)
+        conv = paid_order.conversation
+        route_message(CMD_RESCHEDULE_ORDER, conv)
+        day_postback = sent[-1].suggestions[1].reply.postbackData
+        route_message(day_postback, conv)
+        time_postbacks = [suggestion.reply.postbackData
+            for suggestion in sent[-1].suggestions]
+        route_message(time_postbacks[0], conv)
+        assert day_postback == f'{CMD_RESCHEDULE_ORDER}-{paid_order.id}-{day.date:%Y%m%d}'
+        # Twelve business hours but six o'clock and the full noon slot.
+        assert len(time_postbacks) == 10
+        assert sent[-1].text.startswith('Done!')
+        assert Order.objects.get(id=paid_order.id).pickup_datetime \
+            == pickup.get_slot_start(day.date, 8)
+
+        # An order of another conversation cannot be rescheduled.
+        route_message(f'{CMD_RESCHEDULE_ORDER}-{ready_order.id}-{day.date:%Y%m%d}-9', conv)
+        assert Order.objects.get(id=ready_order.id).pickup_datetime \
+            != pickup.get_slot_start(day.date, 9)
+
+@pytest.mark.parametrize('command', [CMD_SHOW_PENDING_PICKUP, CMD_SHOW_PURCHASES])
+@pytest.mark.parametrize('cursor', ['abc', '1.2.3', '1-2.3', '9' * 30 + '.1', '1.' + '9' * 30])
+def test_bad_cursor_shows_first_page(db, command, cursor):
+    conv = Conversation.objects.create(id=str(uuid.uuid4()))
+    tomorrow = timezone.localdate() + datetime.timedelta(days=1)
+    for hour in range(8, 8 + orders.ORDERS_PAGE_SIZE + 1):
+        cart = ShoppingCart.objects.create(purchased=True)
+        pickup.reserve_slot(cart, pickup.get_slot_start(tomorrow, hour))
+        orders.create_order(conv, cart)
+    sent = []
+    with mock.patch.object(view_utils, 'send_message',
+            lambda message, conversation_id: sent.append(message)):
+        route_message(command, conv)
+        route_message(f'{command}-{cursor}', conv)
+    assert sent[1].fallback == sent[0].fallback
+    assert sent[1].suggestions[0].reply.postbackData.startswith(f'{command}-')
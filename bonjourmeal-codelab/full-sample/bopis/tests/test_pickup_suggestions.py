@@ -0,0 +1,98 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests of the pre-built pickup time suggestions against building them on
+every message, and of the times offered across an hour boundary.
+'''
+
+import datetime
+import uuid
+from unittest import mock
+
+import pytest
+from django.utils import timezone
+from bopis import view_utils
+from bopis.models import Conversation
+from bopis.view_constants import CMD_SET_PICKUP_TIME
+
+# A Monday, so that tomorrow is open and the day after is closed.
+MONDAY = datetime.date(2030, 6, 3)
+
+def build_suggestions(business_hours, first_hour):
+    '''
+    Builds the suggestion texts and postbacks one by one, the way every
+    pickup time message did before they were cached.
+    '''
+    suggestions = []
+    for i in range(max(first_hour, business_hours[0]), business_hours[1]):
+        time_hour, time_meridiem = view_utils.determine_time_hour_and_meridiem(i)
+        suggestions.append((f'{time_hour}:00 {time_meridiem}',
+            f'{CMD_SET_PICKUP_TIME}-{i}:00-{time_meridiem}'))
+    return suggestions
+
+def postbacks(suggestions):
+    return [(suggestion.reply.text, suggestion.reply.postbackData)
+        for suggestion in suggestions]
+
+@pytest.mark.parametrize('business_hours', [(8, 20), (0, 24), (11, 14)])
+def test_cached_suggestions_match_building_them(business_hours):
+    for first_hour in range(25):
+        assert postbacks(view_utils.get_pickup_time_suggestions(
+            business_hours, first_hour).values()) \
+            == build_suggestions(business_hours, first_hour)
+
+def test_suggestions_built_once():
+    assert view_utils.get_pickup_time_suggestions((8, 20), 12) \
+        is view_utils.get_pickup_time_suggestions((8, 20), 12)
+
+@pytest.fixture
+def offered(db, settings):
+    '''
+    Returns a function that sends the pickup time request for a day at a
+    local time and returns the texts of the chips it offers.
+    '''
+    settings.BOPIS_PICKUP_STORE_ID = f'test-{uuid.uuid4().hex[:12]}'
+    settings.BOPIS_BUSINESS_HOURS = [(8, 20)] * 6 + [None]
+    conv = Conversation.objects.create(id=str(uuid.uuid4()))
+    conv.create_new_cart()
+    sent = []
+
+    def offered(local_now, day):
+        with mock.patch('django.utils.timezone.now',
+                return_value=timezone.make_aware(local_now)), \
+                mock.patch.object(view_utils, 'send_message',
+                    lambda message, conversation_id: sent.append(message)):
+            view_utils.send_pickup_time_request_message(conv, f'x-{day}')
+        return [suggestion.reply.text for suggestion in sent[-1].suggestions]
+    return offered
+
+def test_today_moves_on_at_the_hour(offered):
+    before = offered(datetime.datetime.combine(MONDAY, datetime.time(10, 59)), 'today')
+    after = offered(datetime.datetime.combine(MONDAY, datetime.time(11, 0)), 'today')
+    assert before[:2] == ['As soon as possible', '11:00 AM']
+    assert after[:2] == ['As soon as possible', '12:00 PM']
+    assert before[-1] == after[-1] == '7:00 PM'
+
+def test_tomorrow_offers_every_business_hour(offered):
+    assert offered(datetime.datetime.combine(MONDAY, datetime.time(21)), 'tomorrow') \
+        == [text for text, _ in build_suggestions((8, 20), 0)]
+
+def test_after_closing_today_offers_tomorrow(offered):
+    assert offered(datetime.datetime.combine(MONDAY, datetime.time(21)), 'today') \
+        == ['Tomorrow']
+
+def test_closed_day_offers_no_times(offered):
+    assert offered(datetime.datetime.combine(MONDAY + datetime.timedelta(days=5),
+        datetime.time(9)), 'tomorrow') == ['Today']
@@ -0,0 +1,142 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests of on-demand request profiling and of merging the profiles. Business
+Messages is stubbed with a 20 ms delay.
+'''
+
+import io
+import json
+import os
+import pstats
+import time
+import uuid
+from contextlib import redirect_stdout
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+from bopis import view_utils
+from bopis.management.commands.merge_profiles import read_collapsed
+from bopis.models import Item
+from bopis.profiling import CPROFILE_SUFFIX, PROFILE_HEADER, SAMPLE_SUFFIX
+from bopis.view_constants import CMD_ADD_TO_CART
+
+TOKEN = 'test-profiling'
+HEADER = 'HTTP_' + PROFILE_HEADER.upper().replace('-', '_')
+
+@pytest.fixture
+def directory(tmp_path, settings):
+    settings.BOPIS_PROFILE_DIR = str(tmp_path)
+    settings.BOPIS_PROFILE_TOKEN = TOKEN
+    settings.BOPIS_PROFILE_SAMPLE_RATE = 0
+    settings.BOPIS_PROFILE_INTERVAL = 0.001
+    settings.BOPIS_PROFILE_KEEP = 200
+    return str(tmp_path)
+
+@pytest.fixture
+def post(client, db):
+    item = Item.objects.create(name='Profiling test', price='1.75',
+        currency='USD', image_url='https://example.com')
+    conversation_id = str(uuid.uuid4())
+
+    def post(**headers):
+        # The callback prints every payload it receives.
+        with redirect_stdout(io.StringIO()):
+            return client.post('/callback/', json.dumps({
+                'conversationId': conversation_id,
+                'suggestionResponse': {'postbackData': f'{CMD_ADD_TO_CART}-{item.id}'}}),
+                content_type='application/json', **headers)
+
+    with mock.patch.object(view_utils, 'bm_client') as bm_client, \
+            mock.patch.object(view_utils, 'get_credentials'):
+        bm_client.BusinessmessagesV1.ConversationsMessagesService.return_value \
+            .Create.side_effect = lambda **kwargs: time.sleep(0.02)
+        yield post
+
+def test_only_requested_or_sampled_requests_are_profiled(directory, post, settings):
+    post()
+    post(**{HEADER: 'wrong'})
+    settings.BOPIS_PROFILE_DIR = ''
+    post(**{HEADER: TOKEN})
+    assert not os.listdir(directory)
+
+def test_non_ascii_token_is_not_profiled(directory, post):
+    post(**{HEADER: 'tést'})
+    assert not os.listdir(directory)
+
+def test_failed_cprofile_start_frees_the_lock(directory, post):
+    with mock.patch('cProfile.Profile.enable', side_effect=ValueError('in use')):
+        with pytest.raises(ValueError):
+            post(**{HEADER: TOKEN})
+    post(**{HEADER: TOKEN})
+    assert [name for name in os.listdir(directory) if name.endswith(CPROFILE_SUFFIX)]
+
+def test_requested_profile_is_pstats(directory, post):
+    post(**{HEADER: TOKEN})
+    files = os.listdir(directory)
+    assert len(files) == 1
+    assert files[0].endswith(f'-bopis.views.callback-{CMD_ADD_TO_CART}{CPROFILE_SUFFIX}')
+    functions = {name for _, _, name in pstats.Stats(
+        os.path.join(directory, files[0])).stats}
+    assert {'route_message', 'send_message'} <= functions
+
+def test_sampled_profile_is_wall_clock_stacks(directory, post, settings):
+    settings.BOPIS_PROFILE_SAMPLE_RATE = 1
+    post()
+    files = os.listdir(directory)
+    assert len(files) == 1 and files[0].endswith(SAMPLE_SUFFIX)
+    stacks = read_collapsed(os.path.join(directory, files[0]))
+    assert any(';route_message:' in stack for stack in stacks)
+    # Most samples wait on Business Messages.
+    waiting = sum(count for stack, count in stacks.items() if ';send_message:' in stack)
+    assert waiting >= 0.5 * sum(stacks.values()) > 0
+    # Stacks start below the profiling middleware.
+    assert all(not stack.startswith(('__call__:bopis/middleware', 'run:'))
+        for stack in stacks)
+
+def test_only_newest_profiles_kept(directory, post, settings):
+    settings.BOPIS_PROFILE_SAMPLE_RATE = 1
+    settings.BOPIS_PROFILE_KEEP = 3
+    for _ in range(4):
+        post()
+        time.sleep(0.01)
+    assert len(os.listdir(directory)) == 3
+
+def test_merge_profiles(directory, post, settings):
+    for _ in range(2):
+        post(**{HEADER: TOKEN})
+    settings.BOPIS_PROFILE_SAMPLE_RATE = 1
+    for _ in range(2):
+        post()
+    collapsed = [name for name in os.listdir(directory) if name.endswith(SAMPLE_SUFFIX)]
+    expected = sum(sum(read_collapsed(os.path.join(directory, name)).values())
+        for name in collapsed)
+
+    output = os.path.join(directory, 'merged.txt')
+    merged_pstats = os.path.join(directory, 'merged.pstats')
+    report = io.StringIO()
+    call_command('merge_profiles', dir=directory, output=output,
+        pstats_output=merged_pstats, by_command=True, stdout=report)
+    merged = read_collapsed(output)
+    assert sum(merged.values()) == expected > 0
+    assert all(stack.startswith(f'bopis.views.callback;{CMD_ADD_TO_CART};')
+        for stack in merged)
+    assert pstats.Stats(merged_pstats).total_calls > 0
+    assert 'route_message' in report.getvalue()
+
+    filtered = io.StringIO()
+    call_command('merge_profiles', dir=directory, bot_command='show_cart', stdout=filtered)
+    assert filtered.getvalue().startswith('  0 sampled requests, 0 samples, 0 cProfile')
@@ -0,0 +1,99 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Replays every bot command with carts of several sizes and fails when a
+command runs more queries than its budget in bopis.query_budgets, has no
+budget, or runs more queries for a bigger cart.
+'''
+
+import logging
+import uuid
+from unittest import mock
+
+import pytest
+from django.core.cache import cache
+from django.db import transaction
+from bopis import query_budgets, view_utils
+from bopis.models import Conversation
+from bopis.query_budgets import QUERY_BUDGETS, count_queries
+from bopis.stubs import FakeSender, get_commands, get_messages, replaying, seed
+from bopis.view_constants import CMD_ADD_TO_CART, CMD_SHOW_HOURS
+from bopis.views import route_message
+
+SIZES = [1, 10, 100]
+
+def count(conversation_id, message):
+    conv = Conversation.objects.select_related('shopping_cart').get(id=conversation_id)
+    # As the first request of the day in a fresh process, e.g. before
+    # ensure_slots has flagged the day's pickup slots as created.
+    cache.clear()
+    view_utils._forget_menu_carousels()
+    with transaction.atomic():
+        with count_queries() as counter:
+            route_message(message, conv)
+        transaction.set_rollback(True)
+    return counter.count
+
+@pytest.fixture(scope='module')
+def counts(django_db_setup, django_db_blocker):
+    '''
+    The queries of every command, by cart size, counted once for the module.
+    '''
+    counts = {}
+    with django_db_blocker.unblock(), replaying(FakeSender()):
+        with transaction.atomic():
+            for size in SIZES:
+                fixture = seed(size)
+                for command, message in get_messages(fixture).items():
+                    counts.setdefault(command, []).append(
+                        count(fixture.conversation_id, message))
+            transaction.set_rollback(True)
+    return counts
+
+@pytest.mark.parametrize('command', get_commands())
+def test_command_within_budget(command, counts):
+    by_size = counts[command]
+    budget = QUERY_BUDGETS.get(command)
+    assert budget is not None, f'{command} has no budget'
+    assert max(by_size) <= budget, f'{command} ran {by_size} queries at {SIZES}'
+    assert all(bigger <= smaller for smaller, bigger in zip(by_size, by_size[1:])), \
+        f'{command} grows with the cart: {by_size} queries at {SIZES}'
+
+def test_first_add_creates_cart_within_budget(db):
+    with replaying(FakeSender()):
+        fixture = seed(1)
+        conv = Conversation.objects.create(id=str(uuid.uuid4()))
+        message = get_messages(fixture)[CMD_ADD_TO_CART]
+        queries = count(conv.id, message)
+    assert queries <= QUERY_BUDGETS[CMD_ADD_TO_CART]
+
+def test_over_budget_warns_with_debug_only(db, settings):
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger = logging.getLogger(query_budgets.__name__)
+    logger.addHandler(handler)
+    try:
+        with replaying(FakeSender()), mock.patch.dict(QUERY_BUDGETS, {CMD_SHOW_HOURS: -1}):
+            fixture = seed(1)
+            settings.DEBUG = True
+            count(fixture.conversation_id, CMD_SHOW_HOURS)
+            warned = len(records)
+            settings.DEBUG = False
+            count(fixture.conversation_id, CMD_SHOW_HOURS)
+    finally:
+        logger.removeHandler(handler)
+    assert warned == 1 and len(records) == 1
+    assert CMD_SHOW_HOURS in records[0].getMessage()
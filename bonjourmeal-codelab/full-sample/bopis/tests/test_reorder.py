@@ -0,0 +1,99 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests of one-tap reordering of a past purchase, compared with adding the
+same items one by one.
+'''
+
+import uuid
+from unittest import mock
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from bopis import orders, view_utils
+from bopis.cart_store import get_cart_store
+from bopis.models import Conversation, Item, ShoppedItem, ShoppingCart
+from bopis.view_constants import CMD_ADD_TO_CART, CMD_REORDER, CMD_SHOW_PURCHASES
+from bopis.views import route_message
+
+ITEMS = 12
+
+def create_purchase(conv, items):
+    cart = ShoppingCart.objects.create(purchased=True, total_paid='0.00')
+    ShoppedItem.objects.bulk_create([ShoppedItem(item=item, cart=cart, quantity=i + 1)
+        for i, item in enumerate(items)])
+    conv.past_carts.add(cart)
+    return orders.create_order(conv, cart)
+
+@pytest.fixture
+def items(db):
+    items = [Item.objects.create(name=f'Reorder test {i}', price='2.25',
+        currency='USD', image_url='https://example.com') for i in range(ITEMS)]
+    # The last item is no longer available.
+    items[-1].available = False
+    items[-1].save()
+    return items
+
+@pytest.fixture
+def sent():
+    sent = []
+    with mock.patch.object(view_utils, 'send_message',
+            lambda message, conversation_id: sent.append(message)):
+        yield sent
+
+def test_reorder_latest_purchase(items, sent):
+    conv = Conversation.objects.create(id=str(uuid.uuid4()))
+    create_purchase(conv, items[:1])
+    order = create_purchase(conv, items)
+    expected = {item.id: i + 1 for i, item in enumerate(items[:-1])}
+    store = get_cart_store()
+
+    route_message(CMD_SHOW_PURCHASES, conv)
+    assert f'{CMD_REORDER}-{order.id}' in [suggestion.reply.postbackData for suggestion
+        in sent[-1].richCard.carouselCard.cardContents[0].suggestions]
+
+    sent.clear()
+    route_message(CMD_REORDER, conv)
+    assert len(sent) == 1 and store.snapshot(conv.id) == expected
+    assert items[-1].name in sent[0].text and 'no longer available' in sent[0].text
+
+    # Reordering into a cart adds to what is already there.
+    route_message(f'{CMD_REORDER}-{order.id}', conv)
+    assert store.snapshot(conv.id) == {item_id: quantity * 2
+        for item_id, quantity in expected.items()}
+
+def test_order_of_another_conversation_cannot_be_reordered(items, sent):
+    order = create_purchase(Conversation.objects.create(id=str(uuid.uuid4())), items)
+    stranger = Conversation.objects.create(id=str(uuid.uuid4()))
+    route_message(f'{CMD_REORDER}-{order.id}', stranger)
+    assert get_cart_store().snapshot(stranger.id) == {}
+    assert "couldn't find" in sent[-1].text
+
+def test_reorder_matches_adding_one_by_one(items, sent):
+    store = get_cart_store()
+    one_by_one = Conversation.objects.create(id=str(uuid.uuid4()))
+    with CaptureQueriesContext(connection) as single_queries:
+        for i, item in enumerate(items[:-1]):
+            for _ in range(i + 1):
+                route_message(f'{CMD_ADD_TO_CART}-{item.id}', one_by_one)
+
+    again = Conversation.objects.create(id=str(uuid.uuid4()))
+    create_purchase(again, items[:-1])
+    with CaptureQueriesContext(connection) as reorder_queries:
+        route_message(CMD_REORDER, again)
+
+    assert store.snapshot(one_by_one.id) == store.snapshot(again.id)
+    assert len(reorder_queries) < len(single_queries)
@@ -0,0 +1,79 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Walks a conversation from the first item to the confirmed pickup through
+route_message, with every CartStore backend. Business Messages is not
+called.
+'''
+
+import uuid
+
+import pytest
+from django.utils import timezone
+from bopis import cart_store
+from bopis.models import Conversation, Item
+from bopis.stubs import FakeSender, replaying
+from bopis.view_constants import (CMD_ABANDON_CART, CMD_ADD_TO_CART,
+    CMD_CONF_PICKUP_DETAILS, CMD_PURCHASE_CART, CMD_RESET_PICKUP_DETAILS,
+    CMD_SET_PICKUP_DATE, CMD_SET_PICKUP_TIME, CMD_SHOW_CART)
+from bopis.views import route_message
+
+from .test_cart_store import STORES
+
+@pytest.fixture(params=list(STORES))
+def store(request, db, monkeypatch):
+    store = STORES[request.param]()
+    monkeypatch.setattr(cart_store, '_load_store', lambda path: store)
+    return store
+
+def send(conversation_id, message):
+    # Like the callback, with the conversation read afresh for every message.
+    conv = Conversation.objects.select_related('shopping_cart').get(id=conversation_id)
+    route_message(message, conv)
+    return Conversation.objects.select_related('shopping_cart').get(id=conversation_id)
+
+def test_order_flow(store):
+    item = Item.objects.create(name='Flow dish', price='5.00', currency='USD',
+        image_url='https://example.com')
+    conversation_id = str(uuid.uuid4())
+    Conversation.objects.create(id=conversation_id)
+    sender = FakeSender()
+    with replaying(sender):
+        send(conversation_id, f'{CMD_ADD_TO_CART}-{item.id}')
+        send(conversation_id, CMD_SHOW_CART)
+        send(conversation_id, CMD_PURCHASE_CART)
+        conv = send(conversation_id, f'{CMD_SET_PICKUP_DATE}-tomorrow')
+        tomorrow = timezone.localdate() + timezone.timedelta(days=1)
+        assert conv.shopping_cart.pickup_date == tomorrow
+
+        conv = send(conversation_id, f'{CMD_SET_PICKUP_TIME}-13:00-PM')
+        slot = conv.shopping_cart.pickup_slot
+        assert timezone.localtime(slot.start).hour == 13 and slot.reserved == 1
+        conv = send(conversation_id, CMD_RESET_PICKUP_DETAILS)
+        assert conv.shopping_cart.pickup_slot is None
+        slot.refresh_from_db()
+        assert slot.reserved == 0
+
+        send(conversation_id, f'{CMD_SET_PICKUP_DATE}-tomorrow')
+        conv = send(conversation_id, f'{CMD_SET_PICKUP_TIME}-14:00-PM')
+        assert timezone.localtime(conv.shopping_cart.pickup_slot.start).hour == 14
+        send(conversation_id, CMD_CONF_PICKUP_DETAILS)
+        assert store.snapshot(conversation_id) == {item.id: 1}
+
+        cart_id = conv.shopping_cart_id
+        conv = send(conversation_id, CMD_ABANDON_CART)
+    assert conv.shopping_cart_id != cart_id
+    assert not store.get_summary(conversation_id).lines
+    assert sender.sent >= 10
@@ -0,0 +1,126 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests of the read replica router against a second SQLite database that
+stands in for the replica, and that the replica is only used with a cache
+every instance shares, since that cache holds the pins that give
+conversations their own writes back.
+'''
+
+import uuid
+
+import pytest
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections
+from bopis import routers
+from bopis.models import Conversation, Item, Order, ShoppingCart
+from bopis.routers import ReadReplicaRouter, conversation_scope, read_replica
+
+REPLICA = 'replica'
+
+@pytest.fixture
+def replica_db(db, tmp_path):
+    '''
+    Adds a REPLICA database with the tables of the models read here. It is
+    not a test mirror of the default database, so what each query sees shows
+    which one it went to. Replication never happens, the replica holds what
+    the test writes to it.
+    '''
+    connections.databases[REPLICA] = {'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': str(tmp_path / 'replica.sqlite3')}
+    try:
+        with connections[REPLICA].schema_editor() as editor:
+            for model in (Item, ShoppingCart, Conversation):
+                editor.create_model(model)
+        yield REPLICA
+    finally:
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.databases[REPLICA]
+        cache.clear()
+
+def create_item(name, using=DEFAULT_DB_ALIAS):
+    return Item.objects.using(using).create(name=name, price='1.00',
+        currency='USD', image_url='https://example.com')
+
+def get_item_names():
+    return set(Item.objects.values_list('name', flat=True))
+
+def test_replica_serves_read_only_code(replica_db):
+    create_item('Primary item')
+    create_item('Replica item', using=replica_db)
+    assert routers.get_replica_alias() == replica_db
+    with read_replica():
+        assert get_item_names() == {'Replica item'}
+    assert get_item_names() == {'Primary item'}
+
+def test_writes_go_to_primary(replica_db):
+    with read_replica():
+        create_item('Written item')
+        Item.objects.filter(name='Written item').update(price='2.00')
+    assert Item.objects.using(DEFAULT_DB_ALIAS).get(name='Written item').price == 2
+    assert not Item.objects.using(replica_db).exists()
+
+def test_conversation_reads_its_writes(replica_db):
+    writer, reader = str(uuid.uuid4()), str(uuid.uuid4())
+    with conversation_scope(writer):
+        Conversation.objects.create(id=writer)
+        # The replica has not caught up with the new conversation yet.
+        with read_replica():
+            assert Conversation.objects.filter(id=writer).exists()
+    with conversation_scope(reader), read_replica():
+        assert not Conversation.objects.filter(id=writer).exists()
+    with conversation_scope(writer), read_replica():
+        assert Conversation.objects.filter(id=writer).exists()
+
+def test_admin_actions_pick_orders_from_primary(replica_db, admin_client):
+    conv = Conversation.objects.create(id=str(uuid.uuid4()))
+    order = Order.objects.create(conversation=conv,
+        shopping_cart=ShoppingCart.objects.create(purchased=True))
+    # The replica has not caught up with the order yet.
+    with connections[replica_db].schema_editor() as editor:
+        editor.create_model(Order)
+    response = admin_client.post('/admin/bopis/order/', {
+        'action': 'mark_preparing', '_selected_action': [order.id]})
+    assert response.status_code == 302
+    order.refresh_from_db()
+    assert order.state == Order.PREPARING
+
+@pytest.fixture
+def replica(settings, monkeypatch):
+    monkeypatch.setattr(routers, 'get_replica_alias', lambda: 'replica')
+    return settings
+
+@pytest.mark.parametrize('backend', [
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+])
+def test_replica_refuses_process_local_cache(replica, backend):
+    replica.CACHES = {'default': {'BACKEND': backend}}
+    with pytest.raises(ImproperlyConfigured):
+        ReadReplicaRouter()
+
+def test_replica_with_shared_cache(replica):
+    replica.CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': ['127.0.0.1:11211'],
+    }}
+    ReadReplicaRouter()
+
+def test_no_replica_any_cache(settings):
+    settings.CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    ReadReplicaRouter()
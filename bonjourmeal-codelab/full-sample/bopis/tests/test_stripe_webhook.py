@@ -0,0 +1,188 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Replays the recorded Stripe events in stripe_events.json against the webhook
+endpoint. Each test runs in a transaction that is rolled back, so the
+queued confirmation messages are counted but never sent.
+'''
+
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+
+import pytest
+from django.db import connection
+from bopis.cart_store import OrmCartStore, get_cart_store
+from bopis.models import Conversation, Item, Order, StripeEvent
+
+EVENTS_FILE = os.path.join(os.path.dirname(__file__), 'stripe_events.json')
+WEBHOOK_SECRET = 'whsec_test_stripe_webhook'
+WEBHOOK_URL = '/bopis/stripe-webhook'
+
+def sign(payload, secret, timestamp=None):
+    '''
+    Builds a Stripe-Signature header for a payload the way Stripe does.
+
+    Args:
+        payload (str): The request body.
+        secret (str): The endpoint's signing secret.
+        timestamp (int): Signing time, defaults to now.
+    Returns:
+        A :str: header value.
+    '''
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(secret.encode('utf8'),
+        f'{timestamp}.{payload}'.encode('utf8'), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+def load_event(name, **values):
+    with open(EVENTS_FILE) as f:
+        payload = f.read()
+    for key, value in values.items():
+        payload = payload.replace('{' + key + '}', value)
+    return json.dumps(json.loads(payload)[name])
+
+def queued():
+    return len(connection.run_on_commit)
+
+@pytest.fixture
+def post(client, settings):
+    settings.STRIPE_WEBHOOK_SECRET = WEBHOOK_SECRET
+    settings.BOPIS_CART_STORE = 'bopis.cart_store.OrmCartStore'
+
+    def post(payload, signature=None):
+        return client.post(WEBHOOK_URL, data=payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature or sign(payload, WEBHOOK_SECRET))
+    return post
+
+@pytest.fixture
+def cart(db):
+    '''
+    A conversation with an item in its cart, and the event of paying for it.
+    '''
+    store = OrmCartStore()
+    item = Item.objects.create(name='Webhook test', price='10.99',
+        currency='USD', image_url='https://example.com')
+    conversation_id = str(uuid.uuid4())
+    store.add(conversation_id, item.id)
+    return store, item, conversation_id, paid_event(store, conversation_id)
+
+def paid_event(store, conversation_id):
+    return load_event('checkout_session_completed',
+        conversation_id=conversation_id, cart_id=store.get_cart_id(conversation_id),
+        shopping_cart_id=str(Conversation.objects.get(
+            id=conversation_id).shopping_cart_id))
+
+def test_bad_signatures_are_rejected(post, cart):
+    completed = cart[3]
+    assert post(completed, sign(completed, 'whsec_someone_else')).status_code == 400
+    assert not StripeEvent.objects.filter(id=json.loads(completed)['id']).exists()
+    assert post(completed, sign(completed, WEBHOOK_SECRET, time.time() - 3600)) \
+        .status_code == 400
+
+def test_completed_checkout_records_purchase(post, cart):
+    store, _, conversation_id, completed = cart
+    cart_id = Conversation.objects.get(id=conversation_id).shopping_cart_id
+
+    assert post(completed).status_code == 200
+    conv = Conversation.objects.get(id=conversation_id)
+    paid_cart = conv.past_carts.get(id=cart_id)
+    assert paid_cart.purchased and paid_cart.purchase_timestamp is not None
+    assert str(paid_cart.total_paid) == '10.99' and paid_cart.currency == 'USD'
+    assert not paid_cart.abandoned
+    # The conversation starts a new, empty cart.
+    assert conv.shopping_cart_id != cart_id and not store.get_summary(conversation_id).lines
+    assert queued() == 1
+    assert Order.objects.filter(shopping_cart_id=cart_id,
+        conversation_id=conversation_id, state=Order.PAID).exists()
+
+def test_redelivered_event_is_ignored(post, cart):
+    completed, conversation_id = cart[3], cart[2]
+    post(completed)
+    cart_id = Conversation.objects.get(id=conversation_id).shopping_cart_id
+    assert post(completed).status_code == 200
+    assert queued() == 1
+    assert StripeEvent.objects.filter(id=json.loads(completed)['id']).count() == 1
+    assert Conversation.objects.get(id=conversation_id).shopping_cart_id == cart_id
+
+def test_payment_for_old_cart_leaves_new_cart_alone(post, cart):
+    store, item, conversation_id, completed = cart
+    post(completed)
+    store.add(conversation_id, item.id)
+    second_payment = json.loads(completed)
+    second_payment['id'] = 'evt_' + uuid.uuid4().hex
+    assert post(json.dumps(second_payment)).status_code == 200
+    conv = Conversation.objects.get(id=conversation_id)
+    assert queued() == 1 and not conv.shopping_cart.purchased
+    assert store.get_summary(conversation_id).item_count == 1
+
+def test_payment_for_replaced_cart_records_its_order(post, cart):
+    store, item, conversation_id, completed = cart
+    conv = Conversation.objects.get(id=conversation_id)
+    paid_cart_id = conv.shopping_cart_id
+    # The cart is abandoned while its checkout page is still open.
+    store.start_new_cart(conv)
+    store.add(conversation_id, item.id, 3)
+
+    assert post(completed).status_code == 200
+    order = Order.objects.get(conversation_id=conversation_id)
+    assert order.shopping_cart_id == paid_cart_id and order.state == Order.PAID
+    assert order.shopping_cart.purchased and not order.shopping_cart.abandoned
+    assert [(shopped.item_id, shopped.quantity) for shopped in
+        order.shopping_cart.shoppeditem_set.all()] == [(item.id, 1)]
+    # The cart the conversation moved on to is left alone.
+    conv = Conversation.objects.get(id=conversation_id)
+    assert conv.shopping_cart_id != paid_cart_id and not conv.shopping_cart.purchased
+    assert store.get_summary(conversation_id).item_count == 3 and queued() == 1
+
+def test_payment_for_unknown_cart_creates_none(post, cart):
+    _, _, conversation_id, completed = cart
+    cart_id = Conversation.objects.get(id=conversation_id).shopping_cart_id
+    assert post(completed.replace(f'"shopping_cart_id": "{cart_id}"',
+        '"shopping_cart_id": "0"')).status_code == 200
+    conv = Conversation.objects.get(id=conversation_id)
+    assert queued() == 0 and conv.shopping_cart_id == cart_id
+    assert not conv.shopping_cart.purchased and not Order.objects.filter(
+        conversation=conv).exists()
+
+def test_purchase_from_another_store_keeps_items(post, settings, db):
+    settings.BOPIS_CART_STORE = 'bopis.cart_store.InMemoryCartStore'
+    store = get_cart_store()
+    item = Item.objects.create(name='Webhook test', price='10.99',
+        currency='USD', image_url='https://example.com')
+    conversation_id = str(uuid.uuid4())
+    Conversation.objects.create(id=conversation_id).create_new_cart()
+    store.add(conversation_id, item.id, 2)
+
+    assert post(paid_event(store, conversation_id)).status_code == 200
+    order = Order.objects.get(conversation_id=conversation_id)
+    assert [(shopped.item_id, shopped.quantity) for shopped in
+        order.shopping_cart.shoppeditem_set.all()] == [(item.id, 2)]
+    assert not store.get_summary(conversation_id).lines
+    assert Conversation.objects.get(id=conversation_id).shopping_cart_id \
+        != order.shopping_cart_id
+
+def test_other_events_are_recorded(post, db):
+    other = load_event('payment_intent_succeeded')
+    assert post(other).status_code == 200
+    assert StripeEvent.objects.filter(id=json.loads(other)['id'],
+        type='payment_intent.succeeded').exists()
+
+def test_success_page_sends_no_messages(client, cart):
+    response = client.get('/bopis/checkout_success', {'conversation_id': cart[2]})
+    assert response.status_code == 200 and queued() == 0
@@ -0,0 +1,99 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests of /_ah/warmup and the menu cache it primes. Business Messages is not
+called. `manage.py warmup` in a fresh process reports the cold-start cost of
+every stage.
+'''
+
+from unittest import mock
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from bopis import metrics, view_utils, warmup
+from bopis.models import Item
+
+@pytest.fixture
+def stages(client, db, settings):
+    # Nothing listens there, the credentials stage is skipped for it.
+    settings.BOPIS_BUSINESS_MESSAGES_URL = 'http://127.0.0.1:9/'
+    settings.BOPIS_TRUST_APPENGINE_HEADERS = True
+    Item.objects.create(name='Warmup dish', price='3.10', currency='USD',
+        image_url='https://example.com')
+    response = client.get('/_ah/warmup', HTTP_X_APPENGINE_WARMUP='1')
+    assert response.status_code == 200
+    return response.json()['stages']
+
+def test_warmup_runs_every_stage(stages):
+    assert [stage['name'] for stage in stages] == list(warmup.STAGES)
+    assert not any(stage['result'].startswith('failed') for stage in stages)
+    # Credentials are not loaded while messages go to a stand-in.
+    assert any(stage['name'] == 'credentials' and stage['result'].startswith('skipped')
+        for stage in stages)
+
+def test_warmup_primes_the_menus(stages):
+    with CaptureQueriesContext(connection) as queries:
+        view_utils.get_food_menu_carousel()
+        view_utils.get_drink_menu_carousel()
+    assert len(queries) == 0
+
+def test_menu_cache_dropped_on_item_change(stages):
+    food = view_utils.get_food_menu_carousel()
+    Item.objects.create(name='Warmup test', price='3.10', currency='USD',
+        image_url='https://example.com')
+    titles = [card.title for card in view_utils.get_food_menu_carousel().cardContents]
+    assert 'Warmup test' in titles and len(titles) == len(food.cardContents) + 1
+
+def test_menu_cache_expires(stages, settings):
+    settings.BOPIS_MENU_CACHE_SECONDS = 0
+    with CaptureQueriesContext(connection) as queries:
+        view_utils.get_food_menu_carousel()
+    assert len(queries) == 1
+
+def test_stage_timings_exported(stages):
+    rendered = metrics.render_metrics()
+    assert all(f'bopis_warmup_seconds_count{{stage="{name}"}}' in rendered
+        for name in warmup.STAGES)
+
+def test_warmup_only_answers_app_engine_or_token(client, db, settings):
+    settings.BOPIS_INTERNAL_TOKEN = 'test-warmup'
+    with mock.patch.object(warmup, 'warm_up', return_value=[]):
+        settings.BOPIS_TRUST_APPENGINE_HEADERS = False
+        assert client.get('/_ah/warmup', HTTP_X_APPENGINE_CRON='true').status_code == 403
+        assert client.get('/_ah/warmup', HTTP_AUTHORIZATION='Bearer wrong').status_code == 403
+        assert client.get('/_ah/warmup',
+            HTTP_AUTHORIZATION='Bearer test-warmup').status_code == 200
+        settings.BOPIS_TRUST_APPENGINE_HEADERS = True
+        assert client.get('/_ah/warmup', HTTP_X_APPENGINE_CRON='true').status_code == 200
+
+def test_failed_stage_reason_only_logged(client, db, settings):
+    settings.BOPIS_TRUST_APPENGINE_HEADERS = True
+    fail = mock.Mock(side_effect=ValueError('secret'))
+    with mock.patch.dict(warmup._STAGE_FUNCTIONS, urls=fail):
+        response = client.get('/_ah/warmup', HTTP_X_APPENGINE_WARMUP='1')
+    assert response.status_code == 200
+    assert b'secret' not in response.content
+    assert {'name': 'urls', 'result': 'failed'}.items() <= next(stage
+        for stage in response.json()['stages'] if stage['name'] == 'urls').items()
+
+def test_startup_hook_follows_setting(settings):
+    with mock.patch.object(warmup, 'warm_up') as warm_up:
+        settings.BOPIS_WARMUP_ON_STARTUP = False
+        warmup.warm_up_on_startup()
+        assert warm_up.call_count == 0
+        settings.BOPIS_WARMUP_ON_STARTUP = True
+        warmup.warm_up_on_startup()
+        assert warm_up.call_count == 1
@@ -38,4 +38,5 @@ urlpatterns = [
     path('create-checkout-session', views.create_checkout_session),
     path('checkout_success', views.checkout_success),
     path('checkout_failure', views.checkout_failure),
+    path('stripe-webhook', views.stripe_webhook),
 ]
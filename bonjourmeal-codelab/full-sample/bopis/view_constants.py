@@ -18,9 +18,6 @@
 Constants used through Business Messages Bonjour Meal logic
 '''
 
-import stripe
-from businessmessages.businessmessages_v1_messages import BusinessMessagesRepresentative
-
 # String constants used in bot logic.
 MSG_SHOW_FOOD_MENU = 'Show food menu'
 MSG_SHOW_DRINKS_MENU = 'Show drinks menu'
@@ -41,12 +38,17 @@ MSG_REMOVE_ALL = 'Remove all'
 MSG_SHOW_PAST_PURCHASES='Show past purchases'
 MSG_CODELAB_NAME = 'Bonjour Meal Codelab'
 MSG_PENDING_ORDERS = 'See pending orders'
+MSG_REORDER = 'Order again'
 
 # The domain is needed for sending the user to the correct callbacks.
 DOMAIN = 'https://GCP_PROJECT_NAME.appspot.com'
 
-# Set the Stripe API Key here.
-stripe.api_key = 'YOUR_STRIPE_SECRET_KEY_HERE'
+# Set the Stripe API Key here. bopis.sdk sets it on stripe when stripe is
+# first used.
+STRIPE_API_KEY = 'YOUR_STRIPE_SECRET_KEY_HERE'
+# Retries 409s, e.g. a second checkout click while the first one's
+# idempotent session create is still in flight.
+STRIPE_MAX_NETWORK_RETRIES = 2
 
 # Set of commands the bot understand.
 CMD_SHOW_PENDING_PICKUP = 'show_pending_pickup'
@@ -59,15 +61,14 @@ CMD_FOOD_MENU = 'show_food_menu'
 CMD_SHOW_CART = 'show_cart'
 CMD_ABANDON_CART = 'abandon_cart'
 CMD_ADD_TO_CART = 'add_to_cart'
+CMD_REMOVE_FROM_CART = 'remove_from_cart'
+CMD_REMOVE_ALL_FROM_CART = 'remove_all_from_cart'
 CMD_SET_PICKUP_DATE = 'set_pickup_date'
 CMD_SET_PICKUP_TIME = 'set_pickup_time'
 CMD_CONF_PICKUP_DETAILS = 'confirm_pickup_details'
 CMD_RESET_PICKUP_DETAILS = 'reset_pickup_details'
 CMD_CHECK_ORDER_STATUS = 'check_order_status'
 CMD_RESCHEDULE_ORDER = 'reschedule_order'
+CMD_REORDER = 'reorder'
 # The location of the service account credentials.
 SERVICE_ACCOUNT_LOCATION = 'resources/bm-agent-service-account-credentials.json'
-
-# The representative type that all messages are sent as.
-BOT_REPRESENTATIVE = BusinessMessagesRepresentative(
-    representativeType=BusinessMessagesRepresentative.RepresentativeTypeValueValuesEnum.BOT)
@@ -18,33 +18,132 @@
 Functions to support views.py, the functions in this utilities file connect with
 the Python Business Messages SDK to create messages to send to users.
 '''
+import contextlib
+import contextvars
+import functools
+import hashlib
+import json
+import threading
+import time
 import uuid
-import pytz
+from collections import namedtuple
 from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
-from oauth2client.service_account import ServiceAccountCredentials
-from businessmessages import businessmessages_v1_client as bm_client
-from businessmessages.businessmessages_v1_messages import BusinessmessagesConversationsMessagesCreateRequest
-
-from businessmessages.businessmessages_v1_messages import (
-    BusinessMessagesCarouselCard, BusinessMessagesCardContent, BusinessMessagesContentInfo,
-    BusinessMessagesOpenUrlAction, BusinessMessagesMedia, BusinessMessagesMessage,
-    BusinessMessagesRichCard, BusinessMessagesStandaloneCard,
-    BusinessMessagesSuggestion, BusinessMessagesSuggestedAction, BusinessMessagesSuggestedReply)
-
-from .models import Item, ShoppedItem
+from . import metrics
+from .cart_store import get_cart_store, get_shopping_cart_id
+from .models import Item, Order, ShoppingCart
+from .money import cart_totals, format_minor_units
+from .orders import (get_open_orders, get_order_lines, get_pending_orders_page,
+    get_purchases_page, get_reschedulable_order, reschedule_order)
+from .pickup import (get_business_hours, get_open_slots, get_slot_start,
+    get_week_business_hours, reserve_slot)
+from .routers import read_replica
+from .sdk import bm_client, bm_messages, service_account
 
 from .view_constants import (MSG_SHOW_FOOD_MENU, MSG_SHOW_DRINKS_MENU,
     MSG_PURCHASE_CART, MSG_ABANDON_CART, MSG_PURCHASE, MSG_EMPTY_CART,
     MSG_SEE_CART, MSG_SEE_CART_BREAKDOWN, MSG_CART_NOW_EMPTY,
     MSG_CHECK_PENDING_ORDERS, MSG_ADD_TO_CART, MSG_PENDING_ORDERS,
-    MSG_REMOVE_ALL, MSG_SHOW_PAST_PURCHASES, DOMAIN,
+    MSG_REMOVE_ALL, MSG_SHOW_PAST_PURCHASES, MSG_RESCHEDULE_ORDER,
+    MSG_CHECK_ORDER_STATUS, MSG_REORDER, DOMAIN,
     CMD_SHOW_PENDING_PICKUP, CMD_SHOW_PURCHASES, CMD_DRINK_MENU, CMD_FOOD_MENU,
     CMD_PURCHASE_CART, CMD_CART_BREAKDOWN, CMD_SHOW_CART, CMD_ABANDON_CART,
     CMD_ADD_TO_CART, CMD_SET_PICKUP_DATE, CMD_SET_PICKUP_TIME,
-    CMD_CONF_PICKUP_DETAILS, CMD_RESET_PICKUP_DETAILS,
-    SERVICE_ACCOUNT_LOCATION, BOT_REPRESENTATIVE)
+    CMD_CONF_PICKUP_DETAILS, CMD_RESET_PICKUP_DETAILS, CMD_REMOVE_FROM_CART,
+    CMD_REMOVE_ALL_FROM_CART, CMD_RESCHEDULE_ORDER, CMD_CHECK_ORDER_STATUS,
+    CMD_REORDER,
+    SERVICE_ACCOUNT_LOCATION)
+
+# An item in a cart. Exposes the same item and quantity attributes as
+# ShoppedItem so templates and messages work with any CartStore backend.
+CartEntry = namedtuple('CartEntry', ['item', 'quantity'])
+
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
+    'Saturday', 'Sunday']
+
+# How the order status message describes each open state.
+ORDER_STATE_DESCRIPTIONS = {
+    Order.PAID: 'has been received',
+    Order.PREPARING: 'is being prepared',
+    Order.READY: 'is ready for pickup',
+}
+
+# Pickup time suggestions by (business hours, first hour), filled in by
+# get_pickup_time_suggestions. Suggestions are never changed once built, so
+# every message can share them.
+_pickup_time_suggestions = {}
+
+# Menu carousels by builder name, with when they were built, filled in by
+# _cache_menu. Like the pickup time suggestions they are never changed once
+# built, so every message can share them.
+_menu_carousels = {}
+
+_credentials = None
+_credentials_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def get_bot_representative():
+    '''
+    Builds the representative all messages are sent as on first use, so
+    that importing this module does not import the Business Messages
+    messages. Like the pickup time suggestions it is never changed once
+    built, so every message can share it.
+
+    Returns:
+        A :BusinessMessagesRepresentative: of the BOT type.
+    '''
+    representative = bm_messages.BusinessMessagesRepresentative
+    return representative(representativeType=
+        representative.RepresentativeTypeValueValuesEnum.BOT)
+
+@functools.lru_cache(maxsize=None)
+def _get_pickup_asap_suggestion():
+    return bm_messages.BusinessMessagesSuggestion(
+        reply=bm_messages.BusinessMessagesSuggestedReply(
+            text='As soon as possible',
+            postbackData=f'{CMD_SET_PICKUP_TIME}-now'
+        )
+    )
+
+# The messages of the current request while queue_messages() is active.
+_outbox = contextvars.ContextVar('bopis_outbox', default=None)
+
+@contextlib.contextmanager
+def queue_messages():
+    '''
+    Has send_message queue messages instead of posting them, for the
+    enclosed block and the sync_to_async calls made from it. The ASGI
+    webhook posts them once the view returns, see bopis/asgi.py.
+
+    Yields:
+        The :list: of (message, conversation id) pairs queued so far.
+    '''
+    outbox = []
+    token = _outbox.set(outbox)
+    try:
+        yield outbox
+    finally:
+        _outbox.reset(token)
+
+def get_credentials():
+    '''
+    Loads the service account credentials once per process. They refresh
+    their access token when it expires.
+
+    Returns:
+        The :ServiceAccountCredentials: for the Business Messages API.
+    '''
+    global _credentials
+    if _credentials is None:
+        with _credentials_lock:
+            if _credentials is None:
+                _credentials = service_account.ServiceAccountCredentials.from_json_keyfile_name(
+                    SERVICE_ACCOUNT_LOCATION,
+                    scopes=['https://www.googleapis.com/auth/businessmessages'])
+    return _credentials
 
 def send_message(message, conversation_id):
     '''
@@ -56,19 +155,62 @@ def send_message(message, conversation_id):
         message (obj): The message object payload to send to the user.
         conversation_id (str): The unique id for this user and agent.
     '''
-    credentials = ServiceAccountCredentials.from_json_keyfile_name(
-        SERVICE_ACCOUNT_LOCATION,
-        scopes=['https://www.googleapis.com/auth/businessmessages'])
+    outbox = _outbox.get()
+    if outbox is not None:
+        with metrics.phase('outbound'):
+            outbox.append((message, conversation_id))
+        return
+
+    with metrics.phase('outbound'):
+        url = getattr(settings, 'BOPIS_BUSINESS_MESSAGES_URL', '')
+        if url:
+            client = bm_client.BusinessmessagesV1(url=url, get_credentials=False)
+        else:
+            client = bm_client.BusinessmessagesV1(credentials=get_credentials())
+
+        # Create the message request.
+        create_request = bm_messages.BusinessmessagesConversationsMessagesCreateRequest(
+            businessMessagesMessage=message,
+            parent='conversations/' + conversation_id)
 
-    client = bm_client.BusinessmessagesV1(credentials=credentials)
+        bm_client.BusinessmessagesV1.ConversationsMessagesService(
+            client=client).Create(request=create_request)
 
-    # Create the message request.
-    create_request = BusinessmessagesConversationsMessagesCreateRequest(
-        businessMessagesMessage=message,
-        parent='conversations/' + conversation_id)
+def get_cart_entries(conversation_id, summary=None):
+    '''
+    Reads a conversation's cart from the configured CartStore and pairs every
+    line with its Item using a single query.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+        summary (CartSummary): The cart, if the caller already read it.
+    Returns:
+        A :list: of CartEntry objects ordered by item id.
+    '''
+    if summary is None:
+        summary = get_cart_store().get_summary(conversation_id)
+    if not summary.lines:
+        return []
 
-    bm_client.BusinessmessagesV1.ConversationsMessagesService(
-        client=client).Create(request=create_request)
+    items = Item.objects.in_bulk([line.item_id for line in summary.lines])
+    return [CartEntry(items[line.item_id], line.quantity)
+        for line in summary.lines if line.item_id in items]
+
+def get_cart_fingerprint(cart_entries, *extra):
+    '''
+    Fingerprints a cart as read with get_cart_entries.
+
+    Args:
+        cart_entries (list): CartEntry objects.
+        *extra: Other JSON serialisable values the fingerprint depends on.
+    Returns:
+        A :str: that changes whenever the items, quantities, names, prices,
+        images or extra values change.
+    '''
+    contents = [(entry.item.id, entry.quantity, entry.item.name,
+        str(entry.item.price), entry.item.image_url) for entry in cart_entries]
+    payload = json.dumps([contents, extra], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf8')).hexdigest()[:32]
 
 def determine_time_hour_and_meridiem(i):
     '''
@@ -99,28 +241,41 @@ def send_business_hours_message(conv):
         conv (Conversation): The conversation object tied to the user
     '''
 
-    rich_card = BusinessMessagesRichCard(
-        standaloneCard=BusinessMessagesStandaloneCard(
-        cardContent=BusinessMessagesCardContent(
+    def format_hours(business_hours, minutes=':00'):
+        if business_hours is None:
+            return 'Closed'
+        (open_hour, open_meridiem), (close_hour, close_meridiem) = map(
+            determine_time_hour_and_meridiem, business_hours)
+        return (f'{open_hour}{minutes} {open_meridiem} - '
+            f'{close_hour}{minutes} {close_meridiem}')
+
+    week_business_hours = get_week_business_hours()
+    day_descriptions = [
+        f'{WEEKDAY_NAMES[weekday]} {format_hours(week_business_hours[weekday])}'
+        for weekday in (6, 0, 1, 2, 3, 4, 5)]
+    if len(set(week_business_hours)) == 1 and week_business_hours[0] is not None:
+        fallback = ('Business Hours...Open daily from '
+            f"{format_hours(week_business_hours[0], minutes='')}")
+    else:
+        fallback = 'Business Hours...' + ', '.join(day_descriptions)
+
+    rich_card = bm_messages.BusinessMessagesRichCard(
+        standaloneCard=bm_messages.BusinessMessagesStandaloneCard(
+        cardContent=bm_messages.BusinessMessagesCardContent(
             title='Business Hours',
-            description='''
-            Sunday 8:00 AM - 8:00 PM \nMonday 8:00 AM - 8:00 PM
-            Tuesday 8:00 AM - 8:00 PM \nWednesday 8:00 AM - 8:00 PM
-            Thursday 8:00 AM - 8:00 PM \nFriday 8:00 AM - 8:00 PM
-            Saturday 8:00 AM - 8:00 PM
-            ''',
+            description='\n'.join(day_descriptions),
         )))
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         richCard=rich_card,
-        fallback=('Business Hours...Open daily from 8 AM - 8 PM'))
+        fallback=fallback)
 
     send_message(message_obj, conv.id)
 
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         text='''Thanks for inquiring about our Business Hours.
             Please let us know how else we can help!''',
         suggestions=get_cart_suggestions())
@@ -136,21 +291,21 @@ def send_proceed_to_payment_message(conv):
         conv (Conversation): The conversation object tied to the user
     '''
 
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         text='''Great! Thanks for confirming. Proceed to checkout and we'll let
             you know when your order is ready for pickup!''',
         suggestions=[
-        BusinessMessagesSuggestion(
-            action=BusinessMessagesSuggestedAction(
+        bm_messages.BusinessMessagesSuggestion(
+            action=bm_messages.BusinessMessagesSuggestedAction(
                 text=MSG_PURCHASE,
                 postbackData=MSG_PURCHASE,
-                openUrlAction=BusinessMessagesOpenUrlAction(
+                openUrlAction=bm_messages.BusinessMessagesOpenUrlAction(
                     url=f'{DOMAIN}/bopis/checkout/{conv.id}'))
             ),
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_ABANDON_CART,
                     postbackData=CMD_ABANDON_CART)
                 ),
@@ -158,49 +313,384 @@ def send_proceed_to_payment_message(conv):
         )
     send_message(message_obj, conv.id)
 
+def send_payment_confirmation_message(conversation_id):
+    '''
+    Tells the user their payment went through and offers the next steps.
+
+    Args:
+        conversation_id (str): The unique id for this user and agent.
+    '''
+
+    message_obj = bm_messages.BusinessMessagesMessage(
+        messageId=str(uuid.uuid4().int),
+        representative=get_bot_representative(),
+        text='''Your payment has been completed and your order is being
+            processed. We'll let you know that we've prepared your order and it
+            is ready for pickup near your scheduled time.''',
+        suggestions=[
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
+                    text=MSG_RESCHEDULE_ORDER,
+                    postbackData=CMD_RESCHEDULE_ORDER)
+                ),
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
+                    text=MSG_CHECK_ORDER_STATUS,
+                    postbackData=CMD_CHECK_ORDER_STATUS)
+                ),
+            ]
+        )
+    send_message(message_obj, conversation_id)
+
+def describe_pickup_time(pickup_datetime):
+    '''
+    Describes a pickup time the way the bot talks about it, e.g.
+    'tomorrow at 1 PM'.
+
+    Args:
+        pickup_datetime (datetime): The pickup time, may be None.
+    Returns:
+        A :str:.
+    '''
+    if pickup_datetime is None:
+        return 'at a time still to be set'
+
+    local_datetime = timezone.localtime(pickup_datetime)
+    days_away = (local_datetime.date() - timezone.localdate()).days
+    if days_away == 0:
+        day = 'today'
+    elif days_away == 1:
+        day = 'tomorrow'
+    else:
+        day = f'on {local_datetime:%A, %B} {local_datetime.day}'
+    time_hour, time_meridiem = determine_time_hour_and_meridiem(local_datetime.hour)
+    return f'{day} at {time_hour} {time_meridiem}'
+
+def send_order_status_message(conv):
+    '''
+    Tells the user where each of their orders that has not been picked up
+    yet is.
+
+    Args:
+        conv (Conversation): The conversation object tied to the user
+    '''
+    orders = get_open_orders(conv.id)
+    if not orders:
+        message_obj = bm_messages.BusinessMessagesMessage(
+            messageId=str(uuid.uuid4().int),
+            representative=get_bot_representative(),
+            text="You don't have any orders waiting for pickup.",
+            suggestions=get_cart_suggestions())
+        send_message(message_obj, conv.id)
+        return
+
+    status_lines = [f'Order #{order.id} {ORDER_STATE_DESCRIPTIONS[order.state]}, '
+        f'pickup {describe_pickup_time(order.pickup_datetime)}.' for order in orders]
+    suggestions = [
+        bm_messages.BusinessMessagesSuggestion(
+            reply=bm_messages.BusinessMessagesSuggestedReply(
+                text=MSG_CHECK_ORDER_STATUS,
+                postbackData=CMD_CHECK_ORDER_STATUS)
+            ),
+        ]
+    if any(order.state in Order.RESCHEDULABLE_STATES for order in orders):
+        suggestions.insert(0, bm_messages.BusinessMessagesSuggestion(
+            reply=bm_messages.BusinessMessagesSuggestedReply(
+                text=MSG_RESCHEDULE_ORDER,
+                postbackData=CMD_RESCHEDULE_ORDER)
+            ))
+
+    message_obj = bm_messages.BusinessMessagesMessage(
+        messageId=str(uuid.uuid4().int),
+        representative=get_bot_representative(),
+        text='\n'.join(status_lines),
+        suggestions=suggestions)
+    send_message(message_obj, conv.id)
+
+def get_orders_rich_card(orders):
+    '''
+    Shows orders as cards, in a carousel when there is more than one.
+
+    Args:
+        orders (list): Order objects with their carts' items.
+    Returns:
+        A :BusinessMessagesRichCard:.
+    '''
+    card_content = []
+    for order in orders:
+        cart = order.shopping_cart
+        lines = [f'{shopped_item.quantity} x {shopped_item.item.name}'
+            for shopped_item in cart.shoppeditem_set.all()]
+        suggestions = []
+        if order.state in Order.RESCHEDULABLE_STATES:
+            suggestions.append(bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
+                    text=MSG_RESCHEDULE_ORDER,
+                    postbackData=f'{CMD_RESCHEDULE_ORDER}-{order.id}')
+                ))
+        suggestions.append(bm_messages.BusinessMessagesSuggestion(
+            reply=bm_messages.BusinessMessagesSuggestedReply(
+                text=MSG_REORDER,
+                postbackData=f'{CMD_REORDER}-{order.id}')
+            ))
+        card_content.append(bm_messages.BusinessMessagesCardContent(
+            title=f'Order #{order.id}',
+            description='\n'.join([
+                f'{dict(Order.STATE_CHOICES)[order.state]}, pickup '
+                    f'{describe_pickup_time(order.pickup_datetime)}',
+                *lines,
+                f'Total paid: ${cart.total_paid} {cart.currency}']),
+            suggestions=suggestions))
+
+    if len(card_content) == 1:
+        return bm_messages.BusinessMessagesRichCard(
+            standaloneCard=bm_messages.BusinessMessagesStandaloneCard(
+                cardContent=card_content[0]))
+    return bm_messages.BusinessMessagesRichCard(
+        carouselCard=bm_messages.BusinessMessagesCarouselCard(
+            cardContents=card_content,
+            cardWidth=bm_messages.BusinessMessagesCarouselCard.CardWidthValueValuesEnum.MEDIUM))
+
+def send_orders_page_message(conv, page, command, empty_text):
+    '''
+    Sends a page of orders, with a suggestion for the next page if there is
+    one.
+
+    Args:
+        conv (Conversation): The conversation object tied to the user
+        page (Page): The orders to show.
+        command (str): The command that shows the next page.
+        empty_text (str): What to say when there are no orders at all.
+    '''
+    if not page.items:
+        message_obj = bm_messages.BusinessMessagesMessage(
+            messageId=str(uuid.uuid4().int),
+            representative=get_bot_representative(),
+            text=empty_text,
+            suggestions=get_cart_suggestions())
+        send_message(message_obj, conv.id)
+        return
+
+    suggestions = []
+    if page.next_cursor:
+        suggestions.append(bm_messages.BusinessMessagesSuggestion(
+            reply=bm_messages.BusinessMessagesSuggestedReply(
+                text='More',
+                postbackData=f'{command}-{page.next_cursor}')
+            ))
+    suggestions.extend(get_cart_suggestions()[:2])
+
+    message_obj = bm_messages.BusinessMessagesMessage(
+        messageId=str(uuid.uuid4().int),
+        representative=get_bot_representative(),
+        richCard=get_orders_rich_card(page.items),
+        fallback='\n'.join(f'Order #{order.id}: '
+            f'{dict(Order.STATE_CHOICES)[order.state]}' for order in page.items),
+        suggestions=suggestions)
+    send_message(message_obj, conv.id)
+
+def read_orders_page(read_page, conv, message):
+    '''
+    Reads the page of orders a postback asks for. A cursor that does not
+    decode, from a tampered or outdated postback, shows the first page.
+
+    Args:
+        read_page (function): get_pending_orders_page or get_purchases_page.
+        conv (Conversation): The conversation object tied to the user
+        message (String): The command, followed by a cursor for pages after
+            the first.
+    Returns:
+        A :Page: of Order objects.
+    '''
+    cursor = message.split('-', 1)[1] if '-' in message else None
+    try:
+        return read_page(conv.id, cursor)
+    except ValueError:
+        return read_page(conv.id)
+
+def send_pending_orders_message(conv, message):
+    '''
+    Shows the user's orders that are waiting for pickup, a page at a time.
+
+    Args:
+        conv (Conversation): The conversation object tied to the user
+        message (String): CMD_SHOW_PENDING_PICKUP, followed by a cursor for
+            pages after the first.
+    '''
+    send_orders_page_message(conv, read_orders_page(get_pending_orders_page, conv, message),
+        CMD_SHOW_PENDING_PICKUP, "You don't have any orders waiting for pickup.")
+
+def send_past_purchases_message(conv, message):
+    '''
+    Shows the user's purchases, newest first, a page at a time.
+
+    Args:
+        conv (Conversation): The conversation object tied to the user
+        message (String): CMD_SHOW_PURCHASES, followed by a cursor for pages
+            after the first.
+    '''
+    send_orders_page_message(conv, read_orders_page(get_purchases_page, conv, message),
+        CMD_SHOW_PURCHASES, "You haven't purchased anything yet.")
+
+def send_reschedule_order_message(conv, message):
+    '''
+    Walks the user through moving an order to another pickup time. The
+    postback grows by a step each time, reschedule_order, then
+    reschedule_order-<order id>-<YYYYMMDD>, then
+    reschedule_order-<order id>-<YYYYMMDD>-<hour>, which moves the order.
+
+    Args:
+        conv (Conversation): The conversation object tied to the user
+        message (String): The reschedule postback.
+    '''
+    steps = message.split('-')
+    order = get_reschedulable_order(conv.id, int(steps[1]) if len(steps) > 1 else None)
+    if order is None:
+        message_obj = bm_messages.BusinessMessagesMessage(
+            messageId=str(uuid.uuid4().int),
+            representative=get_bot_representative(),
+            text="You don't have an order that can still be rescheduled.",
+            suggestions=[
+                bm_messages.BusinessMessagesSuggestion(
+                    reply=bm_messages.BusinessMessagesSuggestedReply(
+                        text=MSG_CHECK_ORDER_STATUS,
+                        postbackData=CMD_CHECK_ORDER_STATUS)
+                    ),
+                ])
+        send_message(message_obj, conv.id)
+        return
+
+    today = timezone.localdate()
+    if len(steps) < 3:
+        message_obj = bm_messages.BusinessMessagesMessage(
+            messageId=str(uuid.uuid4().int),
+            representative=get_bot_representative(),
+            text=f'Your order is set for pickup {describe_pickup_time(order.pickup_datetime)}. '
+                'When would you like to pick it up instead?',
+            suggestions=[
+                bm_messages.BusinessMessagesSuggestion(
+                    reply=bm_messages.BusinessMessagesSuggestedReply(
+                        text=text,
+                        postbackData=f'{CMD_RESCHEDULE_ORDER}-{order.id}-{day:%Y%m%d}')
+                    )
+                for text, day in (('Today', today),
+                    ('Tomorrow', today + timezone.timedelta(days=1)))
+                ])
+        send_message(message_obj, conv.id)
+        return
+
+    pickup_date = timezone.datetime.strptime(steps[2], '%Y%m%d').date()
+    if len(steps) > 3:
+        if reschedule_order(order, get_slot_start(pickup_date, int(steps[3]))):
+            message_obj = bm_messages.BusinessMessagesMessage(
+                messageId=str(uuid.uuid4().int),
+                representative=get_bot_representative(),
+                text='Done! Your order is now set for pickup '
+                    f'{describe_pickup_time(order.pickup_datetime)}.',
+                suggestions=[
+                    bm_messages.BusinessMessagesSuggestion(
+                        reply=bm_messages.BusinessMessagesSuggestedReply(
+                            text=MSG_CHECK_ORDER_STATUS,
+                            postbackData=CMD_CHECK_ORDER_STATUS)
+                        ),
+                    ])
+            send_message(message_obj, conv.id)
+            return
+
+        message_obj = bm_messages.BusinessMessagesMessage(
+            messageId=str(uuid.uuid4().int),
+            representative=get_bot_representative(),
+            text='Sorry, that pickup time was just booked up.')
+        send_message(message_obj, conv.id)
+
+    suggestions = []
+    for slot in get_open_slots(pickup_date, after=timezone.localtime()):
+        if slot.start == order.pickup_datetime:
+            continue
+        i = timezone.localtime(slot.start).hour
+        time_hour, time_meridiem = determine_time_hour_and_meridiem(i)
+        suggestions.append(bm_messages.BusinessMessagesSuggestion(
+            reply=bm_messages.BusinessMessagesSuggestedReply(
+                text=f'{time_hour}:00 {time_meridiem}',
+                postbackData=f'{CMD_RESCHEDULE_ORDER}-{order.id}-{steps[2]}-{i}')
+            ))
+
+    if not suggestions:
+        message_obj = bm_messages.BusinessMessagesMessage(
+            messageId=str(uuid.uuid4().int),
+            representative=get_bot_representative(),
+            text='Sorry, there are no other pickup times left that day.',
+            suggestions=[
+                bm_messages.BusinessMessagesSuggestion(
+                    reply=bm_messages.BusinessMessagesSuggestedReply(
+                        text=MSG_RESCHEDULE_ORDER,
+                        postbackData=f'{CMD_RESCHEDULE_ORDER}-{order.id}')
+                    ),
+                ])
+    else:
+        message_obj = bm_messages.BusinessMessagesMessage(
+            messageId=str(uuid.uuid4().int),
+            representative=get_bot_representative(),
+            text='What time works better for you?',
+            suggestions=suggestions)
+    send_message(message_obj, conv.id)
+
 def send_get_pickup_detail_confirmation_message(conv, message):
     '''
-    Parses the pickup details and sends a confirmation message to the user.
+    Reserves the requested pickup slot and sends a confirmation message to
+    the user. If the slot filled up in the meantime the user is asked to
+    pick another time.
 
     Args:
         conv (Conversation): The conversation object tied to the user
         message (String): Message from user about their requested pick up time.
 
     '''
-    current_cart = conv.shopping_cart
+    current_cart = get_current_cart(conv)
     requested_pickup_time = message.split('-')
-    requested_pickup_hour = requested_pickup_time[1].split(':')[0]
-    requested_pickup_time_meridium = requested_pickup_time[2]
-
-    # Convert current_cart.pickup_datetime to readable time.
-    pickup_datetime = timezone.datetime(current_cart.pickup_date.year,
-        current_cart.pickup_date.month,
-        current_cart.pickup_date.day,
-        int(requested_pickup_hour))
-    current_cart.pickup_datetime = pickup_datetime
-    current_cart.save()
-    if timezone.now().day == current_cart.pickup_date.day:
+    local_datetime = timezone.localtime()
+    pickup_date = current_cart.pickup_date or local_datetime.date()
+
+    if requested_pickup_time[1] == 'now':
+        open_slots = get_open_slots(local_datetime.date(), after=local_datetime)
+        slot = reserve_slot(current_cart, open_slots[0].start) if open_slots else None
+    else:
+        requested_pickup_hour = int(requested_pickup_time[1].split(':')[0])
+        slot = reserve_slot(current_cart,
+            get_slot_start(pickup_date, requested_pickup_hour))
+
+    if local_datetime.date() == current_cart.pickup_date:
         pickup_date_str = 'today'
     else:
         pickup_date_str = 'tomorrow'
 
-    if int(requested_pickup_hour) > 12:
-        requested_pickup_hour = int(requested_pickup_hour) - 12
+    if slot is None:
+        message_obj = bm_messages.BusinessMessagesMessage(
+            messageId=str(uuid.uuid4().int),
+            representative=get_bot_representative(),
+            text='Sorry, that pickup time was just booked up.')
+        send_message(message_obj, conv.id)
+        send_pickup_time_request_message(conv,
+            f'{CMD_SET_PICKUP_DATE}-{pickup_date_str}')
+        return
+
+    requested_pickup_hour, requested_pickup_time_meridium = \
+        determine_time_hour_and_meridiem(timezone.localtime(slot.start).hour)
 
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         text=f'''Thanks for providing pickup time and date details. Please
 confirm that you'll be picking up this order {pickup_date_str} at {requested_pickup_hour} {requested_pickup_time_meridium}. Do I have this
 right?''',
         suggestions=[
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text='Yes',
                     postbackData=CMD_CONF_PICKUP_DETAILS)
                 ),
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text='No',
                     postbackData=CMD_RESET_PICKUP_DETAILS)
                 ),
@@ -215,23 +705,23 @@ def send_shopping_cart_empty_message(conv):
     Args:
         conv (Conversation): The conversation object tied to the user
     '''
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         text=MSG_EMPTY_CART,
         suggestions=[
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_SHOW_FOOD_MENU,
                     postbackData=CMD_FOOD_MENU)
                 ),
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_SHOW_DRINKS_MENU,
                     postbackData=CMD_DRINK_MENU)
                 ),
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_PENDING_ORDERS,
                     postbackData=CMD_SHOW_PENDING_PICKUP)
                 ),
@@ -247,33 +737,30 @@ def send_pickup_date_request_message(conv):
         conv (Conversation): The conversation object tied to the user
     '''
 
-    current_cart = conv.shopping_cart
-    shopped_items = ShoppedItem.objects.filter(cart=current_cart)
-
-    if len(shopped_items) == 0:
+    if not get_cart_store().get_summary(conv.id).lines:
         send_shopping_cart_empty_message(conv)
         return
 
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         text='We currently support pickup today or tomorrow.',
         )
 
     send_message(message_obj, conv.id)
 
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         text='When would you like to pick up your order?',
         suggestions=[
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text='Today',
                     postbackData=f'{CMD_SET_PICKUP_DATE}-today')
                 ),
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text='Tomorrow',
                     postbackData=f'{CMD_SET_PICKUP_DATE}-tomorrow')
                 ),
@@ -281,10 +768,37 @@ def send_pickup_date_request_message(conv):
         )
     send_message(message_obj, conv.id)
 
+def get_pickup_time_suggestions(business_hours, first_hour=0):
+    '''
+    Returns the pickup time suggestions within business hours from an hour
+    on. Each list is built once per process and reused, so today's changes
+    when the next hour starts and tomorrow's is the same all day.
+
+    Args:
+        business_hours (tuple): The (opening hour, closing hour) of the day.
+        first_hour (int): The first local hour to offer.
+    Returns:
+        A :dict: of BusinessMessagesSuggestion objects by local hour.
+    '''
+    key = (business_hours, first_hour)
+    suggestions = _pickup_time_suggestions.get(key)
+    if suggestions is None:
+        suggestions = {}
+        for i in range(max(first_hour, business_hours[0]), business_hours[1]):
+            time_hour, time_meridiem = determine_time_hour_and_meridiem(i)
+
+            suggestions[i] = bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
+                text=f'{time_hour}:00 {time_meridiem}',
+                postbackData=f'{CMD_SET_PICKUP_TIME}-{i}:00-{time_meridiem}')
+            )
+        _pickup_time_suggestions[key] = suggestions
+    return suggestions
+
 def send_pickup_time_request_message(conv, message):
     '''
     Requests more detail from the user about when they want to pick up their
-    order.
+    order. Only pickup slots with capacity left are offered.
 
     Args:
         conv (Conversation): The conversation object tied to the user
@@ -292,61 +806,70 @@ def send_pickup_time_request_message(conv, message):
 
     '''
     day = message.split('-')[-1]
-    current_cart = conv.shopping_cart
+    current_cart = get_current_cart(conv)
     suggestion_array = []
 
+    local_datetime = timezone.localtime()
     if day == 'today':
-        suggestion_array.append(
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
-                    text='As soon as possible',
-                    postbackData=f'{CMD_SET_PICKUP_TIME}-now'
-                )
-            )
-        )
-        current_cart.pickup_date = timezone.now().date()
-        local_timezone = pytz.timezone(settings.TIME_ZONE)
-        local_datetime = timezone.now().astimezone(local_timezone)
-        i = local_datetime.hour + 1
-
-        while i < 20:
-            time_hour, time_meridiem = determine_time_hour_and_meridiem(i)
-
-            suggestion_array.append(
-                BusinessMessagesSuggestion(
-                    reply=BusinessMessagesSuggestedReply(
-                    text=f'{time_hour}:00 {time_meridiem}',
-                    postbackData=f'{CMD_SET_PICKUP_TIME}-{i}:00-{time_meridiem}')
-                )
-            )
-            i = i + 1
-
-    if day == 'tomorrow':
-        current_cart.pickup_date = timezone.now().date() + timezone.timedelta(days=1)
-        i = 8
-        time_hour = 8
-
-        while i < 20:
-            time_hour, time_meridiem = determine_time_hour_and_meridiem(i)
-
-            suggestion_array.append(
-                BusinessMessagesSuggestion(
-                    reply=BusinessMessagesSuggestedReply(
-                    text=f'{time_hour}:00 {time_meridiem}',
-                    postbackData=f'{CMD_SET_PICKUP_TIME}-{i}:00-{time_meridiem}')
-                )
+        current_cart.pickup_date = local_datetime.date()
+        open_slots = get_open_slots(current_cart.pickup_date, after=local_datetime)
+        first_hour = local_datetime.hour + 1
+        if open_slots:
+            suggestion_array.append(_get_pickup_asap_suggestion())
+    else:
+        day = 'tomorrow'
+        current_cart.pickup_date = local_datetime.date() + timezone.timedelta(days=1)
+        open_slots = get_open_slots(current_cart.pickup_date)
+        first_hour = 0
+    current_cart.save(update_fields=['pickup_date'])
+
+    if open_slots:
+        suggestions = get_pickup_time_suggestions(
+            get_business_hours(current_cart.pickup_date), first_hour)
+        for slot in open_slots:
+            suggestion = suggestions.get(timezone.localtime(slot.start).hour)
+            if suggestion is not None:
+                suggestion_array.append(suggestion)
+    else:
+        other_day = 'tomorrow' if day == 'today' else 'today'
+        message_obj = bm_messages.BusinessMessagesMessage(
+            messageId=str(uuid.uuid4().int),
+            representative=get_bot_representative(),
+            text=f'Sorry, there are no pickup times left {day}.',
+            suggestions=[
+                bm_messages.BusinessMessagesSuggestion(
+                    reply=bm_messages.BusinessMessagesSuggestedReply(
+                        text=other_day.capitalize(),
+                        postbackData=f'{CMD_SET_PICKUP_DATE}-{other_day}')
+                    ),
+                ]
             )
-            i = i + 1
-    current_cart.save()
+        send_message(message_obj, conv.id)
+        return
 
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         text=f'What time would you like to pick up the order {day}?',
         suggestions=suggestion_array
     )
     send_message(message_obj, conv.id)
 
+def get_current_cart(conv):
+    '''
+    Gets the conversation's ShoppingCart, which holds the pickup details
+    whichever CartStore holds the items, and creates it if needed. Only the
+    ORM store creates it as items are added.
+
+    Args:
+        conv (Conversation): The conversation object tied to the user
+    Returns:
+        The current :ShoppingCart:.
+    '''
+    if conv.shopping_cart_id is None:
+        conv.shopping_cart = ShoppingCart.objects.get(id=get_shopping_cart_id(conv.id))
+    return conv.shopping_cart
+
 def add_item_to_cart(conv, item):
     '''
     Add an item to a specific cart.
@@ -355,17 +878,77 @@ def add_item_to_cart(conv, item):
         conv (Conversation): The conversation object tied to the user
         item (Item): The item the user wants to add to their cart
     '''
-    if not conv.shopping_cart:
-        conv.create_new_cart()
-    shopped_item = ShoppedItem.objects.filter(item=item, cart=conv.shopping_cart)
-    if len(shopped_item) == 0:
-        new_item = ShoppedItem(item=item)
-        new_item.place_in(conv.shopping_cart)
-        new_item.save()
+    get_cart_store().add(conv.id, item.id)
+
+def remove_item_from_cart(conv, item_id, quantity=1):
+    '''
+    Remove units of an item from a specific cart.
+
+    Args:
+        conv (Conversation): The conversation object tied to the user
+        item_id (int): The id of the item the user wants to remove
+        quantity (int): How many units to remove, None for all of them
+    '''
+    get_cart_store().remove(conv.id, item_id, quantity)
+
+def send_reorder_message(conv, message):
+    '''
+    Puts everything from a past order that is still available back in the
+    cart, in one read of the order and one write to the cart, and sends a
+    single summary instead of a confirmation per item.
+
+    Args:
+        conv (Conversation): The conversation object tied to the user
+        message (String): CMD_REORDER for the latest order, or
+            reorder-<order id>.
+    '''
+    order_id = message.split('-')[1] if '-' in message else None
+    lines = get_order_lines(conv.id, int(order_id) if order_id else None)
+
+    quantities, added, unavailable = {}, [], []
+    for item_id, name, quantity, available in lines:
+        if not available:
+            unavailable.append(name)
+            continue
+        quantities[item_id] = quantities.get(item_id, 0) + quantity
+        added.append(f'{quantity} x {name}')
+
+    if quantities:
+        get_cart_store().add_many(conv.id, quantities)
+        subtotal = cart_totals(get_cart_entries(conv.id)).subtotal
+        text = '\n'.join(["I've added your previous order to your cart:", *added,
+            f'Your cart total is now ${format_minor_units(subtotal)}.'])
+    elif lines:
+        text = 'None of the items from that order are available right now.'
     else:
-        shopped_item[0].quantity = shopped_item[0].quantity + 1
-        shopped_item[0].save()
+        text = "I couldn't find a past order to repeat."
+    if unavailable:
+        text += ('\n\nThese items are no longer available: '
+            f"{', '.join(unavailable)}.")
 
+    message_obj = bm_messages.BusinessMessagesMessage(
+        messageId=str(uuid.uuid4().int),
+        representative=get_bot_representative(),
+        text=text,
+        suggestions=[
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
+                    text=MSG_SEE_CART,
+                    postbackData=CMD_SHOW_CART)
+                ),
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
+                    text=MSG_PURCHASE_CART,
+                    postbackData=CMD_PURCHASE_CART)
+                ),
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
+                    text=MSG_SHOW_FOOD_MENU,
+                    postbackData=CMD_FOOD_MENU)
+                ),
+            ]
+        )
+    send_message(message_obj, conv.id)
 
 def send_item_added_to_cart(conv, item):
     '''
@@ -375,28 +958,28 @@ def send_item_added_to_cart(conv, item):
         conv (Conversation): The conversation object tied to the user
         item (Item): The item the user wants to add to their cart
     '''
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         text=f"You've added an item to your cart: {item.name}",
         suggestions=[
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_SEE_CART,
                     postbackData=CMD_SHOW_CART)
                 ),
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_SEE_CART_BREAKDOWN,
                     postbackData=CMD_CART_BREAKDOWN)
                 ),
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_SHOW_FOOD_MENU,
                     postbackData=CMD_FOOD_MENU)
                 ),
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_SHOW_DRINKS_MENU,
                     postbackData=CMD_DRINK_MENU)
                 ),
@@ -409,25 +992,25 @@ def send_shopping_cart(conv):
     Send the user their shopping cart.
     '''
 
-    cart_items = ShoppedItem.objects.filter(cart=conv.shopping_cart)
-    if not conv.shopping_cart or len(cart_items) == 0:
-        message_obj = BusinessMessagesMessage(
+    cart_items = get_cart_entries(conv.id)
+    if len(cart_items) == 0:
+        message_obj = bm_messages.BusinessMessagesMessage(
             messageId=str(uuid.uuid4().int),
-            representative=BOT_REPRESENTATIVE,
+            representative=get_bot_representative(),
             text=MSG_EMPTY_CART,
             suggestions=[
-                BusinessMessagesSuggestion(
-                    reply=BusinessMessagesSuggestedReply(
+                bm_messages.BusinessMessagesSuggestion(
+                    reply=bm_messages.BusinessMessagesSuggestedReply(
                         text=MSG_SHOW_FOOD_MENU,
                         postbackData=CMD_FOOD_MENU)
                     ),
-                BusinessMessagesSuggestion(
-                    reply=BusinessMessagesSuggestedReply(
+                bm_messages.BusinessMessagesSuggestion(
+                    reply=bm_messages.BusinessMessagesSuggestedReply(
                         text=MSG_SHOW_DRINKS_MENU,
                         postbackData=CMD_DRINK_MENU)
                     ),
-                BusinessMessagesSuggestion(
-                    reply=BusinessMessagesSuggestedReply(
+                bm_messages.BusinessMessagesSuggestion(
+                    reply=bm_messages.BusinessMessagesSuggestedReply(
                         text=MSG_PENDING_ORDERS,
                         postbackData=CMD_SHOW_PENDING_PICKUP)
                     ),
@@ -438,38 +1021,38 @@ def send_shopping_cart(conv):
     elif len(cart_items) == 1:
         fallback_text = (f'Your shopping cart contains a {cart_items[0].item.name}')
 
-        rich_card = BusinessMessagesRichCard(
-            standaloneCard=BusinessMessagesStandaloneCard(
-                cardContent=BusinessMessagesCardContent(
+        rich_card = bm_messages.BusinessMessagesRichCard(
+            standaloneCard=bm_messages.BusinessMessagesStandaloneCard(
+                cardContent=bm_messages.BusinessMessagesCardContent(
                     title=cart_items[0].item.name,
                     description=f'Quantity: {cart_items[0].quantity}',
                     suggestions=[],
-                    media=BusinessMessagesMedia(
-                        height=BusinessMessagesMedia.HeightValueValuesEnum.MEDIUM,
-                        contentInfo=BusinessMessagesContentInfo(
+                    media=bm_messages.BusinessMessagesMedia(
+                        height=bm_messages.BusinessMessagesMedia.HeightValueValuesEnum.MEDIUM,
+                        contentInfo=bm_messages.BusinessMessagesContentInfo(
                             fileUrl=cart_items[0].item.image_url,
                             forceRefresh=False
                         ))
                     )))
-        message_obj = BusinessMessagesMessage(
+        message_obj = bm_messages.BusinessMessagesMessage(
             messageId=str(uuid.uuid4().int),
-            representative=BOT_REPRESENTATIVE,
+            representative=get_bot_representative(),
             richCard=rich_card,
             fallback=fallback_text)
 
         send_message(message_obj, conv.id)
 
-        message_obj = BusinessMessagesMessage(
+        message_obj = bm_messages.BusinessMessagesMessage(
             messageId=str(uuid.uuid4().int),
-            representative=BOT_REPRESENTATIVE,
+            representative=get_bot_representative(),
             text=f'''The total value of your shopping cart is
-                ${cart_items[0].item.price * cart_items[0].quantity}.''',
+                ${format_minor_units(cart_totals(cart_items).subtotal)}.''',
             suggestions=get_cart_suggestions())
 
         send_message(message_obj, conv.id)
 
     else:
-        rich_card = BusinessMessagesRichCard(carouselCard=get_cart_carousel(cart_items))
+        rich_card = bm_messages.BusinessMessagesRichCard(carouselCard=get_cart_carousel(cart_items))
 
         # Construct a fallback text for devices that do not support carousels.
         fallback_text = ''
@@ -478,21 +1061,19 @@ def send_shopping_cart(conv):
                             + '\n\n' + card_content.media.contentInfo.fileUrl
                             + '\n---------------------------------------------\n\n')
 
-        message_obj = BusinessMessagesMessage(
+        message_obj = bm_messages.BusinessMessagesMessage(
             messageId=str(uuid.uuid4().int),
-            representative=BOT_REPRESENTATIVE,
+            representative=get_bot_representative(),
             richCard=rich_card,
             fallback=fallback_text)
 
         send_message(message_obj, conv.id)
 
-        total_price = 0
-        for cart_item in cart_items:
-            total_price = total_price + cart_item.item.price*cart_item.quantity
+        total_price = format_minor_units(cart_totals(cart_items).subtotal)
 
-        message_obj = BusinessMessagesMessage(
+        message_obj = bm_messages.BusinessMessagesMessage(
             messageId=str(uuid.uuid4().int),
-            representative=BOT_REPRESENTATIVE,
+            representative=get_bot_representative(),
             text=f'The total value of your shopping cart is ${total_price}.',
             suggestions=get_cart_suggestions()
             )
@@ -506,7 +1087,7 @@ def send_drink_menu(conv):
     Args:
         conversation_id (str): The unique id for this user and agent.
     '''
-    rich_card = BusinessMessagesRichCard(carouselCard=get_drink_menu_carousel())
+    rich_card = bm_messages.BusinessMessagesRichCard(carouselCard=get_drink_menu_carousel())
 
     # Construct a fallback text for devices that do not support carousels.
     fallback_text = ''
@@ -515,9 +1096,9 @@ def send_drink_menu(conv):
                           + '\n\n' + card_content.media.contentInfo.fileUrl
                           + '\n---------------------------------------------\n\n')
 
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         richCard=rich_card,
         fallback=fallback_text)
     send_message(message_obj, conv.id)
@@ -529,7 +1110,7 @@ def send_food_menu(conversation_id):
     Args:
         conversation_id (str): The unique id for this user and agent.
     '''
-    rich_card = BusinessMessagesRichCard(carouselCard=get_food_menu_carousel())
+    rich_card = bm_messages.BusinessMessagesRichCard(carouselCard=get_food_menu_carousel())
 
     # Construct a fallback text for devices that do not support carousels.
     fallback_text = ''
@@ -538,9 +1119,9 @@ def send_food_menu(conversation_id):
                           + '\n\n' + card_content.media.contentInfo.fileUrl
                           + '\n---------------------------------------------\n\n')
 
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         richCard=rich_card,
         fallback=fallback_text)
     send_message(message_obj, conversation_id)
@@ -553,23 +1134,23 @@ def send_abandoned_cart_message(conv):
         message (str): The message text received from the user.
         conversation_id (str): The unique id for this user and agent.
     '''
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         text=MSG_CART_NOW_EMPTY,
         suggestions=[
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_SHOW_FOOD_MENU,
                     postbackData=CMD_FOOD_MENU)
                 ),
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_CHECK_PENDING_ORDERS,
                     postbackData=CMD_SHOW_PENDING_PICKUP)
                 ),
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_SHOW_PAST_PURCHASES,
                     postbackData=CMD_SHOW_PURCHASES)
                 ),
@@ -581,41 +1162,38 @@ def send_cart_breakdown_message(conv):
     '''
     This function sends a textual representation
     '''
-    cart = conv.shopping_cart
-    shopped_items = ShoppedItem.objects.filter(cart=cart)
+    shopped_items = get_cart_entries(conv.id)
 
     if len(shopped_items) == 0:
         cart_breakdown = MSG_CART_NOW_EMPTY
     else:
         cart_breakdown = "Here's your cart breakdown:\n\n"
-        total_price = 0
-
-        for shopped_item in shopped_items:
-            total_price = total_price + shopped_item.item.price * shopped_item.quantity
+        totals = cart_totals(shopped_items)
 
+        for shopped_item, line_total in zip(shopped_items, totals.line_totals):
             cart_breakdown = cart_breakdown + f'''{shopped_item.item.name}\n
                 Quantity: {shopped_item.quantity}\n
-                Price: ${shopped_item.item.price * shopped_item.quantity}\n\n'''
+                Price: ${format_minor_units(line_total)}\n\n'''
 
-        cart_breakdown = cart_breakdown + f'-----\nSubtotal Price: ${total_price}'
+        cart_breakdown = cart_breakdown + f'-----\nSubtotal Price: ${format_minor_units(totals.subtotal)}'
 
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         text=cart_breakdown,
         suggestions=[
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_PURCHASE_CART,
                     postbackData=CMD_PURCHASE_CART)
                 ),
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_CHECK_PENDING_ORDERS,
                     postbackData=CMD_SHOW_PENDING_PICKUP)
                 ),
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_ABANDON_CART,
                     postbackData=CMD_ABANDON_CART)
                 ),
@@ -629,26 +1207,26 @@ def get_cart_suggestions():
     suggested reply and two actions.
 
     Returns:
-       A :list: A list of sample BusinessMessagesSuggestions.
+       A :list: A list of sample bm_messages.BusinessMessagesSuggestions.
     '''
     return [
-        BusinessMessagesSuggestion(
-            reply=BusinessMessagesSuggestedReply(
+        bm_messages.BusinessMessagesSuggestion(
+            reply=bm_messages.BusinessMessagesSuggestedReply(
                 text=MSG_SHOW_FOOD_MENU,
                 postbackData=CMD_FOOD_MENU)
             ),
-        BusinessMessagesSuggestion(
-            reply=BusinessMessagesSuggestedReply(
+        bm_messages.BusinessMessagesSuggestion(
+            reply=bm_messages.BusinessMessagesSuggestedReply(
                 text=MSG_SHOW_DRINKS_MENU,
                 postbackData=CMD_DRINK_MENU)
             ),
-        BusinessMessagesSuggestion(
-            reply=BusinessMessagesSuggestedReply(
+        bm_messages.BusinessMessagesSuggestion(
+            reply=bm_messages.BusinessMessagesSuggestedReply(
                 text=MSG_PURCHASE_CART,
                 postbackData=CMD_PURCHASE_CART)
             ),
-        BusinessMessagesSuggestion(
-            reply=BusinessMessagesSuggestedReply(
+        bm_messages.BusinessMessagesSuggestion(
+            reply=bm_messages.BusinessMessagesSuggestedReply(
                 text=MSG_ABANDON_CART,
                 postbackData=CMD_ABANDON_CART)
             ),
@@ -661,37 +1239,59 @@ def get_cart_carousel(cart_items):
     card_content = []
 
     for cart_entity in cart_items:
-        card_content.append(BusinessMessagesCardContent(
+        card_content.append(bm_messages.BusinessMessagesCardContent(
             title=cart_entity.item.name,
             description=f'Quantity: {cart_entity.quantity}' ,
             suggestions=[
-                    BusinessMessagesSuggestion(
-                        reply=BusinessMessagesSuggestedReply(
+                    bm_messages.BusinessMessagesSuggestion(
+                        reply=bm_messages.BusinessMessagesSuggestedReply(
                             text='➕',
                             postbackData=f'{CMD_ADD_TO_CART}-{cart_entity.item.id}')
                         ),
-                    BusinessMessagesSuggestion(
-                        reply=BusinessMessagesSuggestedReply(
+                    bm_messages.BusinessMessagesSuggestion(
+                        reply=bm_messages.BusinessMessagesSuggestedReply(
                             text='➖',
-                            postbackData=f'remove_from_cart-{cart_entity.item.id}')
+                            postbackData=f'{CMD_REMOVE_FROM_CART}-{cart_entity.item.id}')
                         ),
-                    BusinessMessagesSuggestion(
-                        reply=BusinessMessagesSuggestedReply(
+                    bm_messages.BusinessMessagesSuggestion(
+                        reply=bm_messages.BusinessMessagesSuggestedReply(
                             text=MSG_REMOVE_ALL,
-                            postbackData=f'remove_all_from_cart-{cart_entity.item.id}')
+                            postbackData=f'{CMD_REMOVE_ALL_FROM_CART}-{cart_entity.item.id}')
                         ),
                     ],
-            media=BusinessMessagesMedia(
-                height=BusinessMessagesMedia.HeightValueValuesEnum.MEDIUM,
-                contentInfo=BusinessMessagesContentInfo(
+            media=bm_messages.BusinessMessagesMedia(
+                height=bm_messages.BusinessMessagesMedia.HeightValueValuesEnum.MEDIUM,
+                contentInfo=bm_messages.BusinessMessagesContentInfo(
                     fileUrl=cart_entity.item.image_url,
                     forceRefresh=False))))
 
-    return BusinessMessagesCarouselCard(
+    return bm_messages.BusinessMessagesCarouselCard(
         cardContents=card_content,
-        cardWidth=BusinessMessagesCarouselCard.CardWidthValueValuesEnum.MEDIUM
+        cardWidth=bm_messages.BusinessMessagesCarouselCard.CardWidthValueValuesEnum.MEDIUM
         )
 
+def _cache_menu(build):
+    '''
+    Reuses the carousel a menu builder returns for BOPIS_MENU_CACHE_SECONDS.
+    Saving or deleting an Item in this process drops the carousels at once,
+    other processes and bulk changes, e.g. setup_inventory, are picked up
+    when they expire.
+    '''
+    @functools.wraps(build)
+    def wrapper():
+        now = time.monotonic()
+        cached = _menu_carousels.get(build.__name__)
+        if cached is None or now - cached[0] >= settings.BOPIS_MENU_CACHE_SECONDS:
+            cached = _menu_carousels[build.__name__] = (now, build())
+        return cached[1]
+    return wrapper
+
+@receiver([post_save, post_delete], sender=Item)
+def _forget_menu_carousels(**kwargs):
+    _menu_carousels.clear()
+
+@_cache_menu
+@read_replica()
 def get_food_menu_carousel():
     '''
     Creates the food menu carousel rich card.
@@ -703,20 +1303,22 @@ def get_food_menu_carousel():
     menu_items = Item.objects.filter(available=True, menu_type='F')
 
     for item in menu_items:
-        card_content.append(BusinessMessagesCardContent(
+        card_content.append(bm_messages.BusinessMessagesCardContent(
             title=item.name,
             description=f'${item.price}{item.currency}' ,
             suggestions=get_menu_item_suggestions(item),
-            media=BusinessMessagesMedia(
-                height=BusinessMessagesMedia.HeightValueValuesEnum.MEDIUM,
-                contentInfo=BusinessMessagesContentInfo(
+            media=bm_messages.BusinessMessagesMedia(
+                height=bm_messages.BusinessMessagesMedia.HeightValueValuesEnum.MEDIUM,
+                contentInfo=bm_messages.BusinessMessagesContentInfo(
                     fileUrl=item.image_url,
                     forceRefresh=False))))
 
-    return BusinessMessagesCarouselCard(
+    return bm_messages.BusinessMessagesCarouselCard(
         cardContents=card_content,
-        cardWidth=BusinessMessagesCarouselCard.CardWidthValueValuesEnum.MEDIUM)
+        cardWidth=bm_messages.BusinessMessagesCarouselCard.CardWidthValueValuesEnum.MEDIUM)
 
+@_cache_menu
+@read_replica()
 def get_drink_menu_carousel():
     '''
     Creates the drink menu carousel rich card.
@@ -728,19 +1330,19 @@ def get_drink_menu_carousel():
     menu_items = Item.objects.filter(available=True, menu_type='D')
 
     for item in menu_items:
-        card_content.append(BusinessMessagesCardContent(
+        card_content.append(bm_messages.BusinessMessagesCardContent(
             title=item.name,
             description=f'${item.price}{item.currency}' ,
             suggestions=get_menu_item_suggestions(item),
-            media=BusinessMessagesMedia(
-                height=BusinessMessagesMedia.HeightValueValuesEnum.MEDIUM,
-                contentInfo=BusinessMessagesContentInfo(
+            media=bm_messages.BusinessMessagesMedia(
+                height=bm_messages.BusinessMessagesMedia.HeightValueValuesEnum.MEDIUM,
+                contentInfo=bm_messages.BusinessMessagesContentInfo(
                     fileUrl=item.image_url,
                     forceRefresh=False))))
 
-    return BusinessMessagesCarouselCard(
+    return bm_messages.BusinessMessagesCarouselCard(
         cardContents=card_content,
-        cardWidth=BusinessMessagesCarouselCard.CardWidthValueValuesEnum.MEDIUM)
+        cardWidth=bm_messages.BusinessMessagesCarouselCard.CardWidthValueValuesEnum.MEDIUM)
 
 def get_menu_item_suggestions(item):
     '''
@@ -748,20 +1350,20 @@ def get_menu_item_suggestions(item):
     suggested reply and two actions.
 
     Returns:
-       A :list: A list of sample BusinessMessagesSuggestions.
+       A :list: A list of sample bm_messages.BusinessMessagesSuggestions.
     '''
 
     return [
-        BusinessMessagesSuggestion(
-            reply=BusinessMessagesSuggestedReply(
+        bm_messages.BusinessMessagesSuggestion(
+            reply=bm_messages.BusinessMessagesSuggestedReply(
                 text=MSG_ADD_TO_CART,
                 postbackData=f'{CMD_ADD_TO_CART}-{item.id}')
             ),
-        BusinessMessagesSuggestion(
-            action=BusinessMessagesSuggestedAction(
+        bm_messages.BusinessMessagesSuggestion(
+            action=bm_messages.BusinessMessagesSuggestedAction(
                 text=MSG_PURCHASE,
                 postbackData=MSG_PURCHASE,
-                openUrlAction=BusinessMessagesOpenUrlAction(
+                openUrlAction=bm_messages.BusinessMessagesOpenUrlAction(
                     url=f'{DOMAIN}/bopis/purchase/{item.id}'))
             ),
         ]
@@ -19,26 +19,38 @@ View layer logic. Includes logic that manages the webhook to receive messages
 from Business Messages infrastructure when a user sends a message to the agent.
 '''
 
+import functools
+import hmac
 import json
+import time
 import uuid
-import stripe
+from django.conf import settings
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import (HttpResponse, HttpResponseBadRequest,
+    HttpResponseForbidden, HttpResponseNotAllowed, JsonResponse)
+from django.utils.cache import (get_conditional_response,
+    patch_cache_control)
+from django.utils.http import http_date, quote_etag
 from django.views.decorators.csrf import csrf_exempt
 
-from businessmessages.businessmessages_v1_messages import (
-    BusinessMessagesMessage, BusinessMessagesSuggestion,
-    BusinessMessagesSuggestedReply)
-
-from .models import Item, Conversation, ShoppedItem
+from . import capture, metrics, payments
+from .cart_store import get_cart_store
+from .checkout import get_checkout_session, prefetch_checkout_session
+from .models import Item, Conversation
+from .money import cart_totals, format_minor_units, get_tax_rate
+from .query_budgets import watch_query_budget
+from .routers import conversation_scope, read_replica
+from .sdk import bm_messages
+from .warmup import warm_up
 
 from .view_constants import (CMD_DRINK_MENU, CMD_FOOD_MENU, CMD_SHOW_HOURS,
     CMD_PURCHASE_CART, CMD_CART_BREAKDOWN, CMD_SHOW_CART, CMD_ABANDON_CART,
     CMD_ADD_TO_CART, CMD_SET_PICKUP_DATE, CMD_SET_PICKUP_TIME,
     CMD_CONF_PICKUP_DETAILS, CMD_RESCHEDULE_ORDER, CMD_RESET_PICKUP_DETAILS,
-    CMD_CHECK_ORDER_STATUS, MSG_CODELAB_NAME, MSG_CART_NOW_EMPTY,
-    MSG_RESCHEDULE_ORDER, MSG_CHECK_ORDER_STATUS, MSG_COULD_NOT_PROCESS,
-    MSG_TRY_AGAIN, BOT_REPRESENTATIVE)
+    CMD_CHECK_ORDER_STATUS, CMD_REMOVE_FROM_CART, CMD_REMOVE_ALL_FROM_CART,
+    CMD_SHOW_PENDING_PICKUP, CMD_SHOW_PURCHASES, CMD_REORDER,
+    MSG_CODELAB_NAME, MSG_CART_NOW_EMPTY, MSG_COULD_NOT_PROCESS,
+    MSG_TRY_AGAIN, DOMAIN)
 
 from .view_utils import (send_food_menu, send_drink_menu,
     send_business_hours_message, add_item_to_cart, send_item_added_to_cart,
@@ -46,9 +58,24 @@ from .view_utils import (send_food_menu, send_drink_menu,
     send_abandoned_cart_message, send_pickup_date_request_message,
     send_pickup_time_request_message, send_message,
     send_get_pickup_detail_confirmation_message,
-    send_proceed_to_payment_message)
+    send_proceed_to_payment_message, remove_item_from_cart, get_cart_entries,
+    get_cart_fingerprint, send_order_status_message, send_reschedule_order_message,
+    get_bot_representative, get_current_cart,
+    send_pending_orders_message, send_past_purchases_message, send_reorder_message)
+
+# The commands route_message handles, in the order it checks for them.
+ROUTED_COMMANDS = (CMD_FOOD_MENU, CMD_DRINK_MENU, CMD_SHOW_HOURS,
+    CMD_ADD_TO_CART, CMD_REMOVE_FROM_CART, CMD_REMOVE_ALL_FROM_CART,
+    CMD_CART_BREAKDOWN, CMD_SHOW_CART, CMD_ABANDON_CART, CMD_PURCHASE_CART,
+    CMD_SET_PICKUP_DATE, CMD_SET_PICKUP_TIME, CMD_RESET_PICKUP_DETAILS,
+    CMD_SHOW_PENDING_PICKUP, CMD_SHOW_PURCHASES, CMD_CHECK_ORDER_STATUS,
+    CMD_RESCHEDULE_ORDER, CMD_REORDER, CMD_CONF_PICKUP_DETAILS)
+
+# Headers App Engine sets on the requests it sends itself, see internal_only.
+APPENGINE_HEADERS = ('X-Appengine-Warmup', 'X-Appengine-Cron')
 
 @csrf_exempt
+@capture.capture_webhook
 def callback(request):
     '''
     Callback URL. Processes messages sent from a user.
@@ -59,8 +86,9 @@ def callback(request):
         An :HttpResponse: with status code to inform Business Messages of receipt.
     '''
     if request.method == 'POST':
-        request_data = request.body.decode('utf8').replace("'", '"')
-        request_body = json.loads(request_data)
+        with metrics.phase('parse'):
+            request_data = request.body.decode('utf8').replace("'", '"')
+            request_body = json.loads(request_data)
 
         print('request_body: %s', request_body)
 
@@ -68,30 +96,33 @@ def callback(request):
         conversation_id = request_body.get('conversationId')
         print('conversation_id: %s', conversation_id)
 
-        # Check if we've seen this conversation before, if not create it.
-        conv = Conversation.objects.filter(id = conversation_id)
-        if len(conv) == 0:
-            conv = Conversation(id=conversation_id)
-            conv.save()
-        else:
-            conv = conv[0]
-
-        # Check that the message and text body exist.
-        if 'message' in request_body and 'text' in request_body['message']:
-            message = request_body['message']['text']
-
-            print('message: %s', message)
-            route_message(message, conv)
-        elif 'suggestionResponse' in request_body:
-            message = request_body['suggestionResponse']['postbackData']
-
-            print('message: %s', message)
-            route_message(message, conv)
-        elif 'userStatus' in request_body:
-            if 'isTyping' in request_body['userStatus']:
-                print('User is typing')
-            elif 'requestedLiveAgent' in request_body['userStatus']:
-                print('User requested transfer to live agent')
+        with conversation_scope(conversation_id):
+            # Check if we've seen this conversation before, if not create it.
+            # Most commands read the cart, so it comes with the conversation.
+            conv = Conversation.objects.filter(id = conversation_id).select_related(
+                'shopping_cart')
+            if len(conv) == 0:
+                conv = Conversation(id=conversation_id)
+                conv.save()
+            else:
+                conv = conv[0]
+
+            # Check that the message and text body exist.
+            if 'message' in request_body and 'text' in request_body['message']:
+                message = request_body['message']['text']
+
+                print('message: %s', message)
+                route_message(message, conv)
+            elif 'suggestionResponse' in request_body:
+                message = request_body['suggestionResponse']['postbackData']
+
+                print('message: %s', message)
+                route_message(message, conv)
+            elif 'userStatus' in request_body:
+                if 'isTyping' in request_body['userStatus']:
+                    print('User is typing')
+                elif 'requestedLiveAgent' in request_body['userStatus']:
+                    print('User requested transfer to live agent')
 
         return HttpResponse('Response.')
 
@@ -106,6 +137,13 @@ def route_message(message, conv):
         conv (Conversation): The unique conversation object for this user and agent.
     '''
 
+    command = next((command for command in ROUTED_COMMANDS
+        if command in message.lower()), 'unrouted')
+    metrics.set_command(command)
+    with watch_query_budget(command):
+        _send_reply(message, conv)
+
+def _send_reply(message, conv):
     normalized_message = message.lower()
 
     if CMD_FOOD_MENU in normalized_message:
@@ -119,12 +157,20 @@ def route_message(message, conv):
         item = Item.objects.get(id = item_id)
         add_item_to_cart(conv, item)
         send_item_added_to_cart(conv, item)
+    elif CMD_REMOVE_FROM_CART in message:
+        item_id = message.split('-')[-1]
+        remove_item_from_cart(conv, int(item_id))
+        send_shopping_cart(conv)
+    elif CMD_REMOVE_ALL_FROM_CART in message:
+        item_id = message.split('-')[-1]
+        remove_item_from_cart(conv, int(item_id), quantity=None)
+        send_shopping_cart(conv)
     elif CMD_CART_BREAKDOWN in message:
         send_cart_breakdown_message(conv)
     elif CMD_SHOW_CART in message:
         send_shopping_cart(conv)
     elif CMD_ABANDON_CART in message:
-        conv.create_new_cart()
+        get_cart_store().start_new_cart(conv)
         send_abandoned_cart_message(conv)
     elif CMD_PURCHASE_CART in message:
         send_pickup_date_request_message(conv)
@@ -132,10 +178,85 @@ def route_message(message, conv):
         send_pickup_time_request_message(conv, message)
     elif CMD_SET_PICKUP_TIME in message:
         send_get_pickup_detail_confirmation_message(conv, message)
+    elif CMD_RESET_PICKUP_DETAILS in message:
+        # Give the slot back so others can book it while the user picks again.
+        get_current_cart(conv).release_pickup_slot()
+        send_pickup_date_request_message(conv)
+    elif CMD_SHOW_PENDING_PICKUP in message:
+        send_pending_orders_message(conv, message)
+    elif CMD_SHOW_PURCHASES in message:
+        send_past_purchases_message(conv, message)
+    elif CMD_CHECK_ORDER_STATUS in message:
+        send_order_status_message(conv)
+    elif CMD_RESCHEDULE_ORDER in message:
+        send_reschedule_order_message(conv, message)
+    elif CMD_REORDER in message:
+        send_reorder_message(conv, message)
     elif CMD_CONF_PICKUP_DETAILS in message:
+        # Checkout is the next step, have its Stripe session ready for it.
+        prefetch_checkout_session(conv.id)
         send_proceed_to_payment_message(conv)
 
 
+def internal_only(view):
+    '''
+    Decorates a view to answer 403 Forbidden unless App Engine sent the
+    request, with an X-Appengine-Warmup or X-Appengine-Cron header, which it
+    strips from outside requests, or the request carries an
+    "Authorization: Bearer" header equal to BOPIS_INTERNAL_TOKEN.
+
+    Args:
+        view (function): The view.
+    Returns:
+        The decorated view.
+    '''
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if settings.BOPIS_TRUST_APPENGINE_HEADERS and any(
+                header in request.headers for header in APPENGINE_HEADERS):
+            return view(request, *args, **kwargs)
+        token = settings.BOPIS_INTERNAL_TOKEN
+        authorization = request.headers.get('Authorization', '')
+        if token and hmac.compare_digest(authorization.encode(),
+                f'Bearer {token}'.encode()):
+            return view(request, *args, **kwargs)
+        return HttpResponseForbidden()
+    return wrapper
+
+@internal_only
+def warmup(request):
+    '''
+    App Engine warmup request, sent to new instances before they take
+    traffic. Warms the process up, see bopis/warmup.py.
+
+    Args:
+        request (HttpRequest): The request object that django passes to the function
+    Returns:
+        A :JsonResponse: with the time and outcome of every warmup stage.
+        Why a stage failed is only logged.
+    '''
+    stages = warm_up()
+    return JsonResponse({
+        'seconds': round(sum(stage.seconds for stage in stages), 6),
+        'stages': [{'name': stage.name, 'seconds': round(stage.seconds, 6),
+            'result': 'failed' if stage.failed else stage.result}
+            for stage in stages],
+    })
+
+@internal_only
+def export_metrics(request):
+    '''
+    Serves the request latency histograms of this process to Prometheus, see
+    bopis/metrics.py.
+
+    Args:
+        request (HttpRequest): The request object that django passes to the function
+    Returns:
+        An :HttpResponse: in the Prometheus text exposition format.
+    '''
+    return HttpResponse(metrics.render_metrics(),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def landing_placeholder(request):
     '''
     Creates an HttpResponse for a user browsing to the root of the deployed project.
@@ -159,7 +280,10 @@ def landing_placeholder(request):
 def create_checkout_session(request):
     '''
     Creates a checkout session tied to a payment page hosted by Stripe payment
-    integration API.
+    integration API. The session is reused until the cart changes, see
+    bopis/checkout.py. Stripe sends the user back to DOMAIN, like the
+    checkout link the agent sent, whatever host served this request, so the
+    session prefetched when the pickup details were confirmed matches.
 
     Args:
         request (HttpRequest): The request object that django passes to the function
@@ -167,91 +291,99 @@ def create_checkout_session(request):
         An :HttpResponse: containing browser renderable HTML.
     '''
 
-    full_url = request.build_absolute_uri()
-    domain = full_url.split('/bopis/create-checkout-session')[0]
     conv_id = request.GET.get('conversation_id')
-    conv = Conversation.objects.get(id=conv_id)
-    current_cart = conv.shopping_cart
-    shopped_items = ShoppedItem.objects.filter(cart=current_cart)
-
-    shopping_cart_dict = {}
-    if len(shopped_items) == 0:
-        cart_breakdown = MSG_CART_NOW_EMPTY
-    else:
-        cart_breakdown = "Here's your cart breakdown:\n\n"
-        total_price = 0
-
-        for shopped_item in shopped_items:
-            shopping_cart_dict[shopped_item] = shopped_item.quantity
-            total_price = total_price + shopped_item.item.price * shopped_item.quantity
-            cart_breakdown = cart_breakdown + f'''{shopped_item.item.name}\n
-                Quantity: {shopped_item.quantity}\n
-                Price: ${shopped_item.item.price * shopped_item.quantity}\n\n'''
-
-        cart_breakdown = cart_breakdown + f'-----\nTotal Price: ${total_price}'
-        total_price = round(float(total_price) + float(total_price)*0.09025, 2)
-
-    session = stripe.checkout.Session.create(
-        payment_method_types=['card'],
-        line_items=[{
-            'price_data': {
-            'currency': 'usd',
-            'product_data': {
-                'name': 'Bonjour Meal Purchase',
-            },
-            'unit_amount': int(total_price*100),
-            },
-            'quantity': 1,
-        }],
-        mode='payment',
-        success_url=domain+'/bopis/checkout_success?conversation_id='+conv_id,
-        cancel_url=domain+'/bopis/checkout_failure?conversation_id='+conv_id,
-    )
+
+    session = get_checkout_session(conv_id, DOMAIN)
+    if session is None:
+        return HttpResponseBadRequest(MSG_CART_NOW_EMPTY)
     return HttpResponse('{"id":"' + session.id + '"}')
 
 def show_cart_to_checkout(request, conversation_id):
     '''
     Displays the users cart in a webpage before sending them off to payment
-    integration with Stripe.
+    integration with Stripe. Served from the read replica unless the
+    conversation has written recently. Reloads of an unchanged cart get a 304
+    and the cart fragment of the page is cached per cart version.
 
     Args:
         request (HttpRequest): The request object that django passes to the function
     Returns:
         Returns a template filled with contextual data to the request
     '''
+    with conversation_scope(conversation_id), read_replica():
+        response = _render_cart_to_checkout(request, str(conversation_id))
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
-    conv = Conversation.objects.get(id=conversation_id)
-    current_cart = conv.shopping_cart
-    shopped_items = ShoppedItem.objects.filter(cart=current_cart)
-    shopping_cart_dict = {}
-
-    if len(shopped_items) == 0:
-        cart_breakdown = MSG_CART_NOW_EMPTY
-    else:
-        cart_breakdown = "Here's your cart breakdown:\n\n"
-        total_price = 0
-
-        for shopped_item in shopped_items:
-            shopping_cart_dict[shopped_item] = shopped_item.quantity
-            total_price = total_price + shopped_item.item.price * shopped_item.quantity
-            cart_breakdown = cart_breakdown + f'''{shopped_item.item.name}\n
-                Quantity: {shopped_item.quantity}\n
-                Price: ${shopped_item.item.price * shopped_item.quantity}\n\n'''
-
-        cart_breakdown = cart_breakdown + f"-----\nTotal Price: ${total_price}"
-
-        context = {"subtotal": total_price,
-            "items": shopping_cart_dict,
-            "tax": round(float(total_price)*0.09025, 2),
-            "total": round(float(total_price) + float(total_price)*0.09025, 2)
+def _render_cart_to_checkout(request, conversation_id):
+    '''
+    Renders the checkout page for show_cart_to_checkout, or a 304 if the
+    request's ETag or Last-Modified validators match the cart.
+
+    Args:
+        request (HttpRequest): The request object that django passes to the function
+        conversation_id (str): The unique id for this user and agent.
+    Returns:
+        Returns a template filled with contextual data to the request
+    '''
+
+    store = get_cart_store()
+    summary = store.get_summary(conversation_id)
+    shopped_items = get_cart_entries(conversation_id, summary)
+    cart_id = store.get_cart_id(conversation_id)
+    cart_version = get_cart_fingerprint(shopped_items, cart_id, get_tax_rate())
+    last_modified = _get_cart_last_modified(summary, shopped_items)
+    etag = quote_etag(cart_version)
+
+    response = get_conditional_response(request, etag=etag,
+        last_modified=last_modified)
+    if response is None:
+        totals = cart_totals(shopped_items)
+        context = {"subtotal": format_minor_units(totals.subtotal),
+            "items": shopped_items,
+            "tax": format_minor_units(totals.tax),
+            "total": format_minor_units(totals.total),
+            "cart_id": cart_id,
+            "cart_version": cart_version,
+            "fragment_seconds": settings.BOPIS_CHECKOUT_FRAGMENT_SECONDS,
             }
+        with metrics.phase('render'):
+            response = render(request, 'bopis/checkout.html', context)
 
-    return render(request, 'bopis/checkout.html', context)
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+def _get_cart_last_modified(summary, shopped_items):
+    '''
+    Dates the checkout page from stored data, so every instance serves the
+    same Last-Modified: the latest change to the cart or to its items.
+
+    HTTP dates count whole seconds, so a page whose cart changed in the
+    current second gets no Last-Modified. A later change in the same second
+    would otherwise carry the same date and match If-Modified-Since.
+
+    Args:
+        summary (CartSummary): The cart.
+        shopped_items (list): The cart's CartEntry objects.
+    Returns:
+        An :int: timestamp in seconds, or None.
+    '''
+    changes = [summary.modified] + [entry.item.modified_timestamp
+        for entry in shopped_items]
+    if None in changes:
+        return None
+    last_modified = int(max(changes).timestamp())
+    if last_modified >= int(time.time()):
+        return None
+    return last_modified
 
 def checkout_success(request):
     '''
     User has succeeded to checkout and the Stripe callback sends the user to a
-    notice.
+    notice. The purchase is recorded and the user messaged by stripe_webhook,
+    so this page makes no outbound calls.
 
     Args:
         request (HttpRequest): The request object that django passes to the function
@@ -259,29 +391,33 @@ def checkout_success(request):
         Returns a template filled with contextual data to the request
     '''
 
-    conversation_id = request.GET.get("conversation_id")
+    with metrics.phase('render'):
+        return render(request, 'bopis/complete.html')
 
-    message_obj = BusinessMessagesMessage(
-        messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
-        text='''Your payment has been completed and your order is being
-            processed. We'll let you know that we've prepared your order and it
-            is ready for pickup near your scheduled time.''',
-        suggestions=[
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
-                    text=MSG_RESCHEDULE_ORDER,
-                    postbackData=CMD_RESCHEDULE_ORDER)
-                ),
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
-                    text=MSG_CHECK_ORDER_STATUS,
-                    postbackData=CMD_CHECK_ORDER_STATUS)
-                ),
-            ]
-        )
-    send_message(message_obj, conversation_id)
-    return render(request, 'bopis/complete.html')
+@csrf_exempt
+def stripe_webhook(request):
+    '''
+    Receives Stripe events. A checkout.session.completed event records the
+    purchase and queues the payment confirmation message, see
+    bopis/payments.py.
+
+    Args:
+        request (HttpRequest): The request object that django passes to the function
+    Returns:
+        An :HttpResponse: with status code to inform Stripe of receipt.
+    '''
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    try:
+        with metrics.phase('parse'):
+            event = payments.construct_event(request.body,
+                request.META.get('HTTP_STRIPE_SIGNATURE', ''))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid Stripe event.')
+
+    payments.process_event(event)
+    return HttpResponse('Response.')
 
 def checkout_failure(request):
     '''
@@ -295,17 +431,18 @@ def checkout_failure(request):
     '''
 
     conversation_id = request.GET.get("conversation_id")
-    message_obj = BusinessMessagesMessage(
+    message_obj = bm_messages.BusinessMessagesMessage(
         messageId=str(uuid.uuid4().int),
-        representative=BOT_REPRESENTATIVE,
+        representative=get_bot_representative(),
         text=MSG_COULD_NOT_PROCESS,
         suggestions=[
-            BusinessMessagesSuggestion(
-                reply=BusinessMessagesSuggestedReply(
+            bm_messages.BusinessMessagesSuggestion(
+                reply=bm_messages.BusinessMessagesSuggestedReply(
                     text=MSG_TRY_AGAIN,
                     postbackData=CMD_RESET_PICKUP_DETAILS)
                 ),
             ]
         )
     send_message(message_obj, conversation_id)
-    return render(request, 'bopis/complete.html')
+    with metrics.phase('render'):
+        return render(request, 'bopis/complete.html')
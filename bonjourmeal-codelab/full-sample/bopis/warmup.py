@@ -0,0 +1,142 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Warming a process up before it takes traffic. On a cold App Engine instance
+the first webhook would otherwise import the Business Messages, Stripe and
+OAuth client libraries, load the service account credentials and fetch an
+access token, connect to the database, build the URL resolvers, compile the
+templates and read the menus, and the user would wait seconds for a reply.
+The database connection only outlives the warmup where CONN_MAX_AGE keeps
+it open, as settings.py does for MySQL, and then serves the later requests
+of the thread that opened it.
+
+warm_up does all of that in STAGES, logs how long each took and adds the
+timings to the bopis_warmup_seconds histogram of bopis.metrics. App Engine
+calls it through /_ah/warmup on new instances, as app.yaml asks it to, and
+the WSGI and ASGI applications call it when they load with
+BOPIS_WARMUP_ON_STARTUP, for the instances no warmup request reaches. A
+stage that fails is logged and skipped, the instance serves traffic anyway.
+'''
+
+import collections
+import importlib
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template.loader import get_template
+from django.urls import resolve
+
+from . import metrics, sdk
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('imports', 'credentials', 'database', 'urls', 'templates', 'menu')
+
+# Imported by the first webhook otherwise, as are the client libraries in
+# bopis.sdk. bopis.views imports the rest of the app.
+MODULES = ('pytz', 'bopis.views')
+
+TEMPLATES = ('bopis/checkout.html', 'bopis/complete.html')
+
+Stage = collections.namedtuple('Stage', ['name', 'seconds', 'result', 'failed'])
+
+def _import_modules():
+    for module in sdk.MODULES:
+        module.load()
+    for name in MODULES:
+        importlib.import_module(name)
+    return f'{len(sdk.MODULES) + len(MODULES)} modules'
+
+def _load_credentials():
+    if settings.BOPIS_BUSINESS_MESSAGES_URL:
+        return 'skipped, messages go to BOPIS_BUSINESS_MESSAGES_URL'
+    from .view_utils import get_credentials
+    # Fetches the first access token too.
+    get_credentials().get_access_token()
+    return 'access token fetched'
+
+def _connect_databases():
+    # Django closes a connection whose CONN_MAX_AGE is 0 when the request
+    # ends, so opening it early would save the first request nothing.
+    aliases = [alias for alias in connections
+        if connections.databases[alias]['CONN_MAX_AGE']]
+    if not aliases:
+        return 'skipped, CONN_MAX_AGE is 0'
+    for alias in aliases:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+    return ', '.join(aliases)
+
+def _resolve_urls():
+    paths = ['/', *settings.BOPIS_WEBHOOK_PATHS]
+    for path in paths:
+        resolve(path)
+    for path in settings.BOPIS_WEBHOOK_PATHS:
+        resolve(path, settings.BOPIS_WEBHOOK_URLCONF)
+    return f'{len(paths)} paths'
+
+def _compile_templates():
+    for name in TEMPLATES:
+        get_template(name)
+    return f'{len(TEMPLATES)} templates'
+
+def _prime_menus():
+    from apitools.base.py import encoding
+    from .view_utils import get_drink_menu_carousel, get_food_menu_carousel
+    cards = []
+    for carousel in (get_food_menu_carousel(), get_drink_menu_carousel()):
+        # Encoding once builds the encoders of the message classes too.
+        encoding.MessageToJson(carousel)
+        cards.append(len(carousel.cardContents))
+    return f'{cards[0]} dishes, {cards[1]} drinks'
+
+_STAGE_FUNCTIONS = dict(zip(STAGES, (_import_modules, _load_credentials,
+    _connect_databases, _resolve_urls, _compile_templates, _prime_menus)))
+
+def warm_up():
+    '''
+    Runs every warmup stage.
+
+    Returns:
+        A :list: of Stage tuples in STAGES order, with the outcome of each
+        stage, or the error it failed with, as result, and whether it
+        failed.
+    '''
+    stages = []
+    for name in STAGES:
+        started = time.perf_counter()
+        failed = False
+        try:
+            result = _STAGE_FUNCTIONS[name]()
+        except Exception as error:
+            logger.exception('Warmup stage %s failed', name)
+            result = f'failed: {type(error).__name__}: {error}'
+            failed = True
+        seconds = time.perf_counter() - started
+        metrics.record_warmup(name, seconds)
+        stages.append(Stage(name, seconds, result, failed))
+    logger.info('Warmed up in %.3fs: %s', sum(stage.seconds for stage in stages),
+        ', '.join(f'{stage.name} {stage.seconds:.3f}s' for stage in stages))
+    return stages
+
+def warm_up_on_startup():
+    '''
+    Runs warm_up if BOPIS_WARMUP_ON_STARTUP is set. Call it once the WSGI or
+    ASGI application is loaded.
+    '''
+    if settings.BOPIS_WARMUP_ON_STARTUP:
+        warm_up()
@@ -34,6 +34,8 @@ TEST_CONFIG_OVERRIDE = {
     # A dictionary you want to inject into your test. Don't put any
     # secrets here. These values will override predefined values.
     'envs': {
-        'DJANGO_SETTINGS_MODULE': 'bmcodelab.settings'
+        'DJANGO_SETTINGS_MODULE': 'bmcodelab.settings',
+        # The tests run against SQLite, no MySQL server needed.
+        'BOPIS_USE_SQLITE': '1',
     },
 }
@@ -0,0 +1,88 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-memory index of the Bonjour Meal inventory.
+
+The inventory file is parsed once per process and parsed again only when its
+modification time changes, so editing resources/inventory.json takes effect
+without a restart. Lookups by product id and by product name are dict reads.
+"""
+import collections
+import json
+import os
+import threading
+
+INVENTORY_FILE = 'resources/inventory.json'
+
+InventorySnapshot = collections.namedtuple(
+    'InventorySnapshot', ['data', 'items_by_id', 'ids_by_name'])
+
+
+class InventoryIndex(object):
+  """Caches the parsed inventory file and its lookup tables.
+
+  Attributes:
+    path (str): The inventory file backing the index.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+    self._mtime = None
+    self._snapshot = None
+
+  def snapshot(self):
+    """Returns the current inventory, reloading it if the file has changed.
+
+    Callers that look up several products should take one snapshot and use
+    it for every lookup.
+
+    Returns:
+      snapshot (InventorySnapshot): The parsed inventory and its lookup tables.
+    """
+    mtime = os.stat(self.path).st_mtime_ns
+    if mtime != self._mtime:
+      with self._lock:
+        if mtime != self._mtime:
+          self._snapshot = self._load()
+          self._mtime = mtime
+    return self._snapshot
+
+  def _load(self):
+    """Parses the inventory file and builds the lookup tables.
+
+    Returns:
+      snapshot (InventorySnapshot): The freshly parsed inventory.
+    """
+    with open(self.path) as f:
+      data = json.load(f)
+
+    items_by_id = {}
+    ids_by_name = {}
+    for item in data['food']:
+      items_by_id[int(item['id'])] = item
+      ids_by_name[item['name']] = int(item['id'])
+
+    return InventorySnapshot(data, items_by_id, ids_by_name)
+
+
+_index = InventoryIndex(INVENTORY_FILE)
+
+
+def get_inventory():
+  """Returns the current snapshot of the process wide inventory index.
+
+  Returns:
+    snapshot (InventorySnapshot): The parsed inventory and its lookup tables.
+  """
+  return _index.snapshot()
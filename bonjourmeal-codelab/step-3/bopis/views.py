@@ -32,13 +32,13 @@ from businessmessages.businessmessages_v1_messages import (
 
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from google.cloud import datastore
-from google.oauth2 import service_account
 from oauth2client.service_account import ServiceAccountCredentials
 
+from . import cart_store
+from .inventory import get_inventory
+
 # The location of the service account credentials
 SERVICE_ACCOUNT_LOCATION = 'resources/bm-agent-service-account-credentials.json'
-INVENTORY_FILE = 'resources/inventory.json'
 
 # Set of commands the bot understands
 CMD_RICH_CARD = 'card'
@@ -324,22 +324,19 @@ def get_cart_price(conversation_id):
     total_price :float: cart price
   """
   # Pull the data from Google Datastore
-  credentials = service_account.Credentials.from_service_account_file(
-      SERVICE_ACCOUNT_LOCATION)
-  client = datastore.Client(credentials=credentials)
-  key = client.key('ShoppingCart', conversation_id)
-  result = client.get(key)
+  result = cart_store.get_cart(conversation_id)
 
   # Retrieve the inventory data
-  inventory = get_inventory_data()
+  inventory = get_inventory()
 
   # Start off with a total of 0 before adding up the total
   total_price = 0
 
   if len(result.items()) != 0:
     for product_name, quantity in result.items():
+      product_id = inventory.ids_by_name[product_name]
       total_price = total_price + float(
-          inventory['food'][get_id_by_product_name(product_name)]['price']) * int(quantity)
+          inventory.items_by_id[product_id]['price']) * int(quantity)
 
   return total_price
 
@@ -363,12 +360,12 @@ def send_shopping_cart_total_price(conversation_id):
 def get_inventory_data():
   """Retrieves data from inventory.json.
 
+  The file is parsed once and reloaded only when it changes on disk.
+
   Returns:
     inventory (dict): returns data from inventory.json as dictionary
   """
-  f = open(INVENTORY_FILE)
-  inventory = json.load(f)
-  return inventory
+  return get_inventory().data
 
 
 def get_id_by_product_name(product_name):
@@ -380,11 +377,7 @@ def get_id_by_product_name(product_name):
   Returns:
     product_id (int): The id of the product found in inventory.json
   """
-  inventory = get_inventory_data()
-  for item in inventory['food']:
-    if item['name'] == product_name:
-      return int(item['id'])
-  return False
+  return get_inventory().ids_by_name.get(product_name, False)
 
 def get_menu_carousel():
   """Creates a sample carousel rich card.
@@ -393,11 +386,11 @@ def get_menu_carousel():
       A :obj: A BusinessMessagesCarouselCard object with three cards.
   """
 
-  inventory = get_inventory_data()
+  inventory = get_inventory()
 
   card_content = []
 
-  for item in inventory['food']:
+  for item in inventory.items_by_id.values():
     card_content.append(
         BusinessMessagesCardContent(
             title=item['name'],
@@ -456,51 +449,26 @@ def send_product_catalog(conversation_id):
 def update_shopping_cart(conversation_id, message):
   """Updates the shopping cart stored in Google Datastore.
 
+  The change is applied in a Datastore transaction so concurrent updates to
+  the same cart are not lost.
+
   Args:
     conversation_id (str): The unique id for this user and agent.
     message (str): The message containing whether to add or delete an item.
   """
-  credentials = service_account.Credentials.from_service_account_file(
-      SERVICE_ACCOUNT_LOCATION)
-
-  inventory = get_inventory_data()
+  inventory = get_inventory()
 
   cart_request = json.loads(message)
   cart_cmd = cart_request["action"]
   cart_item = cart_request["item_name"]
 
-  item_name = inventory['food'][int(cart_item)]['name']
+  item_name = inventory.items_by_id[int(cart_item)]['name']
 
-  client = datastore.Client(credentials=credentials)
-  key = client.key('ShoppingCart', conversation_id)
-  entity = datastore.Entity(key=key)
-  result = client.get(key)
-
-  if result is None:
-    if cart_cmd == CMD_ADD_ITEM:
-      entity.update({item_name: 1})
-    elif cart_cmd == CMD_DEL_ITEM:
-      # The user is trying to delete an item from an empty cart. Pass and skip
-      pass
-  else:
-    if cart_cmd == CMD_ADD_ITEM:
-      if result.get(item_name) is None:
-        result[item_name] = 1
-      else:
-        result[item_name] = result[item_name] + 1
-
-    elif cart_cmd == CMD_DEL_ITEM:
-      if result.get(item_name) is None:
-        # The user is trying to remove an item that's no in the shopping cart.
-        # Pass and skip
-        pass
-      elif result[item_name] - 1 > 0:
-        result[item_name] = result[item_name] - 1
-      else:
-        del result[item_name]
-
-    entity.update(result)
-  client.put(entity)
+  if cart_cmd == CMD_ADD_ITEM:
+    cart_store.update_cart(conversation_id, item_name, 1)
+  elif cart_cmd == CMD_DEL_ITEM:
+    # Removing an item that is not in the cart leaves the cart unchanged.
+    cart_store.update_cart(conversation_id, item_name, -1)
 
   if cart_cmd == CMD_ADD_ITEM:
     message = 'Great! You\'ve added an item to the cart.'
@@ -530,16 +498,11 @@ def send_shopping_cart(conversation_id):
   Args:
     conversation_id (str): The unique id for this user and agent.
   """
-  credentials = service_account.Credentials.from_service_account_file(
-      SERVICE_ACCOUNT_LOCATION)
-
   # Retrieve the inventory data
-  inventory = get_inventory_data()
+  inventory = get_inventory()
 
   # Pull the data from Google Datastore
-  client = datastore.Client(credentials=credentials)
-  key = client.key('ShoppingCart', conversation_id)
-  result = client.get(key)
+  result = cart_store.get_cart(conversation_id)
 
   shopping_cart_suggestions = [
       BusinessMessagesSuggestion(
@@ -564,7 +527,7 @@ def send_shopping_cart(conversation_id):
   elif len(result.items()) == 1:
 
     for product_name, quantity in result.items():
-      product_id = get_id_by_product_name(product_name)
+      product_id = inventory.ids_by_name[product_name]
 
       fallback_text = ('You have one type of item in the shopping cart')
 
@@ -582,7 +545,7 @@ def send_shopping_cart(conversation_id):
                   media=BusinessMessagesMedia(
                       height=BusinessMessagesMedia.HeightValueValuesEnum.MEDIUM,
                       contentInfo=BusinessMessagesContentInfo(
-                          fileUrl=inventory['food'][product_id]
+                          fileUrl=inventory.items_by_id[product_id]
                           ['image_url'],
                           forceRefresh=False)))))
 
@@ -599,7 +562,7 @@ def send_shopping_cart(conversation_id):
 
     # Iterate through the cart and generate a carousel of items
     for product_name, quantity in result.items():
-      product_id = get_id_by_product_name(product_name)
+      product_id = inventory.ids_by_name[product_name]
 
       cart_carousel_items.append(
           BusinessMessagesCardContent(
@@ -614,7 +577,7 @@ def send_shopping_cart(conversation_id):
               media=BusinessMessagesMedia(
                   height=BusinessMessagesMedia.HeightValueValuesEnum.MEDIUM,
                   contentInfo=BusinessMessagesContentInfo(
-                      fileUrl=inventory['food'][product_id]
+                      fileUrl=inventory.items_by_id[product_id]
                       ['image_url'],
                       forceRefresh=False))))
 
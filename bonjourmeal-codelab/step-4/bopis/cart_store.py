@@ -0,0 +1,171 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shopping carts stored in Google Datastore.
+
+A single datastore.Client is shared by the whole process, so credentials are
+loaded and the channel is opened once. Cart updates run inside Datastore
+transactions so concurrent increments are not lost, and the *_carts helpers
+batch bulk work such as abandoned cart sweeps into get_multi/put_multi calls.
+"""
+import os
+import random
+import threading
+import time
+
+from google.api_core import exceptions
+from google.cloud import datastore
+from google.oauth2 import service_account
+
+# The location of the service account credentials
+SERVICE_ACCOUNT_LOCATION = 'resources/bm-agent-service-account-credentials.json'
+CART_KIND = 'ShoppingCart'
+
+# Datastore accepts at most 1000 keys per lookup and 500 mutations per commit.
+GET_BATCH_SIZE = 1000
+PUT_BATCH_SIZE = 500
+
+# Attempts made before a contended cart update gives up, and the longest
+# random wait before the first retry. The wait doubles on every retry so
+# contending requests spread out instead of colliding again.
+MAX_TRANSACTION_ATTEMPTS = 10
+TRANSACTION_BACKOFF_SECONDS = 0.01
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+  """Returns the process wide Datastore client, creating it on first use.
+
+  When DATASTORE_EMULATOR_HOST is set the client talks to the emulator and
+  no service account is loaded.
+
+  Returns:
+    client (datastore.Client): The shared client.
+  """
+  global _client
+  if _client is None:
+    with _client_lock:
+      if _client is None:
+        if os.environ.get('DATASTORE_EMULATOR_HOST'):
+          _client = datastore.Client()
+        else:
+          credentials = service_account.Credentials.from_service_account_file(
+              SERVICE_ACCOUNT_LOCATION)
+          _client = datastore.Client(credentials=credentials)
+  return _client
+
+
+def set_client(client):
+  """Replaces the shared client, e.g. with an in-memory stand-in.
+
+  Args:
+    client: An object implementing the datastore.Client methods used here.
+  """
+  global _client
+  with _client_lock:
+    _client = client
+
+
+def get_cart(conversation_id):
+  """Retrieves the shopping cart of a conversation.
+
+  Args:
+    conversation_id (str): The unique id for this user and agent.
+
+  Returns:
+    cart (datastore.Entity): Quantities keyed by product name, empty if the
+      conversation has no cart yet.
+  """
+  client = get_client()
+  key = client.key(CART_KIND, conversation_id)
+  return client.get(key) or datastore.Entity(key=key)
+
+
+def update_cart(conversation_id, product_name, delta):
+  """Atomically changes the quantity of a product in a cart.
+
+  The read and the write happen in one Datastore transaction, which is
+  retried if another request updated the same cart concurrently.
+
+  Args:
+    conversation_id (str): The unique id for this user and agent.
+    product_name (str): The name of the product to change.
+    delta (int): How many units to add, negative to remove.
+
+  Returns:
+    cart (datastore.Entity): The cart as written.
+  """
+  client = get_client()
+  key = client.key(CART_KIND, conversation_id)
+
+  for attempt in range(MAX_TRANSACTION_ATTEMPTS):
+    try:
+      with client.transaction():
+        cart = client.get(key) or datastore.Entity(key=key)
+        quantity = cart.get(product_name, 0) + delta
+        if quantity > 0:
+          cart[product_name] = quantity
+        elif product_name in cart:
+          del cart[product_name]
+        client.put(cart)
+      return cart
+    except (exceptions.Aborted, exceptions.Conflict):
+      if attempt == MAX_TRANSACTION_ATTEMPTS - 1:
+        raise
+      time.sleep(random.uniform(0, TRANSACTION_BACKOFF_SECONDS * 2 ** attempt))
+
+
+def get_carts(conversation_ids):
+  """Retrieves many shopping carts with batched lookups.
+
+  Args:
+    conversation_ids (list): The conversations whose carts to fetch.
+
+  Returns:
+    carts (dict): Cart entities keyed by conversation id. Conversations
+      without a cart are left out.
+  """
+  client = get_client()
+  carts = {}
+  for i in range(0, len(conversation_ids), GET_BATCH_SIZE):
+    keys = [client.key(CART_KIND, conversation_id)
+            for conversation_id in conversation_ids[i:i + GET_BATCH_SIZE]]
+    for cart in client.get_multi(keys):
+      carts[cart.key.name] = cart
+  return carts
+
+
+def put_carts(carts):
+  """Writes many shopping carts with batched commits.
+
+  Args:
+    carts (list): The cart entities to write.
+  """
+  client = get_client()
+  for i in range(0, len(carts), PUT_BATCH_SIZE):
+    client.put_multi(carts[i:i + PUT_BATCH_SIZE])
+
+
+def delete_carts(conversation_ids):
+  """Deletes many shopping carts with batched commits.
+
+  Args:
+    conversation_ids (list): The conversations whose carts to delete.
+  """
+  client = get_client()
+  for i in range(0, len(conversation_ids), PUT_BATCH_SIZE):
+    client.delete_multi([
+        client.key(CART_KIND, conversation_id)
+        for conversation_id in conversation_ids[i:i + PUT_BATCH_SIZE]])
@@ -0,0 +1,203 @@
+# Copyright 2020 Google LLC. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+A management command to benchmark the Datastore cart store. Runs against the
+Datastore emulator when DATASTORE_EMULATOR_HOST is set, otherwise against an
+in-memory stand-in that charges a fixed latency per RPC.
+'''
+
+import contextlib
+import os
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from google.api_core import exceptions
+from google.cloud import datastore
+from bopis import cart_store
+
+class InMemoryClient:
+    '''
+    Implements the subset of datastore.Client used by bopis.cart_store on top
+    of a dict. Every call that would be an RPC sleeps for the given latency.
+    Like Datastore, transactions are optimistic: a commit fails with Conflict
+    when an entity the transaction read was written since.
+    '''
+
+    def __init__(self, latency):
+        self.project = 'bench'
+        self._latency = latency
+        self._entities = {}
+        self._versions = {}
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def _rpc(self):
+        if self._latency:
+            time.sleep(self._latency)
+
+    @staticmethod
+    def _copy(entity):
+        copied = datastore.Entity(key=entity.key)
+        copied.update(entity)
+        return copied
+
+    def key(self, *path):
+        return datastore.Key(*path, project=self.project)
+
+    def get(self, key):
+        self._rpc()
+        with self._lock:
+            entity = self._entities.get(key.flat_path)
+            read = getattr(self._local, 'read', None)
+            if read is not None:
+                read.setdefault(key.flat_path, self._versions.get(key.flat_path, 0))
+            return self._copy(entity) if entity is not None else None
+
+    def get_multi(self, keys):
+        self._rpc()
+        return [self._copy(self._entities[key.flat_path])
+            for key in keys if key.flat_path in self._entities]
+
+    def put(self, entity):
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.append(self._copy(entity))
+        else:
+            self.put_multi([entity])
+
+    def put_multi(self, entities):
+        self._rpc()
+        with self._lock:
+            for entity in entities:
+                self._write(entity.key.flat_path, self._copy(entity))
+
+    def delete_multi(self, keys):
+        self._rpc()
+        with self._lock:
+            for key in keys:
+                self._write(key.flat_path, None)
+
+    def _write(self, path, entity):
+        if entity is None:
+            self._entities.pop(path, None)
+        else:
+            self._entities[path] = entity
+        self._versions[path] = self._versions.get(path, 0) + 1
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self._rpc()
+        self._local.pending = []
+        self._local.read = {}
+        try:
+            yield
+            self._rpc()
+            with self._lock:
+                if any(self._versions.get(path, 0) != version
+                        for path, version in self._local.read.items()):
+                    raise exceptions.Conflict('too much contention on these '
+                        'datastore entities, please try again')
+                for entity in self._local.pending:
+                    self._write(entity.key.flat_path, entity)
+        finally:
+            self._local.pending = None
+            self._local.read = None
+
+class Command(BaseCommand):
+    '''
+    Times single and batched cart operations and checks that concurrent
+    increments of one cart are not lost.
+    '''
+    help = 'Benchmarks the Datastore shopping cart store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=200,
+            help='Number of carts to create and read.')
+        parser.add_argument('--threads', type=int, default=8,
+            help='Threads incrementing the same cart concurrently.')
+        parser.add_argument('--latency-ms', type=float, default=2.0,
+            help='Simulated RPC latency of the in-memory stand-in.')
+
+    def handle(self, *args, **options):
+
+        if os.environ.get('DATASTORE_EMULATOR_HOST'):
+            backend = f"emulator at {os.environ['DATASTORE_EMULATOR_HOST']}"
+        else:
+            backend = f"in-memory stand-in ({options['latency_ms']}ms per RPC)"
+            cart_store.set_client(InMemoryClient(options['latency_ms'] / 1000))
+        self.stdout.write(f'Benchmarking cart store against the {backend}')
+
+        prefix = f'bench-{uuid.uuid4().hex}'
+        conversation_ids = [f'{prefix}-{i}' for i in range(options['carts'])]
+        client = cart_store.get_client()
+
+        def update_each():
+            for conversation_id in conversation_ids:
+                cart_store.update_cart(conversation_id, 'Chicken veggie wrap', 1)
+
+        def get_each():
+            for conversation_id in conversation_ids:
+                cart_store.get_cart(conversation_id)
+
+        def put_each(carts):
+            for cart in carts:
+                client.put(cart)
+
+        self._report('update_cart (transactional)', len(conversation_ids),
+            update_each)
+        self._report('get_cart (one RPC per cart)', len(conversation_ids),
+            get_each)
+        carts = []
+        self._report('get_carts (batched)', len(conversation_ids),
+            lambda: carts.extend(cart_store.get_carts(conversation_ids).values()))
+        self._report('put (one RPC per cart)', len(carts),
+            lambda: put_each(carts))
+        self._report('put_carts (batched)', len(carts),
+            lambda: cart_store.put_carts(carts))
+
+        contended_id = f'{prefix}-contended'
+        increments = 10
+
+        def increment_concurrently():
+            def increment():
+                for _ in range(increments):
+                    cart_store.update_cart(contended_id, 'Apple walnut salad', 1)
+            threads = [threading.Thread(target=increment)
+                for _ in range(options['threads'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        expected = increments * options['threads']
+        self._report('update_cart (same cart, concurrent)', expected,
+            increment_concurrently)
+
+        actual = cart_store.get_cart(contended_id).get('Apple walnut salad', 0)
+        cart_store.delete_carts(conversation_ids + [contended_id])
+        if actual != expected:
+            raise CommandError(
+                f'Lost updates: expected quantity {expected}, found {actual}')
+        self.stdout.write(f"No lost updates across {options['threads']} threads.")
+
+    def _report(self, name, operations, run):
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        ops_per_second = operations / elapsed if elapsed else float('inf')
+        self.stdout.write(
+            f'{name:40} {operations:6} ops {elapsed * 1000:10.1f}ms {ops_per_second:10.1f} ops/s')